@@ -0,0 +1,67 @@
+import logging
+from typing import Dict, Any, Callable, Optional
+
+from telegram import Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
+
+from timing_wheel import TimingWheel
+
+logger = logging.getLogger(__name__)
+
+# Telegram delivers the parts of an album as separate updates within a
+# fraction of a second; wait this long after the last part before relaying
+ALBUM_WINDOW = 0.6
+# Telegram allows at most 10 items in one media group
+ALBUM_MAX_ITEMS = 10
+
+def to_input_media(message: Message, caption: Optional[str] = None, parse_mode: Optional[str] = None):
+    """Build the InputMedia item that re-sends an album part."""
+    if caption is None:
+        caption = message.caption
+    if message.photo:
+        return InputMediaPhoto(message.photo[-1].file_id, caption=caption, parse_mode=parse_mode)
+    if message.video:
+        return InputMediaVideo(message.video.file_id, caption=caption, parse_mode=parse_mode)
+    if message.document:
+        return InputMediaDocument(message.document.file_id, caption=caption, parse_mode=parse_mode)
+    if message.audio:
+        return InputMediaAudio(message.audio.file_id, caption=caption, parse_mode=parse_mode)
+    return None
+
+class AlbumCollector:
+    """Collects the parts of albums by media_group_id.
+
+    Each new part restarts the album's timer on the wheel; when it fires the
+    callback gets all parts at once, sorted by message ID.
+    """
+
+    def __init__(self, wheel: TimingWheel, window: float = ALBUM_WINDOW):
+        self.wheel = wheel
+        self.window = window
+        # media_group_id -> {"messages": [...], "timer": Timer, "callback": ..., "args": ...}
+        self.pending: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, message: Message, callback: Callable, *args) -> None:
+        """Buffer an album part; `callback(messages, *args)` runs once the album is complete."""
+        group_id = message.media_group_id
+        album = self.pending.get(group_id)
+        if album is None:
+            album = self.pending[group_id] = {"messages": [], "timer": None, "callback": callback, "args": args}
+        else:
+            album["timer"].cancel()
+        album["messages"].append(message)
+
+        if len(album["messages"]) >= ALBUM_MAX_ITEMS:
+            album["timer"] = self.wheel.call_later(0, self.flush, group_id)
+        else:
+            album["timer"] = self.wheel.call_later(self.window, self.flush, group_id)
+
+    def flush(self, group_id: str):
+        """Hand a buffered album to its callback."""
+        album = self.pending.pop(group_id, None)
+        if album is None:
+            return None
+        messages = sorted(album["messages"], key=lambda message: message.message_id)
+        return album["callback"](messages, *album["args"])
+
+    def __len__(self) -> int:
+        return len(self.pending)
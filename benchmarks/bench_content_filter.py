@@ -0,0 +1,67 @@
+"""Measure content filter build time and per-message scan cost.
+
+Usage: python benchmarks/bench_content_filter.py [--patterns 1000 10000] [--messages 20000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from content_filter import Automaton
+
+ALPHABET = "абвгдеёжзийклмнопрстуфхцчшщъыьэюяabcdefghijklmnopqrstuvwxyz"
+
+def make_patterns(count: int, rng: random.Random) -> list:
+    """Random words of 3-10 letters, standing in for a real word list."""
+    return ["".join(rng.choice(ALPHABET) for _ in range(rng.randint(3, 10))) for _ in range(count)]
+
+def make_messages(count: int, patterns: list, rng: random.Random) -> list:
+    """Chat-like messages of 5-60 words; about one in ten contains a banned word."""
+    messages = []
+    for _ in range(count):
+        words = ["".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 9))) for _ in range(rng.randint(5, 60))]
+        if rng.random() < 0.1:
+            words[rng.randrange(len(words))] = rng.choice(patterns).upper()
+        messages.append(" ".join(words))
+    return messages
+
+def run(pattern_count: int, message_count: int) -> None:
+    rng = random.Random(42)
+    patterns = make_patterns(pattern_count, rng)
+    messages = make_messages(message_count, patterns, rng)
+
+    started = time.perf_counter()
+    automaton = Automaton(patterns)
+    build_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matched = sum(1 for message in messages if automaton.find(message))
+    scan_time = time.perf_counter() - started
+
+    # Naive baseline: one substring search per pattern
+    sample = messages[:max(1, message_count // 100)]
+    started = time.perf_counter()
+    for message in sample:
+        lowered = message.lower()
+        any(pattern in lowered for pattern in patterns)
+    naive_time = (time.perf_counter() - started) / len(sample)
+
+    chars = sum(len(message) for message in messages)
+    print(f"{pattern_count} patterns: build {build_time * 1000:.0f} ms, {len(automaton.goto)} states")
+    print(f"  scan: {scan_time / message_count * 1e6:.1f} us/message "
+          f"({chars / message_count:.0f} chars avg), {matched} of {message_count} matched")
+    print(f"  naive substring loop: {naive_time * 1e6:.1f} us/message")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--patterns", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+    for count in args.patterns:
+        run(count, args.messages)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compare memory used by dict profiles and slotted records.
+
+Usage: python benchmarks/bench_records.py [--users N]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import records
+
+def make_profiles(count: int) -> dict:
+    """Generate profiles in the user_data.json shape."""
+    rng = random.Random(42)
+    data = {}
+    for i in range(count):
+        user_id = str(100000000 + i * 7)
+        data[user_id] = {
+            "gender": rng.choice([None, "male", "female"]),
+            "age": rng.choice([None] + list(range(16, 60))),
+            "interests": rng.choice([[], ["flirt"], ["chat"], ["flirt", "chat"]]),
+            "chat_count": rng.randint(0, 500),
+            "rating": rng.randint(-20, 50),
+            "rating_count": rng.randint(0, 80),
+            "join_date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00",
+        }
+    return data
+
+def make_searches(count: int) -> dict:
+    """Generate search entries in the searching_users.json shape."""
+    now = time.time()
+    return {
+        str(100000000 + i * 7): {
+            "start_time": now - i % 120,
+            "message_id": 1000 + i,
+            "chat_id": 100000000 + i * 7,
+            "gender": "male" if i % 2 else "female",
+            "age": 18 + i % 40,
+        }
+        for i in range(count)
+    }
+
+def measure(build) -> tuple:
+    """Return (bytes allocated, seconds) for building one structure."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200000)
+    args = parser.parse_args()
+
+    profiles = make_profiles(args.users)
+    searches = make_searches(args.users)
+    json_profiles = json.dumps(profiles)
+    json_searches = json.dumps(searches)
+
+    cases = [
+        ("profiles as dicts", lambda: json.loads(json_profiles)),
+        ("profiles as records", lambda: records.profiles_from_json(json.loads(json_profiles))),
+        ("searches as dicts", lambda: json.loads(json_searches)),
+        ("searches as records", lambda: records.searches_from_json(json.loads(json_searches))),
+    ]
+
+    print(f"{args.users} users")
+    for name, build in cases:
+        result, size, elapsed = measure(build)
+        print(f"{name:22s} {size / 1024 / 1024:8.1f} MB  {size / args.users:6.0f} B/user  {elapsed:6.2f}s")
+        del result
+
+    # Round trip must reproduce the JSON shape exactly
+    assert records.profiles_to_json(records.profiles_from_json(profiles)) == profiles
+    assert records.searches_to_json(records.searches_from_json(searches)) == searches
+    print("round trip: ok")
+
+if __name__ == "__main__":
+    main()
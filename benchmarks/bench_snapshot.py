@@ -0,0 +1,102 @@
+"""Compare load/save time and file size of snapshot formats.
+
+Usage: python benchmarks/bench_snapshot.py [--users 100000 1000000]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot
+
+def make_state(count: int) -> dict:
+    """Generate users, chats and searches in the shape the database module uses."""
+    rng = random.Random(42)
+    now = time.time()
+    users = {}
+    for i in range(count):
+        user_id = 100000000 + i * 7
+        users[user_id] = {
+            "gender": rng.choice([None, "male", "female"]),
+            "age": rng.choice([None] + list(range(16, 60))),
+            "interests": rng.choice([[], ["flirt"], ["chat"], ["flirt", "chat"]]),
+            "chat_count": rng.randint(0, 500),
+            "rating": rng.randint(-20, 50),
+            "rating_count": rng.randint(0, 80),
+            "join_date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:00:00",
+        }
+    ids = list(users)
+    chats = {}
+    for i in range(0, count // 10, 2):
+        chats[ids[i]] = ids[i + 1]
+        chats[ids[i + 1]] = ids[i]
+    searches = {
+        user_id: {"start_time": now, "message_id": 1000 + i, "chat_id": user_id,
+                  "gender": users[user_id]["gender"], "age": users[user_id]["age"]}
+        for i, user_id in enumerate(ids[count // 10:count // 10 + count // 100])
+    }
+    return {"users": users, "active_chats": chats, "searching_users": searches}
+
+def legacy_save(path: str, state: dict) -> None:
+    """What the database module used to do: stdlib json with indent=4."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({name: {str(k): v for k, v in table.items()} for name, table in state.items()},
+                  f, ensure_ascii=False, indent=4)
+
+def legacy_load(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return {name: {int(k): v for k, v in table.items()} for name, table in json.load(f).items()}
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+def run(count: int, directory: str) -> None:
+    state = make_state(count)
+    cases = [("json indent=4 (old)", legacy_save, legacy_load)]
+
+    def stdlib_json(path, data):
+        orjson, snapshot.orjson = snapshot.orjson, None
+        try:
+            snapshot.save_snapshot(path, data, "json")
+        finally:
+            snapshot.orjson = orjson
+
+    def stdlib_json_load(path):
+        orjson, snapshot.orjson = snapshot.orjson, None
+        try:
+            return snapshot.load_snapshot(path)
+        finally:
+            snapshot.orjson = orjson
+
+    cases.append(("json compact (stdlib)", stdlib_json, stdlib_json_load))
+    if snapshot.orjson is not None:
+        cases.append(("json compact (orjson)", lambda p, d: snapshot.save_snapshot(p, d, "json"), snapshot.load_snapshot))
+    cases.append(("binary", lambda p, d: snapshot.save_snapshot(p, d, "binary"), snapshot.load_snapshot))
+
+    print(f"\n{count} users, {len(state['active_chats'])} chat entries, {len(state['searching_users'])} searches")
+    print(f"{'format':24s} {'size MB':>9s} {'save s':>8s} {'load s':>8s}")
+    for name, save, load in cases:
+        path = os.path.join(directory, name.split()[0] + ".snap")
+        _, save_time = timed(save, path, state)
+        loaded, load_time = timed(load, path)
+        assert loaded == state, f"{name} did not round-trip"
+        print(f"{name:24s} {os.path.getsize(path) / 1024 / 1024:9.1f} {save_time:8.2f} {load_time:8.2f}")
+        os.remove(path)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+", default=[100000, 1000000])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.users:
+            run(count, directory)
+
+if __name__ == "__main__":
+    main()
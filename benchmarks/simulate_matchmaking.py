@@ -0,0 +1,193 @@
+"""Run the matchmaking logic against a synthetic stream of searchers on a virtual clock.
+
+Users arrive as a Poisson stream and search the way the bot does: a match
+attempt right away and every --retry seconds after, until matched or
+--timeout. Some users come back for another search after their chat ends.
+Everything runs on a TimingWheel driven by a virtual clock, so a day of
+traffic takes seconds.
+
+Usage: python benchmarks/simulate_matchmaking.py [--users 100000] [--rate 5]
+       [--male 0.45] [--female 0.35] [--age-known 0.7] [--interests flirt=0.4,chat=0.6]
+       [--low-tier 0.05] [--timeout 120] [--retry 0.5] [--random-pick 0.3] [--seed 42]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matchmaking
+from timing_wheel import TimingWheel
+
+# Same as SEARCH_TIMEOUT and SEARCH_RETRY_INTERVAL in bot.py
+DEFAULT_TIMEOUT = 120
+DEFAULT_RETRY = 0.5
+
+def percentile(values: list, share: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+class Simulation:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.interests = {name: float(share) for name, share in
+                          (item.split("=") for item in args.interests.split(",") if item)}
+
+        self.now = 0.0
+        self.wheel = TimingWheel(tick=0.1, clock=lambda: self.now)
+        self.index = matchmaking.SearchIndex()
+        self.recent = matchmaking.RecentPairs()
+        self.profiles = {}
+        # user_id -> (retry timer, timeout timer)
+        self.timers = {}
+
+        self.arrived = 0
+        # Users that will still search again: not yet arrived, searching or chatting
+        self.outstanding = args.users
+        self.searches = 0
+        self.matched = 0
+        self.timeouts = 0
+        self.waits = []
+        self.scores = Counter()
+        self.attempts = 0
+        self.match_cpu = 0.0
+
+    def make_profile(self) -> dict:
+        rng, args = self.rng, self.args
+        roll = rng.random()
+        gender = "male" if roll < args.male else "female" if roll < args.male + args.female else None
+        age = None
+        if rng.random() < args.age_known:
+            age = max(14, min(80, int(rng.gauss(args.age_mean, args.age_sd))))
+        interests = [name for name, share in self.interests.items() if rng.random() < share]
+        return {
+            "gender": gender,
+            "age": age,
+            "tier": matchmaking.TIER_LOW if rng.random() < args.low_tier else matchmaking.TIER_NORMAL,
+            "interests": matchmaking.interest_mask(interests)
+        }
+
+    def arrive(self) -> None:
+        user_id = self.arrived
+        self.arrived += 1
+        if self.arrived < self.args.users:
+            self.wheel.call_later(self.rng.expovariate(self.args.rate), self.arrive)
+        self.profiles[user_id] = self.make_profile()
+        self.start_search(user_id)
+
+    def start_search(self, user_id: int) -> None:
+        self.searches += 1
+        entry = dict(self.profiles[user_id], start_time=self.now)
+        self.index.add(user_id, entry)
+        self.timers[user_id] = (
+            self.wheel.call_later(0, self.step, user_id),
+            self.wheel.call_later(self.args.timeout, self.expire, user_id)
+        )
+
+    def stop_search(self, user_id: int) -> None:
+        self.index.remove(user_id)
+        for timer in self.timers.pop(user_id):
+            timer.cancel()
+
+    def step(self, user_id: int) -> None:
+        entry = self.index.get(user_id)
+        if entry is None:
+            return
+        self.attempts += 1
+        started = time.process_time()
+        match = matchmaking.pick_partner(user_id, entry, self.index.candidates(entry), self.now,
+                                         rng=self.rng, recent=self.recent,
+                                         waited=self.now - entry["start_time"])
+        self.match_cpu += time.process_time() - started
+
+        if match is None:
+            self.timers[user_id] = (self.wheel.call_later(self.args.retry, self.step, user_id),
+                                    self.timers[user_id][1])
+            return
+
+        partner_id, score = match
+        partner = self.index.get(partner_id)
+        self.waits.append(self.now - entry["start_time"])
+        self.waits.append(self.now - partner["start_time"])
+        self.scores[score] += 1
+        self.matched += 2
+        self.stop_search(user_id)
+        self.stop_search(partner_id)
+        self.recent.add(user_id, partner_id, self.now)
+        chat_length = self.rng.expovariate(1 / self.args.chat_length)
+        for other_id in (user_id, partner_id):
+            self.wheel.call_later(chat_length, self.leave_chat, other_id)
+
+    def expire(self, user_id: int) -> None:
+        self.timeouts += 1
+        self.stop_search(user_id)
+        self.finish(user_id)
+
+    def leave_chat(self, user_id: int) -> None:
+        self.finish(user_id)
+
+    def finish(self, user_id: int) -> None:
+        """Search again or leave for good."""
+        if self.rng.random() < self.args.requeue:
+            self.start_search(user_id)
+        else:
+            self.outstanding -= 1
+
+    def run(self) -> float:
+        started = time.perf_counter()
+        self.wheel.call_later(0, self.arrive)
+        tick = 0
+        while self.outstanding:
+            tick += 1
+            self.now = tick * self.wheel.tick
+            # Half a tick of slack keeps float rounding from holding the wheel back
+            self.wheel.advance_to(self.now + self.wheel.tick / 2)
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> None:
+        waits = sorted(self.waits)
+        total_scores = sum(self.scores.values())
+        print(f"{self.args.users} users, {self.searches} searches over {self.now / 3600:.1f} simulated hours "
+              f"({elapsed:.1f} s wall)")
+        print(f"  matched: {self.matched / max(1, self.searches):.1%}, timed out: {self.timeouts / max(1, self.searches):.1%}")
+        print(f"  wait p50 {percentile(waits, 0.5):.1f} s, p90 {percentile(waits, 0.9):.1f} s, "
+              f"p99 {percentile(waits, 0.99):.1f} s, max {percentile(waits, 1.0):.1f} s")
+        print("  score distribution: " + ", ".join(
+            f"{score}: {count / total_scores:.1%}" for score, count in sorted(self.scores.items())))
+        print(f"  match attempts: {self.attempts}, CPU per match: "
+              f"{self.match_cpu / max(1, total_scores) * 1e6:.1f} us, per attempt: {self.match_cpu / max(1, self.attempts) * 1e6:.1f} us")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=5.0, help="new users per second")
+    parser.add_argument("--male", type=float, default=0.45, help="share of users who set male")
+    parser.add_argument("--female", type=float, default=0.35, help="share of users who set female")
+    parser.add_argument("--age-known", type=float, default=0.7, help="share of users who set an age")
+    parser.add_argument("--age-mean", type=float, default=24)
+    parser.add_argument("--age-sd", type=float, default=6)
+    parser.add_argument("--interests", default="flirt=0.4,chat=0.6", help="share of users per interest")
+    parser.add_argument("--low-tier", type=float, default=0.05, help="share of low-reputation users")
+    parser.add_argument("--requeue", type=float, default=0.5, help="chance to search again after a chat")
+    parser.add_argument("--chat-length", type=float, default=180, help="mean chat length in seconds")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument("--retry", type=float, default=DEFAULT_RETRY)
+    parser.add_argument("--random-pick", type=float, default=matchmaking.RANDOM_PICK_CHANCE)
+    parser.add_argument("--interest-weight", type=int, default=matchmaking.INTEREST_WEIGHT)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # Scoring knobs are module settings read on every match
+    matchmaking.RANDOM_PICK_CHANCE = args.random_pick
+    matchmaking.INTEREST_WEIGHT = args.interest_weight
+
+    simulation = Simulation(args)
+    simulation.report(simulation.run())
+
+if __name__ == "__main__":
+    main()
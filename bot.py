@@ -7,13 +7,29 @@ import datetime
 import random
 import logging
 import string
-from typing import Dict, Any, List, Optional
+import signal
+import multiprocessing
+from typing import Dict, Any, List, Optional, Set, Tuple
+from collections import OrderedDict
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, InputFile
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes, ConversationHandler
+from telegram.constants import ChatAction
+from telegram.ext import Application, CallbackContext, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler, ApplicationHandlerStop, filters, ContextTypes, ConversationHandler
 import telegram
 from dotenv import load_dotenv
 
 import database as db
+import sharding
+import outbound
+import msgmap
+import albums
+import flood
+import content_filter
+import moderation
+import matchmaking
+import ratings
+import waitstats
+from media_blocklist import MediaBlocklist
+from timing_wheel import TimingWheel, Timer
 
 # Load environment variables from .env file if it exists
 load_dotenv()
@@ -35,6 +51,78 @@ searching_users = {}
 group_chats = {}
 GROUP_MAX_MEMBERS = 10
 
+# Connection to the coordinator when running as one of several sharded workers
+coordinator: Optional[sharding.CoordinatorClient] = None
+
+# One wheel drives every timer: search retries, timeouts and timer-message
+# refreshes, group idle expiry and resuming chats paused by flood control
+wheel = TimingWheel(tick=0.1)
+outbox = outbound.Outbound(wheel)
+
+# Search timers by user ID: {"retry": Timer, "refresh": Timer, "timeout": Timer}
+search_timers: Dict[int, Dict[str, Timer]] = {}
+SEARCH_TIMEOUT = 120
+SEARCH_RETRY_INTERVAL = 0.5
+SEARCH_REFRESH_INTERVAL = 2
+# Searching users bucketed by reputation pool, kept in step with searching_users
+search_index = matchmaking.SearchIndex()
+# Recent match wait times per (gender, age band), for the ETA in the search message
+wait_stats = waitstats.WaitEstimator()
+# Recent partners of each user, passed over to avoid immediate rematches
+recent_pairs = matchmaking.RecentPairs()
+
+# Links between relayed messages and their copies, for edits and replies
+message_map = msgmap.MessageMap()
+
+# Album parts waiting to be relayed as one media group
+album_collector = albums.AlbumCollector(wheel)
+
+# Inbound rate limits per user and update kind (FLOOD_LIMITS)
+flood_control = flood.FloodControl(flood.parse_limits(flood.FLOOD_LIMITS))
+# Users already warned during their current flood; cleared with the stats
+flood_warned: Set[int] = set()
+FLOOD_STATS_INTERVAL = 60
+
+# Banned words and links in relayed text, reloaded when the list changes
+text_filter = content_filter.ContentFilter()
+CONTENT_FILTER_RELOAD_INTERVAL = 10
+FILTERED_MESSAGE_TEXT = "⚠️ Сообщение не доставлено: оно содержит запрещённые слова или ссылки."
+
+# Telegram user IDs allowed to run moderation commands
+ADMIN_IDS = {int(admin_id) for admin_id in os.environ.get("ADMIN_IDS", "").replace(" ", "").split(",") if admin_id}
+
+# file_unique_ids of media that must not be relayed; loaded in init_moderation()
+blocked_media = MediaBlocklist()
+BLOCKED_MEDIA_TEXT = "⚠️ Это медиа запрещено к пересылке."
+
+# Banned users and reports awaiting review; loaded in init_moderation()
+bans = moderation.BanList()
+reports = moderation.ReportQueue()
+BAN_PURGE_INTERVAL = 60
+# Banned users already told about their ban, so repeated updates cost no sends
+ban_notified: Set[int] = set()
+
+# One-time tokens behind the rating and report buttons of ended chats
+rating_tokens = ratings.TokenStore()
+# Votes are applied to profiles in batches
+vote_counter = ratings.VoteCounter()
+VOTE_FLUSH_INTERVAL = 5
+
+# Rendered profile cards by user ID, dropped when the profile changes in the database
+profile_cards: "OrderedDict[int, Tuple[str, InlineKeyboardMarkup]]" = OrderedDict()
+PROFILE_CARD_CACHE_SIZE = int(os.environ.get("PROFILE_CARD_CACHE_SIZE", "10000"))
+
+# Group chats with no messages for this long are closed
+GROUP_IDLE_TIMEOUT = int(os.environ.get("GROUP_IDLE_TIMEOUT", "3600"))
+# Group idle timers by group ID
+group_timers: Dict[str, Timer] = {}
+GROUP_ACTIVITY_RESOLUTION = 60
+
+# Messages per second when notifying many users at once (Telegram allows ~30)
+BATCH_SEND_RATE = int(os.environ.get("BATCH_SEND_RATE", "25"))
+
+RESTART_CHAT_TEXT = "🔄 Бот был перезапущен. Ваш чат с собеседником продолжается."
+
 # Constants
 WELCOME_TEXT = (
     "👋 *Добро пожаловать в анонимный чат!*\n\n"
@@ -51,61 +139,397 @@ MAIN_KEYBOARD = [
     [InlineKeyboardButton("ℹ️ Помощь", callback_data="help")]
 ]
 
-async def update_search_timer(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Update the search timer for users."""
+async def claim_pair(user_id: int, partner_id: int) -> bool:
+    """Reserve two searchers for a match; always succeeds without a coordinator."""
+    if coordinator is None:
+        return True
+    return await coordinator.claim_pair(user_id, partner_id)
+
+def bump_user_counters(user_id: int, deltas: Dict[str, int], txn: Optional[db.Transaction] = None) -> None:
+    """Increment numeric profile fields on the worker that owns the user.
+    
+    Local users are updated inside `txn` when one is given. Users owned by
+    another worker are updated there, outside of the transaction.
+    """
+    if coordinator is not None and not coordinator.owns(user_id):
+        coordinator.forward(user_id, "bump", {"deltas": deltas})
+        return
+    
+    if txn is None:
+        with db.transaction() as txn:
+            for field, delta in deltas.items():
+                txn.increment(user_id, field, delta)
+    else:
+        for field, delta in deltas.items():
+            txn.increment(user_id, field, delta)
+
+async def handle_forwarded_bump(frame: Dict[str, Any]) -> None:
+    """Apply a counter update forwarded by another worker."""
+    bump_user_counters(frame["user_id"], frame["payload"]["deltas"])
+
+def record_votes(user_id: int, positive: int = 0, negative: int = 0, txn: Optional[db.Transaction] = None) -> None:
+    """Count rating votes and update reputation and tier on the worker that owns the user."""
+    if coordinator is not None and not coordinator.owns(user_id):
+        coordinator.forward(user_id, "vote", {"positive": positive, "negative": negative})
+        return
+    
+    if txn is None:
+        with db.transaction() as txn:
+            matchmaking.apply_votes(txn.get_user(user_id), positive, negative)
+    else:
+        matchmaking.apply_votes(txn.get_user(user_id), positive, negative)
+
+def flush_votes(rearm: bool = True) -> None:
+    """Apply the votes collected since the last flush in one transaction."""
+    if rearm:
+        wheel.call_later(VOTE_FLUSH_INTERVAL, flush_votes)
+    pending = vote_counter.drain()
+    if not pending:
+        return
+    
     try:
-        global searching_users, active_chats
-        to_remove = []
-        current_time = time.time()
-        
-        for user_id, search_info in searching_users.items():
-            search_start = search_info.get("start_time", 0)
-            # If searching for more than 2 minutes
-            if current_time - search_start > 120:
-                to_remove.append(user_id)
-                
-                # Send timeout message
-                try:
-                    await context.bot.send_message(
-                        chat_id=int(user_id),
-                        text="⌛ Поиск собеседника завершен по таймауту. Попробуйте снова через некоторое время.",
-                        reply_markup=get_main_menu_keyboard()
-                    )
-                except Exception as e:
-                    logger.error(f"Error sending timeout message: {e}")
-        
-        # Remove users who timed out
-        for user_id in to_remove:
-            if user_id in searching_users:
-                del searching_users[user_id]
-        
-        # Update database with current state
-        db.update_searching_users(searching_users)
-        db.update_active_chats(active_chats)
-        
+        with db.transaction() as txn:
+            for user_id, (positive, negative) in pending.items():
+                record_votes(user_id, positive, negative, txn)
+        logger.info(f"Applied votes for {len(pending)} users")
     except Exception as e:
-        logger.error(f"Error in update_search_timer: {e}")
+        logger.error(f"Error applying votes: {e}")
 
-async def send_typing_notification(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Send typing notification to chat partners."""
+def rating_markup(token: str, with_votes: bool = True) -> InlineKeyboardMarkup:
+    """Buttons under an ended chat: rating, report, new search and main menu."""
+    keyboard = []
+    if with_votes:
+        keyboard.append([
+            InlineKeyboardButton("👍", callback_data=f"rate_pos_{token}"),
+            InlineKeyboardButton("👎", callback_data=f"rate_neg_{token}")
+        ])
+    keyboard += [
+        [InlineKeyboardButton("🚩 Пожаловаться", callback_data=f"report_{token}")],
+        [InlineKeyboardButton("🔍 Новый поиск", callback_data="find_chat")],
+        [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_menu")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+async def rating_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the 👍/👎 buttons shown when a chat ends."""
+    query = update.callback_query
+    user_id = query.from_user.id
+    token = query.data.split("_")[2]
+    is_positive = query.data.startswith("rate_pos_")
+    
+    # The token is bound to this user and this chat and holds a single vote
+    rated_user_id = rating_tokens.claim_vote(token, user_id)
+    if rated_user_id is None:
+        await query.answer("Оценка уже учтена или кнопка устарела.")
+        return
+    await query.answer()
+    
+    vote_counter.add(rated_user_id, is_positive)
+    logger.info(f"User {user_id} rated user {rated_user_id} {'positively' if is_positive else 'negatively'}")
+    
     try:
-        for user_id, partner_id in list(active_chats.items()):
+        await query.edit_message_text(
+            text=f"{'👍' if is_positive else '👎'} Спасибо за оценку! Ваш отзыв был успешно учтен.",
+            reply_markup=rating_markup(token, with_votes=False)
+        )
+    except Exception as e:
+        logger.error(f"Error confirming rating to user {user_id}: {e}")
+
+async def handle_forwarded_vote(frame: Dict[str, Any]) -> None:
+    """Apply votes forwarded by another worker."""
+    record_votes(frame["user_id"], frame["payload"]["positive"], frame["payload"]["negative"])
+
+def is_admin(user_id: int) -> bool:
+    return user_id in ADMIN_IDS
+
+def media_unique_ids(message: telegram.Message) -> List[str]:
+    """file_unique_ids of the media in a message (every size of a photo)."""
+    if message.photo:
+        return [size.file_unique_id for size in message.photo]
+    media = (message.sticker or message.video or message.animation or message.document
+             or message.voice or message.video_note or message.audio)
+    return [media.file_unique_id] if media else []
+
+def has_blocked_media(message: telegram.Message) -> bool:
+    return any(file_unique_id in blocked_media for file_unique_id in media_unique_ids(message))
+
+def init_moderation() -> None:
+    """Load the media blocklist, bans and pending reports from the database."""
+    global blocked_media, bans, reports
+    blocked_media = MediaBlocklist(db.load_table("media_blocklist"))
+    bans = moderation.BanList(db.load_table("bans"))
+    reports = moderation.ReportQueue(db.load_table("reports"))
+    logger.info(f"Loaded {len(blocked_media)} blocked media IDs, {len(bans)} bans, {len(reports)} pending reports")
+
+def save_moderation() -> None:
+    db.save_table("bans", bans.until)
+    db.save_table("reports", reports.reports)
+
+def on_remote_ban_change(user_id: int) -> None:
+    """Track bans placed or lifted on other workers."""
+    if user_id in bans.until:
+        bans.added(user_id)
+    else:
+        ban_notified.discard(user_id)
+    db.save_table("bans", bans.until)
+
+def on_remote_media_change(file_unique_id: str) -> None:
+    """Keep the local copy in step with blocks made on other workers."""
+    db.save_table("media_blocklist", blocked_media.ids)
+
+async def block_media_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/blockmedia: block the media of the replied-to message, or the IDs given as arguments."""
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        return
+    
+    file_unique_ids = list(context.args)
+    if update.message.reply_to_message:
+        file_unique_ids += media_unique_ids(update.message.reply_to_message)
+    if not file_unique_ids:
+        await update.message.reply_text("Ответьте командой на сообщение с медиа или укажите file_unique_id.")
+        return
+    
+    added = sum(1 for file_unique_id in file_unique_ids if blocked_media.add(file_unique_id))
+    db.save_table("media_blocklist", blocked_media.ids)
+    logger.info(f"Admin {user_id} blocked media {file_unique_ids}")
+    await update.message.reply_text(f"🚫 Заблокировано: {added}. Всего в списке: {len(blocked_media)}.")
+
+async def unblock_media_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/unblockmedia <file_unique_id>...: remove media from the blocklist."""
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        return
+    
+    file_unique_ids = list(context.args)
+    if update.message.reply_to_message:
+        file_unique_ids += media_unique_ids(update.message.reply_to_message)
+    removed = sum(1 for file_unique_id in file_unique_ids if blocked_media.remove(file_unique_id))
+    db.save_table("media_blocklist", blocked_media.ids)
+    logger.info(f"Admin {user_id} unblocked media {file_unique_ids}")
+    await update.message.reply_text(f"✅ Разблокировано: {removed}. Всего в списке: {len(blocked_media)}.")
+
+def format_ban(expires: float) -> str:
+    if not expires:
+        return "навсегда"
+    return "до " + datetime.datetime.fromtimestamp(expires).strftime("%d.%m.%Y %H:%M")
+
+async def check_ban(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drop updates from banned users before matchmaking, relaying or flood control see them."""
+    user = update.effective_user
+    if user is None or is_admin(user.id) or not bans.is_banned(user.id):
+        return
+    
+    try:
+        if update.callback_query:
+            await update.callback_query.answer("🚫 Вы заблокированы.")
+        elif user.id not in ban_notified:
+            ban_notified.add(user.id)
+            await outbox.send(
+                context.bot.send_message,
+                user.id,
+                text=f"🚫 Вы заблокированы {format_ban(bans.until.get(user.id, 0))} за нарушение правил."
+            )
+    except Exception as e:
+        logger.error(f"Error notifying banned user {user.id}: {e}")
+    raise ApplicationHandlerStop
+
+def purge_bans() -> None:
+    """Drop finished bans; re-armed every BAN_PURGE_INTERVAL seconds."""
+    wheel.call_later(BAN_PURGE_INTERVAL, purge_bans)
+    expired = bans.purge()
+    if not expired:
+        return
+    for user_id in expired:
+        ban_notified.discard(user_id)
+    db.save_table("bans", bans.until)
+    logger.info(f"Bans expired for users {expired}")
+
+async def ban_user(user_id: int, duration: float, context: ContextTypes.DEFAULT_TYPE) -> float:
+    """Ban a user, close their reports and remove them from searches, chats and groups."""
+    expires = bans.ban(user_id, duration)
+    reports.resolve(user_id)
+    save_moderation()
+    await tear_down_user(user_id, context)
+    
+    ban_notified.add(user_id)
+    try:
+        await outbox.send(
+            context.bot.send_message,
+            user_id,
+            text=f"🚫 Вы заблокированы {format_ban(expires)} за нарушение правил."
+        )
+    except Exception as e:
+        logger.error(f"Error notifying banned user {user_id}: {e}")
+    return expires
+
+async def report_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the 🚩 button shown when a chat ends."""
+    query = update.callback_query
+    reporter_id = query.from_user.id
+    reported_id = rating_tokens.get(query.data.split("_")[1], reporter_id)
+    if reported_id is None:
+        await query.answer("Кнопка устарела.")
+        return
+    
+    count = reports.add(reporter_id, reported_id)
+    if not count:
+        await query.answer("Вы уже пожаловались на этого собеседника.")
+        return
+    db.save_table("reports", reports.reports)
+    logger.info(f"User {reporter_id} reported user {reported_id} ({count} reports)")
+    await query.answer("🚩 Жалоба отправлена модераторам.", show_alert=True)
+    
+    if count == moderation.REPORT_ALERT_THRESHOLD:
+        for admin_id in ADMIN_IDS:
             try:
-                await context.bot.send_chat_action(
-                    chat_id=int(partner_id),
-                    action=telegram.constants.ChatAction.TYPING
+                await outbox.send(
+                    context.bot.send_message,
+                    admin_id,
+                    text=f"🚩 На пользователя {reported_id} пожаловались {count} раз. Проверьте /reports."
                 )
             except Exception as e:
-                logger.error(f"Error sending typing notification to user {partner_id}: {e}")
+                logger.error(f"Error alerting admin {admin_id}: {e}")
+
+def review_markup(reported_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"🚫 {label}", callback_data=f"mod_ban_{reported_id}_{duration}")
+         for duration, label in moderation.BAN_DURATIONS],
+        [InlineKeyboardButton("✅ Отклонить", callback_data=f"mod_dismiss_{reported_id}")]
+    ])
+
+async def reports_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/reports: list the most reported users with ban and dismiss buttons."""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    pending = reports.pending()
+    if not pending:
+        await update.message.reply_text("Жалоб нет.")
+        return
+    for reported_id, entry in pending:
+        first = datetime.datetime.fromtimestamp(entry["first"]).strftime("%d.%m.%Y %H:%M")
+        await update.message.reply_text(
+            f"🚩 Пользователь {reported_id}\nЖалоб: {len(entry['reporters'])}, первая {first}",
+            reply_markup=review_markup(reported_id)
+        )
+
+async def moderation_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the ban and dismiss buttons from /reports."""
+    query = update.callback_query
+    admin_id = query.from_user.id
+    if not is_admin(admin_id):
+        await query.answer()
+        return
+    await query.answer()
+    
+    parts = query.data.split("_")
+    reported_id = int(parts[2])
+    if parts[1] == "ban":
+        expires = await ban_user(reported_id, float(parts[3]), context)
+        logger.info(f"Admin {admin_id} banned user {reported_id} {format_ban(expires)}")
+        text = f"🚫 Пользователь {reported_id} заблокирован {format_ban(expires)}."
+    else:
+        reports.resolve(reported_id)
+        db.save_table("reports", reports.reports)
+        logger.info(f"Admin {admin_id} dismissed reports about user {reported_id}")
+        text = f"✅ Жалобы на пользователя {reported_id} отклонены."
+    await query.edit_message_text(text)
+
+async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/ban <user_id> [hours]: ban a user, forever when no duration is given."""
+    admin_id = update.effective_user.id
+    if not is_admin(admin_id):
+        return
+    try:
+        user_id = int(context.args[0])
+        hours = float(context.args[1]) if len(context.args) > 1 else 0
+    except (IndexError, ValueError):
+        await update.message.reply_text("Использование: /ban <user_id> [часы]")
+        return
+    
+    expires = await ban_user(user_id, hours * 3600, context)
+    logger.info(f"Admin {admin_id} banned user {user_id} {format_ban(expires)}")
+    await update.message.reply_text(f"🚫 Пользователь {user_id} заблокирован {format_ban(expires)}.")
+
+async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/unban <user_id>: lift a ban."""
+    admin_id = update.effective_user.id
+    if not is_admin(admin_id):
+        return
+    try:
+        user_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Использование: /unban <user_id>")
+        return
+    
+    if not bans.unban(user_id):
+        await update.message.reply_text(f"Пользователь {user_id} не заблокирован.")
+        return
+    ban_notified.discard(user_id)
+    db.save_table("bans", bans.until)
+    logger.info(f"Admin {admin_id} unbanned user {user_id}")
+    await update.message.reply_text(f"✅ Пользователь {user_id} разблокирован.")
+
+def reload_content_filter() -> None:
+    """Pick up changes to the word list; re-armed on the wheel."""
+    wheel.call_later(CONTENT_FILTER_RELOAD_INTERVAL, reload_content_filter)
+    try:
+        text_filter.reload_if_changed()
     except Exception as e:
-        logger.error(f"Error in send_typing_notification: {e}")
+        logger.error(f"Error reloading content filter: {e}")
+
+async def check_flood(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drop updates from users over their inbound limits before any handler runs."""
+    user = update.effective_user
+    kind = flood.update_kind(update)
+    if user is None or kind is None:
+        return
+    if flood_control.allow(user.id, kind):
+        return
+    
+    # Warn once per flood, then drop silently
+    if user.id not in flood_warned:
+        flood_warned.add(user.id)
+        try:
+            if update.callback_query:
+                await update.callback_query.answer("⚠️ Слишком много нажатий, подождите немного")
+            else:
+                await outbox.send(
+                    context.bot.send_message,
+                    user.id,
+                    attempts=1,
+                    dead_letter=False,
+                    text="⚠️ Вы отправляете сообщения слишком часто. Часть сообщений не будет доставлена."
+                )
+        except Exception as e:
+            logger.error(f"Error sending flood warning to {user.id}: {e}")
+    raise ApplicationHandlerStop
+
+def sync_journal() -> None:
+    """Commit journal records left waiting by the group fsync."""
+    wheel.call_later(db.JOURNAL_SYNC_INTERVAL, sync_journal)
+    db.sync_journal()
+
+def log_flood_stats() -> None:
+    """Log how much inbound traffic flood control let through and shed; re-armed on the wheel."""
+    wheel.call_later(FLOOD_STATS_INTERVAL, log_flood_stats)
+    stats = flood_control.stats()
+    if any(shed for _, shed in stats.values()):
+        summary = ", ".join(f"{kind} {allowed}/{shed}" for kind, (allowed, shed) in stats.items())
+        logger.info(f"Flood control allowed/shed in the last {FLOOD_STATS_INTERVAL}s: {summary}")
+    flood_control.reset_stats()
+    flood_warned.clear()
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Send welcome message when the command /start is issued."""
     try:
-        user_id = str(update.effective_user.id)
+        user_id = update.effective_user.id
         logger.info(f"Received /start command from user {user_id}")
         
+        # Someone who blocked the bot and came back can be messaged again
+        outbox.unblock(user_id)
+        
         # Get user data from database
         user_data = db.get_user_data(user_id)
         
@@ -154,59 +578,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle button presses."""
     query = update.callback_query
-    user_id = str(query.from_user.id)
+    user_id = query.from_user.id
     
     await query.answer()
     
-    # Обработка кнопок оценки собеседника
-    if query.data.startswith("rate_pos_") or query.data.startswith("rate_neg_"):
-        # Извлекаем ID оцениваемого пользователя
-        rated_user_id = query.data.split("_")[2]
-        is_positive = query.data.startswith("rate_pos_")
-        
-        # Обновляем рейтинг пользователя
-        try:
-            user_data = db.get_user_data(rated_user_id)
-            
-            # Текущий рейтинг
-            current_rating = user_data.get("rating", 0)
-            rating_count = user_data.get("rating_count", 0)
-            
-            # Обновляем рейтинг
-            if is_positive:
-                user_data["rating"] = current_rating + 1
-            else:
-                user_data["rating"] = current_rating - 1
-                
-            user_data["rating_count"] = rating_count + 1
-            
-            # Сохраняем обновленные данные
-            db.update_user_data(rated_user_id, user_data)
-            
-            # Логируем оценку
-            logger.info(f"User {user_id} rated user {rated_user_id} {'positively' if is_positive else 'negatively'}")
-            
-            # Отправляем сообщение пользователю
-            await query.edit_message_text(
-                text=f"{'👍' if is_positive else '👎'} Спасибо за оценку! Ваш отзыв был успешно учтен.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔍 Новый поиск", callback_data="find_chat")],
-                    [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_main")]
-                ])
-            )
-        except Exception as e:
-            logger.error(f"Error updating user rating: {e}")
-            await query.edit_message_text(
-                text="❌ Произошла ошибка при сохранении оценки. Пожалуйста, попробуйте позже.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔍 Новый поиск", callback_data="find_chat")],
-                    [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_main")]
-                ])
-            )
-        
-        return START
-    
-    elif query.data == "find_chat":
+    if query.data == "find_chat":
         return await find_chat(update, context)
     
     elif query.data == "group_chat":
@@ -313,7 +689,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     elif query.data == "cancel_search":
         # Remove user from searching list
         if user_id in searching_users:
-            del searching_users[user_id]
+            remove_from_search(user_id)
         
         await query.edit_message_text(
             text=WELCOME_TEXT,
@@ -330,17 +706,22 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             # Notify partner that chat has ended
             if partner_id in active_chats:
                 try:
-                    await context.bot.send_message(
-                        chat_id=int(partner_id),
+                    await outbox.send(
+                        context.bot.send_message,
+                        partner_id,
                         text=WELCOME_TEXT,
                         parse_mode="Markdown",
                         reply_markup=InlineKeyboardMarkup(MAIN_KEYBOARD)
                     )
-                    del active_chats[partner_id]
                 except Exception as e:
                     logger.error(f"Error showing welcome message to partner: {e}")
+                # The chat ends even if the partner can't be told
+                active_chats.pop(partner_id, None)
             
-            del active_chats[user_id]
+            # A blocked partner's chat may already be torn down by now
+            active_chats.pop(user_id, None)
+            db.record_unpair(user_id, partner_id)
+            forget_chat_messages(user_id, partner_id)
         
         if query.data == "skip_user":
             # Start new search
@@ -504,7 +885,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not update.message:
         return CHATTING
         
-    user_id = str(update.effective_user.id)
+    user_id = update.effective_user.id
     logger.info(f"Received message from user {user_id}")
     
     # Check if user is in active chat
@@ -520,7 +901,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 del active_chats[user_id]
             if partner_id in active_chats:
                 del active_chats[partner_id]
-            db.update_active_chats(active_chats)
+            db.record_unpair(user_id, partner_id)
+            forget_chat_messages(user_id, partner_id)
             
             await update.message.reply_text(
                 "❌ Произошла ошибка в чате. Пожалуйста, начните новый поиск.",
@@ -530,107 +912,139 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         
         # Forward message to partner
         try:
-            # Debug info
-            logger.info(f"Partner ID: {partner_id}, Type: {type(partner_id)}")
+            # Album parts are buffered and relayed together in one call
+            if update.message.media_group_id:
+                album_collector.add(update.message, relay_album, user_id, partner_id, context)
+                return CHATTING
+            
+            # Mask or refuse banned words and links before anything is sent
+            text_allowed, text = text_filter.apply(update.message.text)
+            caption_allowed, caption = text_filter.apply(update.message.caption)
+            if not (text_allowed and caption_allowed):
+                await update.message.reply_text(FILTERED_MESSAGE_TEXT)
+                return CHATTING
+            if has_blocked_media(update.message):
+                await update.message.reply_text(BLOCKED_MEDIA_TEXT)
+                return CHATTING
+            
+            await relay_chat_action(update.message, partner_id, context)
             
-            # Convert partner_id to integer explicitly
-            partner_id_int = int(partner_id)
+            # Replies point at the partner's copy of the quoted message
+            reply_to = None
+            if update.message.reply_to_message:
+                target = message_map.lookup(user_id, update.message.reply_to_message.message_id)
+                if target is not None:
+                    reply_to = target[1]
+            
+            # Remember both copies so edits and replies can be relayed later;
+            # called when the copy goes out, which may be after a retry
+            def remember(sent_message: telegram.Message) -> None:
+                message_map.add(user_id, update.message.message_id, partner_id, sent_message.message_id)
             
             # Handle different message types
             if update.message.text:
                 logger.info(f"Forwarding text message from {user_id} to {partner_id}")
-                sent_message = await context.bot.send_message(
-                    chat_id=partner_id_int,
-                    text=update.message.text,
+                await outbox.send(
+                    context.bot.send_message,
+                    partner_id,
+                    reply_to_message_id=reply_to,
+                    on_sent=remember,
+                    text=text,
                     reply_markup=InlineKeyboardMarkup([
                         [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
                     ])
                 )
                 
-                logger.info(f"Message successfully sent to {partner_id_int}, message ID: {sent_message.message_id}")
-                
             elif update.message.photo:
                 logger.info(f"Forwarding photo from {user_id} to {partner_id}")
                 photo = update.message.photo[-1]
-                sent_message = await context.bot.send_photo(
-                    chat_id=partner_id_int,
+                await outbox.send(
+                    context.bot.send_photo,
+                    partner_id,
+                    reply_to_message_id=reply_to,
+                    on_sent=remember,
                     photo=photo.file_id,
-                    caption=update.message.caption or "",
+                    caption=caption or "",
                     reply_markup=InlineKeyboardMarkup([
                         [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
                     ])
                 )
                 
-                logger.info(f"Photo successfully sent to {partner_id_int}, message ID: {sent_message.message_id}")
-                
             elif update.message.voice:
                 logger.info(f"Forwarding voice message from {user_id} to {partner_id}")
-                sent_message = await context.bot.send_voice(
-                    chat_id=partner_id_int,
+                await outbox.send(
+                    context.bot.send_voice,
+                    partner_id,
+                    reply_to_message_id=reply_to,
+                    on_sent=remember,
                     voice=update.message.voice.file_id,
                     reply_markup=InlineKeyboardMarkup([
                         [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
                     ])
                 )
                 
-                logger.info(f"Voice message successfully sent to {partner_id_int}, message ID: {sent_message.message_id}")
-                
             elif update.message.video:
                 logger.info(f"Forwarding video from {user_id} to {partner_id}")
-                sent_message = await context.bot.send_video(
-                    chat_id=partner_id_int,
+                await outbox.send(
+                    context.bot.send_video,
+                    partner_id,
+                    reply_to_message_id=reply_to,
+                    on_sent=remember,
                     video=update.message.video.file_id,
-                    caption=update.message.caption or "",
+                    caption=caption or "",
                     reply_markup=InlineKeyboardMarkup([
                         [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
                     ])
                 )
                 
-                logger.info(f"Video successfully sent to {partner_id_int}, message ID: {sent_message.message_id}")
-                
             elif update.message.sticker:
                 logger.info(f"Forwarding sticker from {user_id} to {partner_id}")
-                sent_message = await context.bot.send_sticker(
-                    chat_id=partner_id_int,
+                await outbox.send(
+                    context.bot.send_sticker,
+                    partner_id,
+                    reply_to_message_id=reply_to,
+                    on_sent=remember,
                     sticker=update.message.sticker.file_id,
                     reply_markup=InlineKeyboardMarkup([
                         [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
                     ])
                 )
                 
-                logger.info(f"Sticker successfully sent to {partner_id_int}, message ID: {sent_message.message_id}")
-                
             elif update.message.animation:
                 logger.info(f"Forwarding animation from {user_id} to {partner_id}")
-                sent_message = await context.bot.send_animation(
-                    chat_id=partner_id_int,
+                await outbox.send(
+                    context.bot.send_animation,
+                    partner_id,
+                    reply_to_message_id=reply_to,
+                    on_sent=remember,
                     animation=update.message.animation.file_id,
-                    caption=update.message.caption or "",
+                    caption=caption or "",
                     reply_markup=InlineKeyboardMarkup([
                         [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
                     ])
                 )
                 
-                logger.info(f"Animation successfully sent to {partner_id_int}, message ID: {sent_message.message_id}")
-                
             elif update.message.document:
                 # Only forward files less than 20MB
                 if update.message.document.file_size <= 20 * 1024 * 1024:
                     logger.info(f"Forwarding document from {user_id} to {partner_id}")
-                    sent_message = await context.bot.send_document(
-                        chat_id=partner_id_int,
+                    await outbox.send(
+                        context.bot.send_document,
+                        partner_id,
+                        reply_to_message_id=reply_to,
+                        on_sent=remember,
                         document=update.message.document.file_id,
-                        caption=update.message.caption or "",
+                        caption=caption or "",
                         reply_markup=InlineKeyboardMarkup([
                             [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
                         ])
                     )
-                    logger.info(f"Document successfully sent to {partner_id_int}, message ID: {sent_message.message_id}")
                 else:
                     logger.warning(f"File too large to forward: {update.message.document.file_size} bytes")
                     await update.message.reply_text("⚠️ Файл слишком большой для пересылки (>20MB)")
-                    await context.bot.send_message(
-                        chat_id=partner_id_int,
+                    await outbox.send(
+                        context.bot.send_message,
+                        partner_id,
                         text="[Собеседник пытался отправить слишком большой файл]",
                         reply_markup=InlineKeyboardMarkup([
                             [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
@@ -638,8 +1052,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     )
             else:
                 logger.warning(f"Unsupported message type from {user_id}")
-                await context.bot.send_message(
-                    chat_id=partner_id_int,
+                await outbox.send(
+                    context.bot.send_message,
+                    partner_id,
                     text="[Собеседник отправил неподдерживаемый тип сообщения]",
                     reply_markup=InlineKeyboardMarkup([
                         [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
@@ -649,9 +1064,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             # Don't send confirmation to sender to avoid cluttering the chat
             return CHATTING
             
-        except telegram.error.Unauthorized:
+        except telegram.error.Forbidden:
+            # The outbox has already scheduled the chat teardown
             logger.warning(f"User {partner_id} has blocked the bot")
-            await end_chat_session(user_id, partner_id, context)
             await update.message.reply_text(
                 "❌ Собеседник заблокировал бота. Чат был завершен.",
                 reply_markup=InlineKeyboardMarkup(MAIN_KEYBOARD)
@@ -683,6 +1098,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         logger.info(f"User {user_id} sent command: {command}")
         
         if command == 'start':
+            outbox.unblock(user_id)
+            
             # End current chat if any
             if user_id in active_chats:
                 partner_id = active_chats[user_id]
@@ -761,9 +1178,176 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
     return START
 
+async def handle_edited_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Apply an edit to the partner's copy of a relayed message."""
+    message = update.edited_message
+    user_id = update.effective_user.id
+    target = message_map.lookup(user_id, message.message_id)
+    if target is None or active_chats.get(user_id) != target[0]:
+        return
+    
+    partner_id, partner_message_id = target
+    text_allowed, text = text_filter.apply(message.text)
+    caption_allowed, caption = text_filter.apply(message.caption)
+    if not (text_allowed and caption_allowed):
+        # Keep the partner's copy as it was
+        return
+    
+    end_chat_markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
+    ])
+    try:
+        if message.text is not None:
+            await outbox.send(
+                context.bot.edit_message_text,
+                partner_id,
+                message_id=partner_message_id,
+                text=text,
+                reply_markup=end_chat_markup
+            )
+        elif message.caption is not None:
+            await outbox.send(
+                context.bot.edit_message_caption,
+                partner_id,
+                message_id=partner_message_id,
+                caption=caption,
+                reply_markup=end_chat_markup
+            )
+    except telegram.error.BadRequest as e:
+        if "Message is not modified" not in str(e):
+            logger.error(f"Error relaying edit from {user_id} to {partner_id}: {e}")
+    except Exception as e:
+        logger.error(f"Error relaying edit from {user_id} to {partner_id}: {e}")
+
+async def screen_album(messages: List[telegram.Message], user_id: int, context: ContextTypes.DEFAULT_TYPE) -> Optional[List[Optional[str]]]:
+    """Check album media and captions; returns the captions to send, or None if the album must not be relayed."""
+    captions = []
+    notice = None
+    for message in messages:
+        allowed, caption = text_filter.apply(message.caption)
+        if not allowed:
+            notice = FILTERED_MESSAGE_TEXT
+            break
+        if has_blocked_media(message):
+            notice = BLOCKED_MEDIA_TEXT
+            break
+        captions.append(caption)
+    
+    if notice is None:
+        return captions
+    try:
+        await outbox.send(context.bot.send_message, user_id, text=notice)
+    except Exception as e:
+        logger.error(f"Error notifying {user_id} about a refused album: {e}")
+    return None
+
+async def relay_album(messages: List[telegram.Message], user_id: int, partner_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send a buffered album to the chat partner with one send_media_group call."""
+    if active_chats.get(user_id) != partner_id:
+        return
+    
+    captions = await screen_album(messages, user_id, context)
+    if captions is None:
+        return
+    
+    media = [albums.to_input_media(message, caption) for message, caption in zip(messages, captions)]
+    parts = [(message, item) for message, item in zip(messages, media) if item is not None]
+    if not parts:
+        return
+    
+    await relay_chat_action(messages[0], partner_id, context)
+    
+    reply_to = None
+    quoted = messages[0].reply_to_message
+    if quoted:
+        target = message_map.lookup(user_id, quoted.message_id)
+        if target is not None:
+            reply_to = target[1]
+    
+    def remember(sent_messages: List[telegram.Message]) -> None:
+        for (message, _), sent_message in zip(parts, sent_messages):
+            message_map.add(user_id, message.message_id, partner_id, sent_message.message_id)
+    
+    try:
+        await outbox.send(
+            context.bot.send_media_group,
+            partner_id,
+            on_sent=remember,
+            media=[item for _, item in parts],
+            reply_to_message_id=reply_to
+        )
+        logger.info(f"Album of {len(parts)} items sent from {user_id} to {partner_id}")
+    except Exception as e:
+        logger.error(f"Error forwarding album from {user_id} to {partner_id}: {e}")
+
+async def relay_group_album(messages: List[telegram.Message], user_id: int, group_id: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send a buffered album to every other group member with one call each."""
+    group_info = group_chats.get(group_id)
+    if group_info is None or user_id not in group_info.get("members", []):
+        return
+    
+    captions = await screen_album(messages, user_id, context)
+    if captions is None:
+        return
+    
+    user_info = db.get_user_data(user_id)
+    gender = "👨" if user_info.get("gender") == "male" else "👩" if user_info.get("gender") == "female" else "👤"
+    user_index = group_info["members"].index(user_id) + 1
+    
+    # Only the first item carries the sender line, like a single captioned message
+    media = []
+    for i, (message, caption) in enumerate(zip(messages, captions)):
+        if i == 0:
+            item = albums.to_input_media(message, f"{gender} *Участник {user_index}:*\n{caption or ''}", "Markdown")
+        else:
+            item = albums.to_input_media(message, caption)
+        if item is not None:
+            media.append(item)
+    if not media:
+        return
+    
+    for member_id in group_info["members"]:
+        if member_id != user_id:
+            try:
+                await outbox.send(context.bot.send_media_group, member_id, media=media)
+            except Exception as e:
+                logger.error(f"Error forwarding group album to {member_id}: {e}")
+
+def forget_chat_messages(user_id: int, partner_id: int) -> None:
+    """Drop the message links of an ended chat."""
+    message_map.drop(user_id)
+    message_map.drop(partner_id)
+
+async def relay_chat_action(message: telegram.Message, partner_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the partner that a message from their chat is on its way.
+    
+    Only sent for messages that passed the content filter, and throttled
+    per chat by the outbox to one action per Telegram action window.
+    Awaited right before the relay, so the action always reaches the
+    partner ahead of the copy it announces.
+    """
+    if message.photo:
+        action = ChatAction.UPLOAD_PHOTO
+    elif message.video:
+        action = ChatAction.UPLOAD_VIDEO
+    elif message.voice:
+        action = ChatAction.UPLOAD_VOICE
+    elif message.document:
+        action = ChatAction.UPLOAD_DOCUMENT
+    elif message.sticker:
+        action = ChatAction.CHOOSE_STICKER
+    else:
+        action = ChatAction.TYPING
+    
+    try:
+        await outbox.send_action(context.bot, partner_id, action)
+    except Exception as e:
+        # The message itself matters more than the indicator
+        logger.warning(f"Error sending chat action to {partner_id}: {e}")
+
 async def find_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start looking for a chat partner."""
-    user_id = str(update.effective_user.id)
+    user_id = update.effective_user.id
     logger.info(f"User {user_id} is looking for a chat partner")
     
     # Check if user is already searching
@@ -780,30 +1364,24 @@ async def find_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         # Notify partner that chat has ended
         if partner_id in active_chats:
             try:
-                await context.bot.send_message(
-                    chat_id=int(partner_id),
+                await outbox.send(
+                    context.bot.send_message,
+                    partner_id,
                     text="❌ *Собеседник покинул чат*\n\nМожете начать новый поиск.",
                     parse_mode="Markdown",
                     reply_markup=InlineKeyboardMarkup(MAIN_KEYBOARD)
                 )
-                del active_chats[partner_id]
             except Exception as e:
                 logger.error(f"Error notifying partner about chat end: {e}")
+            # The chat ends even if the partner can't be told
+            active_chats.pop(partner_id, None)
         
-        del active_chats[user_id]
-        db.update_active_chats(active_chats)
-    
-    # Clean up any stale searches
-    current_time = time.time()
-    stale_users = [uid for uid, info in searching_users.items() 
-                  if current_time - info.get("start_time", 0) > 120]
+        # A blocked partner's chat may already be torn down by now
+        active_chats.pop(user_id, None)
+        db.record_unpair(user_id, partner_id)
+        forget_chat_messages(user_id, partner_id)
     
-    for stale_user in stale_users:
-        if stale_user in searching_users:
-            del searching_users[stale_user]
-    
-    if stale_users:
-        db.update_searching_users(searching_users)
+    # Stale searches are removed by their timeout timers on the wheel
     
     # Send initial search message
     try:
@@ -829,18 +1407,25 @@ async def find_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 ])
             )
         
-        # Add user to searching users
+        # Add user to searching users; profile fields travel with the entry
+        # so other workers can score this user without reading our database
+        user_data = db.get_user_data(user_id)
         searching_users[user_id] = {
             "start_time": time.time(),
             "message_id": search_message.message_id,
-            "chat_id": update.effective_chat.id
+            "chat_id": update.effective_chat.id,
+            "gender": user_data.get("gender"),
+            "age": user_data.get("age"),
+            "tier": user_data.get("tier", matchmaking.TIER_NORMAL),
+            "interests": matchmaking.interest_mask(user_data.get("interests"))
         }
+        search_index.add(user_id, searching_users[user_id])
         
         # Update database
-        db.update_searching_users(searching_users)
+        db.record_enqueue(user_id, searching_users[user_id])
         
-        # Start continuous search in background
-        asyncio.create_task(continuous_search(user_id, context))
+        # Match, refresh and time out the search on the wheel
+        schedule_search(user_id, context)
         
         # Log the number of users searching
         logger.info(f"Currently searching users: {len(searching_users)}")
@@ -862,266 +1447,315 @@ async def find_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     
     return START
 
-async def continuous_search(user_id: str, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Continuously search for a chat partner."""
+def schedule_search(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Arm the match, timer refresh and timeout timers for a searching user."""
+    cancel_search_timers(user_id)
+    search_info = searching_users[user_id]
+    # The original start time is kept, so searches restored after a restart
+    # that are already past the limit time out right away
+    remaining = search_info.get("start_time", time.time()) + SEARCH_TIMEOUT - time.time()
+    search_timers[user_id] = {
+        "retry": wheel.call_later(0, search_step, user_id, context),
+        "refresh": wheel.call_later(SEARCH_REFRESH_INTERVAL, refresh_search_message, user_id, context),
+        "timeout": wheel.call_later(max(0, remaining), expire_search, user_id, context)
+    }
+
+def cancel_search_timers(user_id: int) -> None:
+    """Disarm all search timers of a user."""
+    for timer in search_timers.pop(user_id, {}).values():
+        timer.cancel()
+
+def index_search(user_id: int) -> None:
+    """Bring the candidate index in line with a user's entry in searching_users."""
+    entry = searching_users.get(user_id)
+    if entry is None:
+        search_index.remove(user_id)
+        return
+    
+    # Entries restored from older files may not carry profile fields
+    if "gender" not in entry:
+        user_data = db.get_user_data(user_id)
+        entry = dict(entry, gender=user_data.get("gender"), age=user_data.get("age"),
+                     tier=user_data.get("tier", matchmaking.TIER_NORMAL),
+                     interests=matchmaking.interest_mask(user_data.get("interests")))
+    search_index.add(user_id, entry)
+
+def remove_from_search(user_id: int) -> None:
+    """Take a user out of the search queue."""
+    cancel_search_timers(user_id)
+    search_index.remove(user_id)
+    if user_id in searching_users:
+        del searching_users[user_id]
+    db.record_dequeue(user_id)
+
+async def search_step(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Try once to find a chat partner; re-armed on the wheel until matched or timed out."""
     try:
         global active_chats, searching_users
         
         # Get search info
         search_info = searching_users.get(user_id)
         if not search_info:
-            logger.warning(f"User {user_id} search info not found")
+            cancel_search_timers(user_id)
+            return
+        if bans.is_banned(user_id):
+            remove_from_search(user_id)
             return
         
-        chat_id = search_info.get("chat_id")
-        message_id = search_info.get("message_id")
-        start_time = search_info.get("start_time", time.time())
+        entry = search_index.get(user_id)
+        if entry is None:
+            index_search(user_id)
+            entry = search_index.get(user_id)
         
-        # Обновляем время поиска каждые 2 секунды
-        update_timer_task = asyncio.create_task(update_search_timer_for_user(user_id, context, chat_id, message_id, start_time))
+        current_time = time.time()
+        elapsed_search_time = current_time - search_info.get("start_time", current_time)
         
-        # Get user data
-        user_data = db.get_user_data(user_id)
-        user_gender = user_data.get("gender")
-        user_age = user_data.get("age")
+        # Show current search status
+        logger.info(f"User {user_id} searching for {int(elapsed_search_time)}s, {len(searching_users)} users searching total")
         
-        logger.info(f"Starting continuous search for user {user_id}")
+        # Only the user's own reputation pool is scanned; interests count in the score
+        candidates = ((partner_id, partner_info)
+                      for partner_id, partner_info in search_index.candidates(entry)
+                      if not bans.is_banned(partner_id))
+        match = matchmaking.pick_partner(user_id, entry, candidates, current_time,
+                                         recent=recent_pairs, waited=elapsed_search_time)
         
-        while user_id in searching_users:
-            current_time = time.time()
-            elapsed_search_time = current_time - start_time
-            
-            # Collect all potential partners
-            potential_partners = []
+        if match is not None:
+            selected_partner = match[0]
+            logger.info(f"Found partner for user {user_id}: {selected_partner}")
             
-            # Show current search status
-            logger.info(f"User {user_id} searching for {int(elapsed_search_time)}s, {len(searching_users)} users searching total")
+            # Get partner info
+            partner_info = searching_users[selected_partner]
             
-            for partner_id, partner_info in searching_users.items():
-                if partner_id == user_id:
-                    continue
-                
-                partner_data = db.get_user_data(partner_id)
-                partner_gender = partner_data.get("gender")
-                partner_age = partner_data.get("age")
-                
-                # Calculate match score (higher is better)
-                score = 0
-                
-                # If both users have gender set and they're opposite, increase score
-                if user_gender and partner_gender and user_gender != partner_gender:
-                    score += 3
-                
-                # If both users have age set and they're close, increase score
-                if user_age and partner_age:
-                    age_diff = abs(user_age - partner_age)
-                    if age_diff <= 3:
-                        score += 2
-                    elif age_diff <= 5:
-                        score += 1
-                
-                # Add waiting time bonus (longer waiting = higher chance)
-                partner_waiting_time = current_time - partner_info.get("start_time", current_time)
-                if partner_waiting_time > 60:  # Waiting more than 1 minute
-                    score += 2
-                elif partner_waiting_time > 30:  # Waiting more than 30 seconds
-                    score += 1
-                
-                # Always add as potential partner with base score
-                potential_partners.append((partner_id, score))
-            
-            # If we have potential partners
-            if potential_partners:
-                # Sort by score (highest first)
-                potential_partners.sort(key=lambda x: x[1], reverse=True)
-                
-                # Select partner - prefer higher scores but allow some randomness
-                if len(potential_partners) > 3 and random.random() < 0.3:
-                    # 30% chance to pick from top 3
-                    selected_partner = random.choice(potential_partners[:3])[0]
-                else:
-                    # Otherwise pick the highest score
-                    selected_partner = potential_partners[0][0]
-                
-                logger.info(f"Found partner for user {user_id}: {selected_partner}")
-                
-                # Get partner info
-                partner_info = searching_users[selected_partner]
-                
-                # Cancel timer update task
-                update_timer_task.cancel()
-                
-                # Remove both users from searching
-                if user_id in searching_users:
-                    del searching_users[user_id]
-                if selected_partner in searching_users:
-                    del searching_users[selected_partner]
-                
-                # Update database
-                db.update_searching_users(searching_users)
-                
-                # Set up active chats (ensure both directions are created)
-                active_chats[user_id] = selected_partner
-                active_chats[selected_partner] = user_id
-                
-                # Update database
-                db.update_active_chats(active_chats)
-                
-                # Log current active chats for debugging
-                logger.info(f"Active chats after match: {active_chats}")
-                
-                # Notify users
-                try:
-                    # Notify current user
-                    try:
-                        await context.bot.edit_message_text(
-                            chat_id=chat_id,
-                            message_id=message_id,
-                            text="✅ *Собеседник найден!*\n\nМожете начинать общение.",
-                            parse_mode="Markdown",
-                            reply_markup=InlineKeyboardMarkup([
-                                [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
-                            ])
-                        )
-                        logger.info(f"Notification sent to user {user_id}")
-                    except Exception as e:
-                        logger.error(f"Error notifying user {user_id}: {e}")
-                        # Try to send a new message if edit fails
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text="✅ *Собеседник найден!*\n\nМожете начинать общение.",
-                            parse_mode="Markdown",
-                            reply_markup=InlineKeyboardMarkup([
-                                [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
-                            ])
-                        )
-                    
-                    # Notify partner
-                    partner_chat_id = partner_info.get("chat_id")
-                    partner_message_id = partner_info.get("message_id")
-                    
-                    try:
-                        # Try to edit partner's search message
-                        await context.bot.edit_message_text(
-                            chat_id=partner_chat_id,
-                            message_id=partner_message_id,
-                            text="✅ *Собеседник найден!*\n\nМожете начинать общение.",
-                            parse_mode="Markdown",
-                            reply_markup=InlineKeyboardMarkup([
-                                [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
-                            ])
-                        )
-                        logger.info(f"Notification sent to partner {selected_partner}")
-                    except Exception as e:
-                        logger.error(f"Error editing partner message: {e}")
-                        # Try to send a new message if edit fails
-                        await context.bot.send_message(
-                            chat_id=partner_chat_id,
-                            text="✅ *Собеседник найден!*\n\nМожете начинать общение.",
-                            parse_mode="Markdown",
-                            reply_markup=InlineKeyboardMarkup([
-                                [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
-                            ])
-                        )
-                    
-                    # Send welcome messages to both users
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text="👋 Вы можете отправлять текст, фотографии, видео, голосовые сообщения, стикеры и документы.\n\nЧтобы завершить чат, нажмите кнопку 'Завершить чат'.",
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
-                        ])
-                    )
-                    
-                    await context.bot.send_message(
-                        chat_id=partner_chat_id,
-                        text="👋 Вы можете отправлять текст, фотографии, видео, голосовые сообщения, стикеры и документы.\n\nЧтобы завершить чат, нажмите кнопку 'Завершить чат'.",
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
-                        ])
-                    )
-                    
-                except Exception as e:
-                    logger.error(f"Error notifying users about match: {e}")
-                
+            # Another worker may have matched one of us in the meantime
+            if await claim_pair(user_id, selected_partner):
+                await connect_pair(user_id, search_info, selected_partner, partner_info, context)
                 return
-            
-            # Check if search timed out (2 minutes)
-            if elapsed_search_time > 120:
-                if user_id in searching_users:
-                    del searching_users[user_id]
-                db.update_searching_users(searching_users)
-                
-                try:
-                    await context.bot.edit_message_text(
-                        chat_id=chat_id,
-                        message_id=message_id,
-                        text="⌛ *Поиск завершен*\n\nК сожалению, собеседник не был найден. Попробуйте еще раз.",
-                        parse_mode="Markdown",
-                        reply_markup=InlineKeyboardMarkup(MAIN_KEYBOARD)
-                    )
-                except Exception as e:
-                    logger.error(f"Error sending timeout message: {e}")
-                
-                update_timer_task.cancel()
-                return
-            
-            # Wait a short time before next check
-            await asyncio.sleep(0.5)  # Check twice per second
+            logger.info(f"Partner {selected_partner} was taken by another worker, retrying")
         
-        # If search was cancelled
-        update_timer_task.cancel()
+        # Nobody suitable yet; try again on a later turn of the wheel
+        timers = search_timers.get(user_id)
+        if timers is not None and user_id in searching_users:
+            timers["retry"] = wheel.call_later(SEARCH_RETRY_INTERVAL, search_step, user_id, context)
         
     except Exception as e:
-        logger.error(f"Error in continuous search: {e}")
+        logger.error(f"Error in search step: {e}")
         # Try to clean up
-        if user_id in searching_users:
-            del searching_users[user_id]
-        db.update_searching_users(searching_users)
+        remove_from_search(user_id)
 
-async def update_search_timer_for_user(user_id: str, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, start_time: float) -> None:
-    """Update search timer for a specific user."""
+async def connect_pair(user_id: int, search_info: Dict[str, Any], partner_id: int, partner_info: Dict[str, Any], context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Move two matched searchers into a chat and notify both."""
+    # Stop both users' search timers
+    cancel_search_timers(user_id)
+    cancel_search_timers(partner_id)
+    
+    # Remove both users from searching
+    search_index.remove(user_id)
+    search_index.remove(partner_id)
+    if user_id in searching_users:
+        del searching_users[user_id]
+    if partner_id in searching_users:
+        del searching_users[partner_id]
+    
+    now = time.time()
+    for info in (search_info, partner_info):
+        wait_stats.record(info.get("gender"), info.get("age"), now - info.get("start_time", now))
+    
+    # Set up active chats (ensure both directions are created)
+    active_chats[user_id] = partner_id
+    active_chats[partner_id] = user_id
+    recent_pairs.add(user_id, partner_id, time.time())
+    
+    # Leaving the queue and pairing are one journal record, so a crash can't
+    # leave both users out of the queue but unpaired
+    with db.transaction() as txn:
+        txn.dequeue(user_id)
+        txn.dequeue(partner_id)
+        txn.pair(user_id, partner_id)
+    
+    logger.info(f"Matched {user_id} with {partner_id}, active chats: {len(active_chats) // 2}")
+    
+    found_text = "✅ *Собеседник найден!*\n\nМожете начинать общение."
+    end_chat_markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
+    ])
+    
+    # Notify users
     try:
-        while user_id in searching_users:
-            # Calculate elapsed time
-            elapsed_time = int(time.time() - start_time)
-            minutes = elapsed_time // 60
-            seconds = elapsed_time % 60
-            time_str = f"{minutes:02d}:{seconds:02d}"
-            
-            # Update message
+        for chat_id, message_id in ((search_info.get("chat_id"), search_info.get("message_id")),
+                                    (partner_info.get("chat_id"), partner_info.get("message_id"))):
             try:
-                await context.bot.edit_message_text(
-                    chat_id=chat_id,
+                # Try to edit the search message
+                await outbox.send(
+                    context.bot.edit_message_text,
+                    chat_id,
                     message_id=message_id,
-                    text=f"🔍 *Поиск собеседника...*\n\n⏱ Время поиска: {time_str}",
+                    text=found_text,
                     parse_mode="Markdown",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("❌ Отменить поиск", callback_data="cancel_search")]
-                    ])
+                    reply_markup=end_chat_markup
                 )
-            except telegram.error.BadRequest as e:
-                if "Message is not modified" in str(e):
-                    # Ignore this error, it's normal when the timer hasn't changed
-                    pass
-                else:
-                    logger.error(f"Error updating search time: {e}")
-            
-            # Wait before updating again
-            await asyncio.sleep(2)
-    except asyncio.CancelledError:
-        # Задача была отменена, это нормально
-        pass
+                logger.info(f"Match notification sent to chat {chat_id}")
+            except Exception as e:
+                logger.error(f"Error editing search message in chat {chat_id}: {e}")
+                # Try to send a new message if edit fails
+                await outbox.send(
+                    context.bot.send_message,
+                    chat_id,
+                    text=found_text,
+                    parse_mode="Markdown",
+                    reply_markup=end_chat_markup
+                )
+        
+        # Send welcome messages to both users
+        for chat_id in (search_info.get("chat_id"), partner_info.get("chat_id")):
+            await outbox.send(
+                context.bot.send_message,
+                chat_id,
+                text="👋 Вы можете отправлять текст, фотографии, видео, голосовые сообщения, стикеры и документы.\n\nЧтобы завершить чат, нажмите кнопку 'Завершить чат'.",
+                reply_markup=end_chat_markup
+            )
+        
     except Exception as e:
-        logger.error(f"Error in update_search_timer_for_user: {e}")
+        logger.error(f"Error notifying users about match: {e}")
+
+async def refresh_search_message(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the elapsed search time; re-armed every SEARCH_REFRESH_INTERVAL seconds."""
+    search_info = searching_users.get(user_id)
+    timers = search_timers.get(user_id)
+    if not search_info or timers is None:
+        return
+    timers["refresh"] = wheel.call_later(SEARCH_REFRESH_INTERVAL, refresh_search_message, user_id, context)
+    
+    # Users like this one mostly time out: say so now instead of in two minutes
+    gender, age = search_info.get("gender"), search_info.get("age")
+    if search_looks_hopeless(user_id, search_info):
+        await expire_search(user_id, context, early=True)
+        return
+    
+    # Calculate elapsed time
+    elapsed_time = int(time.time() - search_info.get("start_time", time.time()))
+    time_str = format_duration(elapsed_time)
+    
+    eta_line = ""
+    eta = wait_stats.estimate(gender, age)
+    if eta is not None:
+        if eta > SEARCH_TIMEOUT:
+            eta_line = "\n⏳ Сейчас поиск может затянуться"
+        else:
+            eta_line = f"\n⏳ Обычно поиск занимает ~{format_duration(int(eta) + 1)}"
+    
+    # Update message
+    try:
+        # A lost tick is replaced by the next one, so don't retry it
+        await outbox.send(
+            context.bot.edit_message_text,
+            search_info.get("chat_id"),
+            attempts=1,
+            dead_letter=False,
+            message_id=search_info.get("message_id"),
+            text=f"🔍 *Поиск собеседника...*\n\n⏱ Время поиска: {time_str}{eta_line}",
+            parse_mode="Markdown",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("❌ Отменить поиск", callback_data="cancel_search")]
+            ])
+        )
+    except telegram.error.BadRequest as e:
+        if "Message is not modified" in str(e):
+            # Ignore this error, it's normal when the timer hasn't changed
+            pass
+        else:
+            logger.error(f"Error updating search time: {e}")
+    except Exception as e:
+        logger.error(f"Error updating search time: {e}")
+
+def search_looks_hopeless(user_id: int, search_info: Dict[str, Any]) -> bool:
+    """Users like this one mostly time out, and nobody they could meet is searching now.
+    
+    The queue is checked so that a bucket that only saw timeouts still gets
+    matches, and with them the samples that bring it back, once partners
+    show up.
+    """
+    if not wait_stats.likely_timeout(search_info.get("gender"), search_info.get("age")):
+        return False
+    entry = search_index.get(user_id)
+    return entry is None or not any(partner_id != user_id for partner_id, _ in search_index.candidates(entry))
+
+def format_duration(seconds: int) -> str:
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+async def expire_search(user_id: int, context: ContextTypes.DEFAULT_TYPE, early: bool = False) -> None:
+    """End a search that found nobody within SEARCH_TIMEOUT, or is not expected to."""
+    search_info = searching_users.get(user_id)
+    if not search_info:
+        cancel_search_timers(user_id)
+        return
+    remove_from_search(user_id)
+    
+    now = time.time()
+    wait = now - search_info.get("start_time", now)
+    if early:
+        # We only know the search would have lasted longer than this
+        wait_stats.record_stopped(search_info.get("gender"), search_info.get("age"), wait)
+        text = "⌛ *Поиск остановлен*\n\nСейчас подходящих собеседников почти нет, и поиск скорее всего не дал бы результата. Попробуйте немного позже."
+    else:
+        wait_stats.record(search_info.get("gender"), search_info.get("age"), wait, timed_out=True)
+        text = "⌛ *Поиск завершен*\n\nК сожалению, собеседник не был найден. Попробуйте еще раз."
+    
+    try:
+        await outbox.send(
+            context.bot.edit_message_text,
+            search_info.get("chat_id"),
+            message_id=search_info.get("message_id"),
+            text=text,
+            parse_mode="Markdown",
+            reply_markup=InlineKeyboardMarkup(MAIN_KEYBOARD)
+        )
+    except Exception as e:
+        logger.error(f"Error sending timeout message: {e}")
 
 async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Show user profile."""
-    user_id = str(update.effective_user.id)
+    user_id = update.effective_user.id
     
-    # Get user data из базы данных
-    user_info = db.get_user_data(user_id)
+    profile_text, profile_markup = get_profile_card(user_id)
+    
+    # Send or edit message
+    if update.callback_query:
+        await update.callback_query.edit_message_text(
+            text=profile_text,
+            parse_mode="Markdown",
+            reply_markup=profile_markup
+        )
+    else:
+        await update.message.reply_text(
+            text=profile_text,
+            parse_mode="Markdown",
+            reply_markup=profile_markup
+        )
     
+    return PROFILE
+
+def get_profile_card(user_id: int) -> Tuple[str, InlineKeyboardMarkup]:
+    """Rendered profile text and keyboard, cached until the profile changes."""
+    card = profile_cards.get(user_id)
+    if card is not None:
+        profile_cards.move_to_end(user_id)
+        return card
+    
+    card = profile_cards[user_id] = render_profile_card(db.get_user_data(user_id))
+    if len(profile_cards) > PROFILE_CARD_CACHE_SIZE:
+        profile_cards.popitem(last=False)
+    return card
+
+def invalidate_profile_card(user_id: Optional[int]) -> None:
+    """Profile listener: drop the cached card of a changed profile (all cards for None)."""
+    if user_id is None:
+        profile_cards.clear()
+    else:
+        profile_cards.pop(user_id, None)
+
+def render_profile_card(user_info: Dict[str, Any]) -> Tuple[str, InlineKeyboardMarkup]:
+    """Build the profile text and keyboard."""
     # Build profile text
     profile_text = "*👤 Ваш профиль:*\n\n"
     
@@ -1195,25 +1829,11 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     if avatar_path and os.path.exists(avatar_path):
         keyboard.insert(1, [InlineKeyboardButton("🖼 Посмотреть аватар", callback_data="view_avatar")])
     
-    # Send or edit message
-    if update.callback_query:
-        await update.callback_query.edit_message_text(
-            text=profile_text,
-            parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    else:
-        await update.message.reply_text(
-            text=profile_text,
-            parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    
-    return PROFILE
+    return profile_text, InlineKeyboardMarkup(keyboard)
 
 async def handle_avatar_upload(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle avatar upload."""
-    user_id = str(update.effective_user.id)
+    user_id = update.effective_user.id
     
     if update.message.photo:
         # Save avatar
@@ -1238,7 +1858,7 @@ async def handle_avatar_upload(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def find_group_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Find available group chats."""
-    user_id = str(update.effective_user.id)
+    user_id = update.effective_user.id
     available_groups = []
     
     for group_id, group_info in group_chats.items():
@@ -1273,7 +1893,7 @@ async def find_group_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def create_group_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Create a new group chat."""
-    user_id = str(update.effective_user.id)
+    user_id = update.effective_user.id
     
     # Generate unique group ID
     group_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
@@ -1287,11 +1907,13 @@ async def create_group_chat(update: Update, context: ContextTypes.DEFAULT_TYPE)
         "members": [user_id],
         "invite_code": invite_code,
         "private": False,
-        "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "last_activity": time.time()
     }
     
     # Add to group chats
     group_chats[group_id] = group_info
+    watch_group_idle(group_id, context)
     
     # Send success message with group info
     await update.callback_query.edit_message_text(
@@ -1308,7 +1930,7 @@ async def create_group_chat(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def join_group_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Join a group chat by invite code."""
-    user_id = str(update.effective_user.id)
+    user_id = update.effective_user.id
     
     # Ask for invite code
     if update.callback_query:
@@ -1331,7 +1953,7 @@ async def join_group_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def handle_group_join(update: Update, context: ContextTypes.DEFAULT_TYPE, group_id: str) -> int:
     """Handle joining a group chat."""
-    user_id = str(update.effective_user.id)
+    user_id = update.effective_user.id
     
     # Check if group exists
     if group_id not in group_chats:
@@ -1417,6 +2039,9 @@ async def handle_group_join(update: Update, context: ContextTypes.DEFAULT_TYPE,
     
     # Add user to group
     group_info["members"].append(user_id)
+    # Re-assign so other shards see the membership change
+    group_chats[group_id] = group_info
+    watch_group_idle(group_id, context)
     
     # Create member list
     member_list = ""
@@ -1456,8 +2081,9 @@ async def handle_group_join(update: Update, context: ContextTypes.DEFAULT_TYPE,
     for member_id in group_info["members"]:
         if member_id != user_id:  # Don't notify the user who just joined
             try:
-                await context.bot.send_message(
-                    chat_id=int(member_id),
+                await outbox.send(
+                    context.bot.send_message,
+                    member_id,
                     text=f"👋 *Новый участник присоединился к группе!*\n\n"
                          f"В группе теперь {len(group_info['members'])} участников.",
                     parse_mode="Markdown"
@@ -1469,7 +2095,7 @@ async def handle_group_join(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
 async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle messages in group chats."""
-    user_id = str(update.effective_user.id)
+    user_id = update.effective_user.id
     
     # Find which group the user is in
     user_group = None
@@ -1493,12 +2119,31 @@ async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYP
     # Get group info
     group_info = group_chats[user_group]
     
+    touch_group(user_group, group_info)
+    
+    # Album parts are buffered and relayed together in one call per member
+    if update.message.media_group_id:
+        album_collector.add(update.message, relay_group_album, user_id, user_group, context)
+        return GROUP_CHATTING
+    
+    # Mask or refuse banned words and links before anything is sent
+    text_allowed, text = text_filter.apply(update.message.text)
+    caption_allowed, caption = text_filter.apply(update.message.caption)
+    if not (text_allowed and caption_allowed):
+        await update.message.reply_text(FILTERED_MESSAGE_TEXT)
+        return GROUP_CHATTING
+    if has_blocked_media(update.message):
+        await update.message.reply_text(BLOCKED_MEDIA_TEXT)
+        return GROUP_CHATTING
+    
     # Get user info
-    user_info = user_data.get(user_id, {})
+    user_info = db.get_user_data(user_id)
     gender = "👨" if user_info.get("gender") == "male" else "👩" if user_info.get("gender") == "female" else "👤"
     
     # Get user index in group
     user_index = group_info["members"].index(user_id) + 1
+    # Caption with the sender header, built once for every member
+    member_caption = f"{gender} *Участник {user_index}:*\n{caption or ''}"
     
     # Forward message to all group members
     for member_id in group_info["members"]:
@@ -1506,51 +2151,56 @@ async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYP
             try:
                 # Handle different message types
                 if update.message.text:
-                    await context.bot.send_message(
-                        chat_id=int(member_id),
-                        text=f"{gender} *Участник {user_index}:*\n{update.message.text}",
+                    await outbox.send(
+                        context.bot.send_message,
+                        member_id,
+                        text=f"{gender} *Участник {user_index}:*\n{text}",
                         parse_mode="Markdown"
                     )
                 elif update.message.photo:
                     photo = update.message.photo[-1]
-                    caption = f"{gender} *Участник {user_index}:*\n{update.message.caption or ''}"
-                    await context.bot.send_photo(
-                        chat_id=int(member_id),
+                    await outbox.send(
+                        context.bot.send_photo,
+                        member_id,
                         photo=photo.file_id,
-                        caption=caption,
+                        caption=member_caption,
                         parse_mode="Markdown"
                     )
                 elif update.message.voice:
-                    await context.bot.send_voice(
-                        chat_id=int(member_id),
+                    await outbox.send(
+                        context.bot.send_voice,
+                        member_id,
                         voice=update.message.voice.file_id,
                         caption=f"{gender} *Участник {user_index}*",
                         parse_mode="Markdown"
                     )
                 elif update.message.video:
-                    caption = f"{gender} *Участник {user_index}:*\n{update.message.caption or ''}"
-                    await context.bot.send_video(
-                        chat_id=int(member_id),
+                    await outbox.send(
+                        context.bot.send_video,
+                        member_id,
                         video=update.message.video.file_id,
-                        caption=caption,
+                        caption=member_caption,
                         parse_mode="Markdown"
                     )
                 elif update.message.sticker:
                     # Send sticker
-                    await context.bot.send_sticker(
-                        chat_id=int(member_id),
+                    await outbox.send(
+                        context.bot.send_sticker,
+                        member_id,
                         sticker=update.message.sticker.file_id
                     )
                     # Send info about who sent it
-                    await context.bot.send_message(
-                        chat_id=int(member_id),
+                    await outbox.send(
+                        context.bot.send_message,
+                        member_id,
                         text=f"{gender} *Участник {user_index}* отправил стикер",
                         parse_mode="Markdown"
                     )
                 elif update.message.location:
                     # Поддержка передачи локации
-                    await context.bot.send_location(
-                        chat_id=int(member_id),
+                    await outbox.send(
+                        context.bot.send_location,
+                        member_id,
                         latitude=update.message.location.latitude,
                         longitude=update.message.location.longitude
                     )
@@ -1563,8 +2213,9 @@ async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYP
                     )
                 elif update.message.venue:
                     # Поддержка передачи мест (venue)
-                    await context.bot.send_venue(
-                        chat_id=int(member_id),
+                    await outbox.send(
+                        context.bot.send_venue,
+                        member_id,
                         latitude=update.message.venue.location.latitude,
                         longitude=update.message.venue.location.longitude,
                         title=update.message.venue.title,
@@ -1585,8 +2236,9 @@ async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYP
                         anonymized_text += f" {contact.last_name[:1]}."
                     
                     # Не отправляем номер телефона для сохранения анонимности
-                    await context.bot.send_message(
-                        chat_id=int(member_id),
+                    await outbox.send(
+                        context.bot.send_message,
+                        member_id,
                         text=anonymized_text
                     )
                     
@@ -1599,14 +2251,16 @@ async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYP
                     )
                 elif update.message.poll:
                     # Отправляем сообщение о том, что опросы не поддерживаются
-                    await context.bot.send_message(
-                        chat_id=int(member_id),
+                    await outbox.send(
+                        context.bot.send_message,
+                        member_id,
                         text="[Собеседник попытался отправить опрос. Опросы не поддерживаются в анонимном чате.]"
                     )
                     await update.message.reply_text("❗ Опросы не поддерживаются в анонимном чате.")
                 else:
-                    await context.bot.send_message(
-                        chat_id=int(member_id),
+                    await outbox.send(
+                        context.bot.send_message,
+                        member_id,
                         text="[Сообщение не поддерживается]"
                     )
             except Exception as e:
@@ -1616,7 +2270,7 @@ async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def leave_group_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, group_id: str) -> int:
     """Leave a group chat."""
-    user_id = str(update.effective_user.id)
+    user_id = update.effective_user.id
     
     # Check if group exists
     if group_id not in group_chats:
@@ -1671,6 +2325,12 @@ async def leave_group_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, g
     # If group is empty, delete it
     if not group_info["members"]:
         del group_chats[group_id]
+        timer = group_timers.pop(group_id, None)
+        if timer is not None:
+            timer.cancel()
+    else:
+        # Re-assign so other shards see the membership change
+        group_chats[group_id] = group_info
         
         if update.callback_query:
             await update.callback_query.edit_message_text(
@@ -1693,7 +2353,76 @@ async def leave_group_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, g
     
     return START
 
-async def end_chat_session(user_id: str, partner_id: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+def watch_group_idle(group_id: str, context: ContextTypes.DEFAULT_TYPE, delay: float = GROUP_IDLE_TIMEOUT) -> None:
+    """Arm the idle timer of a group unless this worker already has one."""
+    if group_id not in group_timers:
+        group_timers[group_id] = wheel.call_later(delay, expire_idle_group, group_id, context)
+
+def touch_group(group_id: str, group_info: Dict[str, Any]) -> None:
+    """Record activity in a group.
+    
+    The timestamp is only re-published once per GROUP_ACTIVITY_RESOLUTION
+    seconds so busy groups don't flood the other shards with updates.
+    """
+    now = time.time()
+    if now - group_info.get("last_activity", 0) >= GROUP_ACTIVITY_RESOLUTION:
+        group_info["last_activity"] = now
+        group_chats[group_id] = group_info
+
+async def expire_idle_group(group_id: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Close a group nobody has written in for GROUP_IDLE_TIMEOUT seconds."""
+    group_timers.pop(group_id, None)
+    group_info = group_chats.get(group_id)
+    if group_info is None:
+        return
+    
+    # The timer isn't moved on every message; check the real idle time instead
+    idle = time.time() - group_info.get("last_activity", 0)
+    if idle < GROUP_IDLE_TIMEOUT:
+        watch_group_idle(group_id, context, GROUP_IDLE_TIMEOUT - idle)
+        return
+    
+    del group_chats[group_id]
+    logger.info(f"Closed group {group_id} after {int(idle)}s without messages")
+    for member_id in group_info.get("members", []):
+        try:
+            await outbox.send(
+                context.bot.send_message,
+                member_id,
+                text="⌛ *Групповой чат закрыт*\n\nВ группе долго не было сообщений.",
+                parse_mode="Markdown",
+                reply_markup=InlineKeyboardMarkup(MAIN_KEYBOARD)
+            )
+        except Exception as e:
+            logger.error(f"Error notifying group member {member_id} about group closing: {e}")
+
+async def handle_blocked_recipient(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Remove a user who blocked the bot from searches, chats and groups."""
+    logger.info(f"Tearing down state of user {user_id}, who blocked the bot")
+    await tear_down_user(user_id, context)
+
+async def tear_down_user(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Take a user out of the search queue, their chat and all groups."""
+    if user_id in searching_users:
+        remove_from_search(user_id)
+    
+    partner_id = active_chats.get(user_id)
+    if partner_id is not None:
+        await end_chat_session(user_id, partner_id, context)
+    
+    for group_id, group_info in list(group_chats.items()):
+        if user_id not in group_info.get("members", []):
+            continue
+        group_info["members"].remove(user_id)
+        if group_info["members"]:
+            group_chats[group_id] = group_info
+        else:
+            del group_chats[group_id]
+            timer = group_timers.pop(group_id, None)
+            if timer is not None:
+                timer.cancel()
+
+async def end_chat_session(user_id: int, partner_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
     """End a chat session between two users."""
     global active_chats
     logger.info(f"Ending chat session between {user_id} and {partner_id}")
@@ -1711,20 +2440,22 @@ async def end_chat_session(user_id: str, partner_id: str, context: ContextTypes.
         del active_chats[partner_id]
         logger.info(f"Removed {partner_id} from active chats")
     
-    # Update in database
-    db.update_active_chats(active_chats)
+    # End the chat and count it for both users in one durable write
+    with db.transaction() as txn:
+        txn.unpair(user_id, partner_id)
+        bump_user_counters(user_id, {"total_chats": 1}, txn)
+        bump_user_counters(partner_id, {"total_chats": 1}, txn)
+    forget_chat_messages(user_id, partner_id)
     logger.info(f"Updated active chats in database, current count: {len(active_chats)}")
     
     # Notify partner that chat has ended if not already notified
     try:
-        await context.bot.send_message(
-            chat_id=int(partner_id),
+        await outbox.send(
+            context.bot.send_message,
+            partner_id,
             text="❌ *Собеседник завершил чат*\n\nВы можете начать новый поиск.",
             parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔍 Новый поиск", callback_data="find_chat")],
-                [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_menu")]
-            ])
+            reply_markup=rating_markup(rating_tokens.issue(partner_id, user_id))
         )
         logger.info(f"Sent end chat notification to {partner_id}")
     except Exception as e:
@@ -1732,19 +2463,10 @@ async def end_chat_session(user_id: str, partner_id: str, context: ContextTypes.
     
     # Log chat end
     logger.info(f"Chat between {user_id} and {partner_id} has ended")
-    
-    # Increment stats
-    user1_data = db.get_user_data(user_id)
-    user1_data['total_chats'] = user1_data.get('total_chats', 0) + 1
-    db.update_user_data(user_id, user1_data)
-    
-    user2_data = db.get_user_data(partner_id)
-    user2_data['total_chats'] = user2_data.get('total_chats', 0) + 1
-    db.update_user_data(partner_id, user2_data)
 
 async def end_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """End the current chat."""
-    user_id = str(update.effective_user.id)
+    user_id = update.effective_user.id
     
     if user_id in active_chats:
         partner_id = active_chats[user_id]
@@ -1753,26 +2475,19 @@ async def end_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         await end_chat_session(user_id, partner_id, context)
         
         # Предлагаем оценить собеседника
-        rating_keyboard = [
-            [
-                InlineKeyboardButton("👍", callback_data=f"rate_pos_{partner_id}"),
-                InlineKeyboardButton("👎", callback_data=f"rate_neg_{partner_id}")
-            ],
-            [InlineKeyboardButton("🔍 Новый поиск", callback_data="find_chat")],
-            [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_menu")]
-        ]
+        rating_keyboard = rating_markup(rating_tokens.issue(user_id, partner_id))
         
         if update.callback_query:
             await update.callback_query.edit_message_text(
                 text="❌ *Чат завершен*\n\nВы можете оценить собеседника и начать новый поиск.",
                 parse_mode="Markdown",
-                reply_markup=InlineKeyboardMarkup(rating_keyboard)
+                reply_markup=rating_keyboard
             )
         else:
             await update.message.reply_text(
                 text="❌ *Чат завершен*\n\nВы можете оценить собеседника и начать новый поиск.",
                 parse_mode="Markdown",
-                reply_markup=InlineKeyboardMarkup(rating_keyboard)
+                reply_markup=rating_keyboard
             )
     else:
         # Если пользователь не находится в чате, просто показываем главное меню
@@ -1791,7 +2506,7 @@ async def end_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     
     return START
 
-async def save_avatar(user_id: str, photo_file) -> str:
+async def save_avatar(user_id: int, photo_file) -> str:
     """Save avatar to disk and return path."""
     try:
         # Create avatars directory if it doesn't exist
@@ -1839,9 +2554,9 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
     error_message = str(error)
     
     # Обработка различных типов ошибок
-    if isinstance(error, telegram.error.Unauthorized):
+    if isinstance(error, outbound.BLOCKED_ERRORS):
         # Пользователь заблокировал бота или удалил чат
-        logger.warning(f"Unauthorized error: {error_message}")
+        logger.warning(f"Forbidden error: {error_message}")
         # Не нужно отправлять сообщение, так как пользователь заблокировал бота
         return
         
@@ -1920,6 +2635,9 @@ async def main() -> None:
     global active_chats, searching_users
     active_chats = db.get_active_chats()
     searching_users = db.get_searching_users()
+    for user_id in searching_users:
+        index_search(user_id)
+    init_moderation()
     
     # Создаем директорию для аватаров, если ее нет
     avatar_dir = "avatars"
@@ -1931,11 +2649,119 @@ async def main() -> None:
     if not os.path.exists(default_avatar):
         logger.warning(f"Default avatar does not exist at {default_avatar}. User avatars may not display correctly.")
     
-    # Get token from environment variable or use default for local development
+    token = get_token()
+    application = build_application(token)
+    
+    # Start the bot
+    logger.info("Starting polling...")
+    
+    # Упрощенный способ запуска без дублирования событийных циклов
+    await application.initialize()
+    await application.start()
+    # Keep updates sent during a deploy so messages in restored chats are still relayed
+    await application.updater.start_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=False)
+    
+    # Resume searches and tell users in chats that the bot is back
+    wheel.start()
+    await resume_after_restart(application)
+    
+    # Держим приложение запущенным до SIGINT/SIGTERM
+    try:
+        await wait_for_stop_signal()
+    finally:
+        # В случае прерывания корректно останавливаем приложение
+        logger.info("Bot stopping...")
+        await shutdown(application)
+
+async def wait_for_stop_signal() -> None:
+    """Block until the process receives SIGINT or SIGTERM."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    await stop_event.wait()
+
+def owns_user(user_id: int) -> bool:
+    """Check if this process is responsible for the user."""
+    return coordinator is None or coordinator.owns(user_id)
+
+async def send_batch(bot: telegram.Bot, chat_ids: List[int], text: str, reply_markup=None) -> None:
+    """Send the same message to many users without exceeding BATCH_SEND_RATE."""
+    for i in range(0, len(chat_ids), BATCH_SEND_RATE):
+        chunk = chat_ids[i:i + BATCH_SEND_RATE]
+        started = time.monotonic()
+        results = await asyncio.gather(
+            *(outbox.send(bot.send_message, chat_id, text=text, reply_markup=reply_markup) for chat_id in chunk),
+            return_exceptions=True
+        )
+        for chat_id, result in zip(chunk, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error sending batch message to {chat_id}: {result}")
+        
+        elapsed = time.monotonic() - started
+        if i + BATCH_SEND_RATE < len(chat_ids) and elapsed < 1:
+            await asyncio.sleep(1 - elapsed)
+
+async def resume_after_restart(application: Application) -> None:
+    """Restart searches restored from disk and notify users whose chats survived."""
+    context = CallbackContext(application)
+    
+    resumed = 0
+    for user_id in list(searching_users):
+        if owns_user(user_id) and user_id not in search_timers:
+            schedule_search(user_id, context)
+            resumed += 1
+    
+    chat_users = [user_id for user_id in active_chats if owns_user(user_id)]
+    logger.info(f"Resumed {resumed} searches, notifying {len(chat_users)} users in active chats")
+    
+    if chat_users:
+        asyncio.create_task(send_batch(
+            application.bot,
+            chat_users,
+            RESTART_CHAT_TEXT,
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("❌ Завершить чат", callback_data="end_chat")]
+            ])
+        ))
+
+async def shutdown(application: Application) -> None:
+    """Stop taking updates and flush all state to disk."""
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    
+    # Searches stay in the queue on disk and are resumed after the restart
+    wheel.stop()
+    outbox.close()
+    flush_votes(rearm=False)
+    
+    await application.shutdown()
+    db.close_db()
+    logger.info("State flushed to disk, bot stopped")
+
+def get_token() -> str:
+    """Get bot token from environment variable or use default for local development."""
     token = os.environ.get("TELEGRAM_BOT_TOKEN", "8039344227:AAEDCP_902a3r52JIdM9REqUyPx-p2IVtxA")
     logger.info(f"Using token: {token[:5]}...{token[-5:]}")  # Log only parts of token for security
-    
-    application = Application.builder().token(token).build()
+    return token
+
+def build_application(token: str, with_updater: bool = True) -> Application:
+    """Create the application and register all handlers."""
+    builder = Application.builder().token(token)
+    if not with_updater:
+        # Sharded workers receive updates from the front process instead of polling
+        builder = builder.updater(None)
+    application = builder.build()
+    
+    # Everything a chat relays, including album parts; the handlers pick the
+    # message type and answer types they can't relay themselves
+    chat_messages = (
+        filters.TEXT | filters.PHOTO | filters.VIDEO | filters.VOICE | filters.AUDIO
+        | filters.Document.ALL | filters.Sticker.ALL | filters.ANIMATION
+        | filters.LOCATION | filters.VENUE | filters.CONTACT | filters.POLL
+    ) & ~filters.COMMAND
     
     # Add handlers
     conv_handler = ConversationHandler(
@@ -1947,7 +2773,7 @@ async def main() -> None:
                 CallbackQueryHandler(show_profile, pattern="^profile$"),
             ],
             CHATTING: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message),
+                MessageHandler(chat_messages, handle_message),
                 CallbackQueryHandler(end_chat, pattern="^end_chat$"),
             ],
             PROFILE: [
@@ -1957,34 +2783,134 @@ async def main() -> None:
                 CallbackQueryHandler(button_handler),
             ],
             GROUP_CHATTING: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_group_message),
+                MessageHandler(chat_messages, handle_group_message),
                 CallbackQueryHandler(leave_group_chat, pattern="^leave_group$"),
             ],
         },
         fallbacks=[CommandHandler("start", start)],
     )
     
+    # Banned users are dropped first, then flood control runs before every other handler
+    application.add_handler(TypeHandler(Update, check_ban), group=-2)
+    application.add_handler(TypeHandler(Update, check_flood), group=-1)
+    wheel.call_later(FLOOD_STATS_INTERVAL, log_flood_stats)
+    wheel.call_later(BAN_PURGE_INTERVAL, purge_bans)
+    wheel.call_later(VOTE_FLUSH_INTERVAL, flush_votes)
+    wheel.call_later(CONTENT_FILTER_RELOAD_INTERVAL, reload_content_filter)
+    wheel.call_later(db.JOURNAL_SYNC_INTERVAL, sync_journal)
+    
+    # Moderation commands for ADMIN_IDS
+    application.add_handler(CommandHandler("blockmedia", block_media_command))
+    application.add_handler(CommandHandler("unblockmedia", unblock_media_command))
+    application.add_handler(CommandHandler("reports", reports_command))
+    application.add_handler(CommandHandler("ban", ban_command))
+    application.add_handler(CommandHandler("unban", unban_command))
+    application.add_handler(CallbackQueryHandler(moderation_button_handler, pattern="^mod_"))
+    
+    # Rating and report buttons work in any conversation state
+    application.add_handler(CallbackQueryHandler(rating_handler, pattern="^rate_(pos|neg)_[0-9a-f]+$"))
+    application.add_handler(CallbackQueryHandler(report_handler, pattern="^report_[0-9a-f]+$"))
+    
+    # Edits are relayed regardless of the conversation state
+    application.add_handler(MessageHandler(filters.UpdateType.EDITED_MESSAGE, handle_edited_message))
     application.add_handler(conv_handler)
     application.add_error_handler(error_handler)
     
-    # Start the bot
-    logger.info("Starting polling...")
+    # Cached profile cards follow profile changes made through the database module
+    db.add_profile_listener(invalidate_profile_card)
     
-    # Упрощенный способ запуска без дублирования событийных циклов
+    # Tear down chats and groups of users who block the bot
+    blocked_context = CallbackContext(application)
+    outbox.on_blocked = lambda chat_id: handle_blocked_recipient(chat_id, blocked_context)
+    
+    return application
+
+async def run_worker(shard: int, num_shards: int) -> None:
+    """Run one sharded worker that owns a hash-partition of user IDs."""
+    global active_chats, searching_users, group_chats, coordinator, blocked_media, bans, reports, rating_tokens
+    
+    # Each worker keeps the profiles of its own users in a separate directory
+    db.set_data_dir(os.path.join(db.USER_DATA_DIR, f"shard-{shard}"))
+    db.init_db()
+    
+    # Shared state is mirrored locally and kept in sync through the coordinator
+    active_chats = sharding.ReplicatedDict("active_chats", db.get_active_chats())
+    searching_users = sharding.ReplicatedDict("searching_users", db.get_searching_users())
+    group_chats = sharding.ReplicatedDict("group_chats")
+    # A user who blocked the bot is skipped by every worker
+    outbox.blocked = sharding.ReplicatedDict("blocked_chats")
+    blocked_media = MediaBlocklist(sharding.ReplicatedDict("blocked_media", db.load_table("media_blocklist")))
+    bans = moderation.BanList(sharding.ReplicatedDict("bans", db.load_table("bans")))
+    reports = moderation.ReportQueue(sharding.ReplicatedDict("reports", db.load_table("reports")))
+    # Buttons of a chat ended here may be pressed by a user owned by another worker
+    rating_tokens = ratings.TokenStore(sharding.ReplicatedDict("rating_tokens"))
+    
+    coordinator = sharding.CoordinatorClient(shard, num_shards)
+    coordinator.on_forward("bump", handle_forwarded_bump)
+    coordinator.on_forward("vote", handle_forwarded_vote)
+    await coordinator.connect({
+        "active_chats": active_chats,
+        "searching_users": searching_users,
+        "group_chats": group_chats,
+        "blocked_chats": outbox.blocked,
+        "blocked_media": blocked_media.ids,
+        "bans": bans.until,
+        "reports": reports.reports,
+        "rating_tokens": rating_tokens.tokens
+    })
+    # Entries from the snapshot bypassed the expiry heap
+    bans.rebuild()
+    for user_id in searching_users:
+        index_search(user_id)
+    searching_users.on_remote_change = index_search
+    blocked_media.ids.on_remote_change = on_remote_media_change
+    bans.until.on_remote_change = on_remote_ban_change
+    reports.reports.on_remote_change = lambda reported_id: db.save_table("reports", reports.reports)
+    
+    application = build_application(get_token(), with_updater=False)
     await application.initialize()
     await application.start()
-    await application.updater.start_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    wheel.start()
+    await resume_after_restart(application)
+    
+    async def on_update(data: Dict[str, Any]) -> None:
+        await application.update_queue.put(Update.de_json(data, application.bot))
     
-    # Держим приложение запущенным
+    serve_task = asyncio.create_task(sharding.serve_worker_updates(shard, on_update))
     try:
-        # Бесконечный цикл для поддержания работы приложения
-        while True:
-            await asyncio.sleep(3600)  # Спим час и продолжаем работу
-    except (KeyboardInterrupt, SystemExit):
-        # В случае прерывания корректно останавливаем приложение
-        logger.info("Bot stopping...")
-        await application.stop()
-        await application.updater.stop()
+        await wait_for_stop_signal()
+    finally:
+        logger.info(f"Worker {shard} stopping...")
+        serve_task.cancel()
+        await shutdown(application)
+        await coordinator.close()
+
+def worker_entry(shard: int, num_shards: int) -> None:
+    """Process entry point for a sharded worker."""
+    try:
+        asyncio.run(run_worker(shard, num_shards))
+    except KeyboardInterrupt:
+        pass
+
+def run_sharded(num_workers: int) -> None:
+    """Run the coordinator, the workers and the front router on this machine."""
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=sharding.run_coordinator, name="coordinator")]
+    for shard in range(num_workers):
+        processes.append(ctx.Process(target=worker_entry, args=(shard, num_workers), name=f"worker-{shard}"))
+    
+    for process in processes:
+        process.start()
+    logger.info(f"Started coordinator and {num_workers} workers")
+    
+    try:
+        bot = telegram.Bot(get_token())
+        asyncio.run(sharding.run_front(bot, num_workers, allowed_updates=Update.ALL_TYPES))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
 
 if __name__ == "__main__":
     try:
@@ -1998,8 +2924,11 @@ if __name__ == "__main__":
         if not os.path.exists(default_avatar):
             logger.warning(f"Default avatar does not exist at {default_avatar}. User avatars may not display correctly.")
         
-        # Запускаем бота
-        asyncio.run(main())
+        # Запускаем бота: один процесс или несколько воркеров по BOT_WORKERS
+        if sharding.NUM_WORKERS > 1:
+            run_sharded(sharding.NUM_WORKERS)
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
@@ -0,0 +1,134 @@
+import os
+import logging
+from collections import deque
+from typing import Dict, List, Tuple, Optional, Iterable
+
+logger = logging.getLogger(__name__)
+
+# One banned word or link fragment per line; lines starting with # are comments
+CONTENT_FILTER_FILE = os.environ.get("CONTENT_FILTER_FILE", "banned_words.txt")
+# "mask" replaces matches, "block" refuses to relay the whole message
+CONTENT_FILTER_MODE = os.environ.get("CONTENT_FILTER_MODE", "mask")
+MASK_CHAR = "•"
+
+class Automaton:
+    """Aho–Corasick automaton over lowercase patterns.
+
+    Scanning is one pass over the text regardless of the number of patterns.
+    For every state `longest` holds the longest pattern ending there (via
+    failure links too), which is all masking needs: shorter matches ending
+    at the same position lie inside it.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.longest: List[int] = [0]
+        self.count = 0
+
+        for pattern in patterns:
+            pattern = pattern.lower()
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.longest.append(0)
+                state = next_state
+            self.longest[state] = max(self.longest[state], len(pattern))
+            self.count += 1
+
+        # Breadth-first so failure targets are complete before their users
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                target = self.fail[state]
+                while target and char not in self.goto[target]:
+                    target = self.fail[target]
+                fallback = self.goto[target].get(char, 0)
+                self.fail[next_state] = fallback if fallback != next_state else 0
+                self.longest[next_state] = max(self.longest[next_state], self.longest[self.fail[next_state]])
+
+    def find(self, text: str) -> List[Tuple[int, int]]:
+        """Return merged (start, end) spans of all matches in `text`."""
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # A few characters change length when lowercased; keep positions aligned
+            lowered = "".join(char.lower() if len(char.lower()) == 1 else char for char in text)
+
+        goto, fail, longest = self.goto, self.fail, self.longest
+        spans: List[Tuple[int, int]] = []
+        state = 0
+        for position, char in enumerate(lowered):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            length = longest[state]
+            if length:
+                start = position + 1 - length
+                # A long match can reach back over several earlier spans
+                while spans and start <= spans[-1][1]:
+                    start = min(start, spans.pop()[0])
+                spans.append((start, position + 1))
+        return spans
+
+class ContentFilter:
+    """Banned words and links from a word-list file, reloaded when the file changes."""
+
+    def __init__(self, path: str = CONTENT_FILTER_FILE, mode: str = CONTENT_FILTER_MODE):
+        self.path = path
+        self.mode = mode
+        self.mtime: Optional[float] = None
+        self.automaton = Automaton([])
+        self.reload_if_changed()
+
+    def reload_if_changed(self) -> bool:
+        """Rebuild the automaton if the word list was modified; returns True on reload."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self.mtime:
+            return False
+
+        self.mtime = mtime
+        patterns = []
+        if mtime is not None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        line = line.strip()
+                        if line and not line.startswith("#"):
+                            patterns.append(line)
+            except Exception as e:
+                logger.error(f"Error reading content filter list {self.path}: {e}")
+                return False
+        # Swap in the new automaton in one assignment so scans never see a partial one
+        self.automaton = Automaton(patterns)
+        logger.info(f"Loaded {self.automaton.count} content filter patterns from {self.path}")
+        return True
+
+    def apply(self, text: Optional[str]) -> Tuple[bool, Optional[str]]:
+        """Check relayed text; returns (allowed, text to send)."""
+        if not text or not self.automaton.count:
+            return True, text
+        spans = self.automaton.find(text)
+        if not spans:
+            return True, text
+        if self.mode == "block":
+            return False, None
+        parts = []
+        last = 0
+        for start, end in spans:
+            parts.append(text[last:start])
+            parts.append(MASK_CHAR * (end - start))
+            last = end
+        parts.append(text[last:])
+        return True, "".join(parts)
@@ -1,8 +1,13 @@
 import os
 import json
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Callable
 import time
+import contextlib
+
+from userstore import UserStore
+from journal import StateJournal, apply_record
+import snapshot
 
 logger = logging.getLogger(__name__)
 
@@ -10,55 +15,78 @@ logger = logging.getLogger(__name__)
 USER_DATA_DIR = os.environ.get("DATA_DIR", ".")  # Get data directory from env or use current dir
 USER_DATA_FILE = os.path.join(USER_DATA_DIR, "user_data.json")
 
+# Bounded profile cache; the rest of the users stay on disk until needed
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "100000"))
+
+# Chat and search changes are journaled; the full state is checkpointed this often
+JOURNAL_CHECKPOINT_EVERY = int(os.environ.get("JOURNAL_CHECKPOINT_EVERY", "1000"))
+# Journal records appended within this many seconds share one fsync
+JOURNAL_SYNC_INTERVAL = float(os.environ.get("JOURNAL_SYNC_INTERVAL", "0.1"))
+SNAPSHOT_FORMAT = os.environ.get("SNAPSHOT_FORMAT", "binary")
+
 # In-memory database for Railway (since Railway doesn't provide persistent storage by default)
-user_data_cache = {}
+user_store: Optional[UserStore] = None
+state_journal: Optional[StateJournal] = None
 active_chats_cache = {}
 searching_users_cache = {}
 
-def load_user_data() -> Dict[str, Any]:
-    """Load user data from file or initialize empty dict."""
-    global user_data_cache
+# Called with a user ID after that profile changes, or None when any may have
+profile_listeners: List[Callable[[Optional[int]], None]] = []
+
+def set_data_dir(data_dir: str) -> None:
+    """Point the database at another data directory (used by sharded workers)."""
+    close_db()
+    global USER_DATA_DIR, USER_DATA_FILE
+    USER_DATA_DIR = data_dir
+    USER_DATA_FILE = os.path.join(USER_DATA_DIR, "user_data.json")
+    _profile_changed(None)
+
+def _int_keys(data: Dict[str, Any]) -> Dict[int, Any]:
+    """Convert JSON object keys back to integer user IDs."""
+    return {int(key): value for key, value in data.items()}
+
+def load_user_data() -> UserStore:
+    """Open the user store; only the index is mapped, profiles load on first access."""
+    global user_store
+    
+    if user_store is not None:
+        return user_store
     
-    if user_data_cache:
-        return user_data_cache
+    user_store = UserStore(USER_DATA_DIR, cache_size=USER_CACHE_SIZE)
     
+    # One-time migration from the old single JSON file
     try:
-        if os.path.exists(USER_DATA_FILE):
+        if len(user_store) == 0 and os.path.exists(USER_DATA_FILE):
             with open(USER_DATA_FILE, "r", encoding="utf-8") as file:
-                user_data_cache = json.load(file)
-                logger.info(f"Loaded user data for {len(user_data_cache)} users")
-                return user_data_cache
+                # JSON object keys are always strings; convert once on load
+                legacy_data = _int_keys(json.load(file))
+            user_store.bulk_load(legacy_data)
+            os.replace(USER_DATA_FILE, USER_DATA_FILE + ".migrated")
+            logger.info(f"Migrated {len(legacy_data)} users from {USER_DATA_FILE} to the indexed store")
     except Exception as e:
-        logger.error(f"Error loading user data: {e}")
+        logger.error(f"Error migrating user data: {e}")
     
-    user_data_cache = {}
-    return user_data_cache
+    logger.info(f"Opened user store with {len(user_store)} users")
+    return user_store
 
-def save_user_data(data: Dict[str, Any]) -> None:
-    """Save user data to file."""
-    global user_data_cache
-    user_data_cache = data
+def save_user_data() -> None:
+    """Write changed profiles back to disk."""
+    if user_store is None:
+        return
     
     try:
-        # Make sure the directory exists
-        os.makedirs(os.path.dirname(USER_DATA_FILE), exist_ok=True)
-        
-        with open(USER_DATA_FILE, "w", encoding="utf-8") as file:
-            json.dump(data, file, ensure_ascii=False, indent=4)
-        logger.info(f"Saved user data for {len(data)} users")
+        user_store.flush()
     except Exception as e:
         logger.error(f"Error saving user data: {e}")
         logger.error(f"Will continue with in-memory data only")
 
-def get_user_data(user_id: str) -> Dict[str, Any]:
+def get_user_data(user_id: int) -> Dict[str, Any]:
     """Get user data by user ID."""
-    global user_data_cache
-    
-    if not user_data_cache:
-        load_user_data()
+    store = load_user_data()
     
-    if user_id not in user_data_cache:
-        user_data_cache[user_id] = {
+    data = store.get(user_id)
+    if data is None:
+        data = {
             "gender": None,
             "age": None,
             "interests": [],
@@ -66,108 +94,302 @@ def get_user_data(user_id: str) -> Dict[str, Any]:
             "rating": 0,
             "rating_count": 0
         }
-        save_user_data(user_data_cache)
+        store.put(user_id, data)
     
-    return user_data_cache[user_id]
+    return data
 
-def update_user_data(user_id: str, data: Dict[str, Any]) -> None:
+def update_user_data(user_id: int, data: Dict[str, Any]) -> None:
     """Update user data for a specific user."""
-    global user_data_cache
-    
-    if not user_data_cache:
-        load_user_data()
-    
-    user_data_cache[user_id] = data
-    save_user_data(user_data_cache)
+    # Apply before journaling so a checkpoint triggered by this record includes it
+    load_user_data().put(user_id, data)
+    _journal({"op": "user", "id": user_id, "data": data})
+    _profile_changed(user_id)
 
-def get_active_chats() -> Dict[str, str]:
-    """Get active chats."""
-    global active_chats_cache
-    
-    if not active_chats_cache:
+def add_profile_listener(callback: Callable[[Optional[int]], None]) -> None:
+    """Register a callback for profile changes made through this module."""
+    profile_listeners.append(callback)
+
+def _profile_changed(user_id: Optional[int]) -> None:
+    for callback in profile_listeners:
         try:
-            # Try to load from file
-            if os.path.exists("active_chats.json"):
-                with open("active_chats.json", "r") as f:
-                    active_chats_cache = json.load(f)
-                    
-                # Validate loaded chats
-                valid_chats = {}
-                for user_id, partner_id in active_chats_cache.items():
-                    if partner_id in active_chats_cache and active_chats_cache[partner_id] == user_id:
-                        valid_chats[user_id] = partner_id
-                active_chats_cache = valid_chats
+            callback(user_id)
         except Exception as e:
-            logger.error(f"Error loading active chats from file: {e}")
-            active_chats_cache = {}
-    
-    return active_chats_cache
+            logger.error(f"Error in profile listener: {e}")
 
-def update_active_chats(active_chats: Dict[str, str]) -> None:
-    """Update active chats."""
-    global active_chats_cache
+def _get_journal() -> StateJournal:
+    """Open the chat/search journal and load the state it describes."""
+    global state_journal, active_chats_cache, searching_users_cache
     
-    # Validate chat pairs
-    valid_chats = {}
-    for user_id, partner_id in active_chats.items():
-        # Check if both users are connected to each other
-        if partner_id in active_chats and active_chats[partner_id] == user_id:
-            valid_chats[user_id] = partner_id
+    if state_journal is not None:
+        return state_journal
+    
+    state_journal = StateJournal(USER_DATA_DIR, checkpoint_every=JOURNAL_CHECKPOINT_EVERY, fmt=SNAPSHOT_FORMAT,
+                                 sync_interval=JOURNAL_SYNC_INTERVAL)
+    try:
+        if state_journal.has_checkpoint():
+            active_chats_cache, searching_users_cache = state_journal.load(load_user_data())
+        else:
+            active_chats_cache, searching_users_cache = _load_legacy_state()
+            state_journal.checkpoint(active_chats_cache, searching_users_cache)
+    except Exception as e:
+        logger.error(f"Error loading chat state: {e}")
+        active_chats_cache, searching_users_cache = {}, {}
     
-    active_chats_cache = valid_chats
+    # Validate loaded chats
+    active_chats_cache = {
+        user_id: partner_id for user_id, partner_id in active_chats_cache.items()
+        if active_chats_cache.get(partner_id) == user_id
+    }
     
+    # Remove any stale searches
+    current_time = time.time()
+    searching_users_cache = {
+        user_id: info for user_id, info in searching_users_cache.items()
+        if current_time - info.get("start_time", 0) <= 120
+    }
+    return state_journal
+
+def _load_legacy_state():
+    """Read active_chats.json and searching_users.json written by older versions."""
+    chats, searches = {}, {}
+    # Older versions wrote these files to the current directory instead of DATA_DIR
+    for directory in dict.fromkeys([USER_DATA_DIR, "."]):
+        chats_path = os.path.join(directory, "active_chats.json")
+        searches_path = os.path.join(directory, "searching_users.json")
+        try:
+            if not chats and os.path.exists(chats_path):
+                with open(chats_path, "r") as f:
+                    # Partners used to be stored as strings: {"123": "456"}
+                    chats = {int(user_id): int(partner_id) for user_id, partner_id in json.load(f).items()}
+                os.replace(chats_path, chats_path + ".migrated")
+                logger.info(f"Migrated {len(chats)} active chat entries from {chats_path}")
+            if not searches and os.path.exists(searches_path):
+                with open(searches_path, "r") as f:
+                    searches = _int_keys(json.load(f))
+                os.replace(searches_path, searches_path + ".migrated")
+                logger.info(f"Migrated {len(searches)} searches from {searches_path}")
+        except Exception as e:
+            logger.error(f"Error migrating legacy chat state from {directory}: {e}")
+    return chats, searches
+
+def _journal(record: Dict[str, Any]) -> None:
+    """Append a delta record, checkpointing when the journal gets long."""
+    journal = _get_journal()
     try:
-        # Try to save to file for persistence
-        with open("active_chats.json", "w") as f:
-            json.dump(active_chats_cache, f)
+        if journal.append(record):
+            checkpoint_state()
     except Exception as e:
-        logger.error(f"Error saving active chats to file: {e}")
+        logger.error(f"Error writing chat state journal: {e}")
 
-def get_searching_users() -> Dict[str, Any]:
+def sync_journal() -> None:
+    """Commit journal records still waiting for a group fsync."""
+    if state_journal is None:
+        return
+    try:
+        state_journal.sync()
+    except Exception as e:
+        logger.error(f"Error syncing chat state journal: {e}")
+
+def get_active_chats() -> Dict[int, int]:
+    """Get active chats."""
+    _get_journal()
+    return active_chats_cache
+
+def get_searching_users() -> Dict[int, Any]:
     """Get searching users."""
-    global searching_users_cache
+    _get_journal()
+    return searching_users_cache
+
+def record_pair(user_id: int, partner_id: int) -> None:
+    """Persist a new chat between two users."""
+    record = {"op": "pair", "a": user_id, "b": partner_id}
+    _get_journal()
+    apply_record(record, active_chats_cache, searching_users_cache)
+    _journal(record)
+
+def record_unpair(user_id: int, partner_id: int) -> None:
+    """Persist the end of a chat."""
+    record = {"op": "unpair", "a": user_id, "b": partner_id}
+    _get_journal()
+    apply_record(record, active_chats_cache, searching_users_cache)
+    _journal(record)
+
+def record_enqueue(user_id: int, entry: Dict[str, Any]) -> None:
+    """Persist a user joining the search queue."""
+    record = {"op": "enqueue", "user": user_id, "entry": entry}
+    _get_journal()
+    apply_record(record, active_chats_cache, searching_users_cache)
+    _journal(record)
+
+def record_dequeue(user_id: int) -> None:
+    """Persist a user leaving the search queue."""
+    record = {"op": "dequeue", "user": user_id}
+    _get_journal()
+    apply_record(record, active_chats_cache, searching_users_cache)
+    _journal(record)
+
+def update_active_chats(active_chats: Dict[int, int]) -> None:
+    """Replace all active chats and write a checkpoint."""
+    global active_chats_cache
+    journal = _get_journal()
     
-    if not searching_users_cache:
-        try:
-            # Try to load from file
-            if os.path.exists("searching_users.json"):
-                with open("searching_users.json", "r") as f:
-                    searching_users_cache = json.load(f)
-                    
-                # Remove any stale searches
-                current_time = time.time()
-                valid_searches = {
-                    user_id: info for user_id, info in searching_users_cache.items()
-                    if current_time - info.get("start_time", 0) <= 120
-                }
-                searching_users_cache = valid_searches
-        except Exception as e:
-            logger.error(f"Error loading searching users from file: {e}")
-            searching_users_cache = {}
+    # Validate chat pairs
+    active_chats_cache = {
+        user_id: partner_id for user_id, partner_id in active_chats.items()
+        if active_chats.get(partner_id) == user_id
+    }
     
-    return searching_users_cache
+    try:
+        journal.checkpoint(active_chats_cache, searching_users_cache)
+    except Exception as e:
+        logger.error(f"Error saving active chats: {e}")
 
-def update_searching_users(searching_users: Dict[str, Any]) -> None:
-    """Update searching users."""
+def update_searching_users(searching_users: Dict[int, Any]) -> None:
+    """Replace all searches and write a checkpoint."""
     global searching_users_cache
+    journal = _get_journal()
     
     # Remove any users that have been searching for too long (over 2 minutes)
     current_time = time.time()
-    valid_searches = {
+    searching_users_cache = {
         user_id: info for user_id, info in searching_users.items()
         if current_time - info.get("start_time", 0) <= 120
     }
     
-    searching_users_cache = valid_searches
-    
     try:
-        # Try to save to file for persistence
-        with open("searching_users.json", "w") as f:
-            json.dump(searching_users_cache, f)
+        journal.checkpoint(active_chats_cache, searching_users_cache)
+    except Exception as e:
+        logger.error(f"Error saving searching users: {e}")
+
+def checkpoint_state() -> None:
+    """Write the current chat and search state and empty the journal."""
+    try:
+        # Profile updates in the journal must be on disk before it is emptied
+        load_user_data().flush()
+        _get_journal().checkpoint(active_chats_cache, searching_users_cache)
+    except Exception as e:
+        logger.error(f"Error writing chat state checkpoint: {e}")
+
+class Transaction:
+    """Profile and chat-state changes committed as one journal record.
+
+    Nothing is visible to readers until commit(), which applies every change
+    and writes the record without yielding to the event loop, so readers see
+    either none or all of it.
+    """
+
+    def __init__(self):
+        self.users: Dict[int, Dict[str, Any]] = {}
+        self.changes: List[Dict[str, Any]] = []
+
+    def get_user(self, user_id: int) -> Dict[str, Any]:
+        """Return a private copy of the profile to modify inside the transaction."""
+        if user_id not in self.users:
+            self.users[user_id] = dict(get_user_data(user_id))
+        return self.users[user_id]
+
+    def update_user(self, user_id: int, data: Dict[str, Any]) -> None:
+        self.users[user_id] = data
+
+    def increment(self, user_id: int, field: str, delta: int = 1) -> None:
+        data = self.get_user(user_id)
+        data[field] = data.get(field, 0) + delta
+
+    def pair(self, user_id: int, partner_id: int) -> None:
+        self.changes.append({"op": "pair", "a": user_id, "b": partner_id})
+
+    def unpair(self, user_id: int, partner_id: int) -> None:
+        self.changes.append({"op": "unpair", "a": user_id, "b": partner_id})
+
+    def enqueue(self, user_id: int, entry: Dict[str, Any]) -> None:
+        self.changes.append({"op": "enqueue", "user": user_id, "entry": entry})
+
+    def dequeue(self, user_id: int) -> None:
+        self.changes.append({"op": "dequeue", "user": user_id})
+
+    def commit(self) -> None:
+        if not self.users and not self.changes:
+            return
+        record = {"op": "txn", "users": list(self.users.items()), "changes": self.changes}
+        store = load_user_data()
+        _get_journal()
+        apply_record(record, active_chats_cache, searching_users_cache, store)
+        _journal(record)
+        for user_id in self.users:
+            _profile_changed(user_id)
+
+@contextlib.contextmanager
+def transaction():
+    """Group several updates into one durable write.
+
+        with db.transaction() as txn:
+            txn.unpair(user_id, partner_id)
+            txn.increment(user_id, "total_chats")
+    """
+    txn = Transaction()
+    yield txn
+    txn.commit()
+
+def load_table(name: str) -> Dict[Any, Any]:
+    """Load a small named table (e.g. the media blocklist) from the data directory."""
+    path = os.path.join(USER_DATA_DIR, f"{name}.json")
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "rb") as f:
+            # Stored as [key, value] pairs so integer keys stay integers
+            return dict(snapshot.json_loads(f.read()))
     except Exception as e:
-        logger.error(f"Error saving searching users to file: {e}")
+        logger.error(f"Error loading {path}: {e}")
+        return {}
+
+def save_table(name: str, table: Dict[Any, Any]) -> None:
+    """Atomically write a small named table to the data directory."""
+    path = os.path.join(USER_DATA_DIR, f"{name}.json")
+    try:
+        os.makedirs(USER_DATA_DIR, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(snapshot.json_dumps(list(table.items())))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.error(f"Error saving {path}: {e}")
+
+def export_snapshot(path: str, fmt: str = "binary") -> None:
+    """Write users, active chats and searches to a single snapshot file."""
+    store = load_user_data()
+    snapshot.save_snapshot(path, {
+        "users": dict(store.items()),
+        "active_chats": get_active_chats(),
+        "searching_users": get_searching_users()
+    }, fmt)
+    logger.info(f"Exported {fmt} snapshot to {path}")
+
+def import_snapshot(path: str) -> None:
+    """Load users, active chats and searches from a snapshot file."""
+    state = snapshot.load_snapshot(path)
+    store = load_user_data()
+    store.bulk_load(state.get("users", {}))
+    _profile_changed(None)
+    update_active_chats(state.get("active_chats", {}))
+    update_searching_users(state.get("searching_users", {}))
+    logger.info(f"Imported snapshot from {path}")
 
 def init_db() -> None:
     """Initialize the database by loading user data."""
     load_user_data()
-    logger.info("Database initialized successfully") 
\ No newline at end of file
+    _get_journal()
+    logger.info("Database initialized successfully")
+
+def close_db() -> None:
+    """Flush everything to disk before shutdown."""
+    global user_store, state_journal
+    if state_journal is not None:
+        checkpoint_state()
+        state_journal.close()
+        state_journal = None
+    if user_store is not None:
+        user_store.close()
+        user_store = None 
\ No newline at end of file
@@ -0,0 +1,101 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Tuple, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Inbound limits per user and update kind as "kind=burst/seconds": up to
+# `burst` updates at once, refilled at burst/seconds per second
+DEFAULT_LIMITS = "text=20/10,media=10/10,sticker=5/10,callback=30/10,edit=10/10,other=10/10"
+FLOOD_LIMITS = os.environ.get("FLOOD_LIMITS", DEFAULT_LIMITS)
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Parse FLOOD_LIMITS into {kind: (burst, refill per second)}."""
+    limits = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        kind, rule = item.split("=")
+        burst, seconds = rule.split("/")
+        limits[kind.strip()] = (float(burst), float(burst) / float(seconds))
+    return limits
+
+def update_kind(update) -> Optional[str]:
+    """Classify an update for flood control; None for updates without a user."""
+    if update.callback_query:
+        return "callback"
+    if update.edited_message:
+        return "edit"
+    message = update.message
+    if message is None:
+        return None
+    if message.text:
+        return "text"
+    if message.sticker:
+        return "sticker"
+    if (message.photo or message.video or message.document or message.animation
+            or message.voice or message.audio or message.video_note):
+        return "media"
+    return "other"
+
+class FloodControl:
+    """Token buckets per user and update kind.
+
+    A bucket that has been idle long enough to refill completely is the same
+    as no bucket, so idle buckets are dropped from the front of an LRU dict
+    and memory only grows with the number of recently active users.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]]):
+        self.limits = limits
+        # Longest time any bucket needs to refill from empty
+        self.idle_after = max((burst / rate for burst, rate in limits.values()), default=0)
+        # (user_id, kind) -> [tokens, last update time]
+        self.buckets: "OrderedDict[Tuple[int, str], List[float]]" = OrderedDict()
+        self.allowed: Dict[str, int] = {kind: 0 for kind in limits}
+        self.shed: Dict[str, int] = {kind: 0 for kind in limits}
+
+    def allow(self, user_id: int, kind: str, now: Optional[float] = None) -> bool:
+        """Take one token for the update; False when the user is over the limit."""
+        limit = self.limits.get(kind)
+        if limit is None:
+            return True
+        if now is None:
+            now = time.monotonic()
+        burst, rate = limit
+
+        self._prune(now)
+        key = (user_id, kind)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [burst, now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            self.buckets.move_to_end(key)
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            self.allowed[kind] += 1
+            return True
+        self.shed[kind] += 1
+        return False
+
+    def _prune(self, now: float) -> None:
+        while self.buckets:
+            key, bucket = next(iter(self.buckets.items()))
+            if now - bucket[1] < self.idle_after:
+                break
+            del self.buckets[key]
+
+    def stats(self) -> Dict[str, Tuple[int, int]]:
+        """{kind: (allowed, shed)} since the last reset."""
+        return {kind: (self.allowed[kind], self.shed[kind]) for kind in self.limits}
+
+    def reset_stats(self) -> None:
+        for kind in self.limits:
+            self.allowed[kind] = 0
+            self.shed[kind] = 0
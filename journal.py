@@ -0,0 +1,150 @@
+import os
+import time
+import logging
+from typing import Dict, Any, Tuple
+
+import snapshot
+
+logger = logging.getLogger(__name__)
+
+class StateJournal:
+    """Append-only log of state changes with periodic checkpoints.
+
+    Each pair/unpair/enqueue/dequeue and each profile update is one small
+    record appended to the journal, so a state change costs O(1) I/O.
+    Several changes can be grouped into one "txn" record that is written
+    and replayed as a unit. Every `checkpoint_every` records the chat and
+    search state is written to a snapshot and the journal is truncated.
+    On startup the state is rebuilt from the last checkpoint plus the journal.
+
+    A record is committed once it is fsynced. Records are flushed to the OS
+    as they are appended, which survives a crash of the process; the fsync
+    is shared by all records appended within `sync_interval` seconds (group
+    commit), so after a power loss at most that much is lost. The owner
+    calls `sync` on a timer to commit the tail once appends stop.
+    """
+
+    def __init__(self, data_dir: str, checkpoint_every: int = 1000, fmt: str = "binary",
+                 sync_interval: float = 0.0):
+        self.journal_path = os.path.join(data_dir, "state.journal")
+        self.checkpoint_path = os.path.join(data_dir, "state.snap")
+        self.checkpoint_every = checkpoint_every
+        self.format = fmt
+        self.sync_interval = sync_interval
+        self.records_since_checkpoint = 0
+        self.file = None
+        self.unsynced = False
+        self.last_sync = 0.0
+        os.makedirs(data_dir, exist_ok=True)
+
+    def has_checkpoint(self) -> bool:
+        return os.path.exists(self.checkpoint_path) or os.path.exists(self.journal_path)
+
+    def load(self, users=None) -> Tuple[Dict[int, int], Dict[int, Any]]:
+        """Rebuild active chats and searches from the checkpoint and the journal.
+
+        Profile updates found in the journal are replayed into `users`.
+        """
+        chats: Dict[int, int] = {}
+        searches: Dict[int, Any] = {}
+
+        if os.path.exists(self.checkpoint_path):
+            state = snapshot.load_snapshot(self.checkpoint_path)
+            chats = state.get("active_chats", {})
+            searches = state.get("searching_users", {})
+
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            valid_end = 0
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        apply_record(snapshot.json_loads(line), chats, searches, users)
+                    except Exception as e:
+                        logger.error(f"Stopping journal replay at unreadable record: {e}")
+                        break
+                    valid_end += len(line)
+                    replayed += 1
+            # Drop a torn record left by a crash mid-write
+            if valid_end != os.path.getsize(self.journal_path):
+                logger.warning(f"Truncating journal {self.journal_path} to {valid_end} bytes")
+                with open(self.journal_path, "r+b") as f:
+                    f.truncate(valid_end)
+
+        self.records_since_checkpoint = replayed
+        logger.info(f"Loaded {len(chats)} chat entries and {len(searches)} searches ({replayed} journal records)")
+        return chats, searches
+
+    def append(self, record: Dict[str, Any]) -> bool:
+        """Append one record; returns True when a checkpoint is due.
+
+        The record is fsynced right away unless another sync happened less
+        than `sync_interval` seconds ago; then it waits for the next `sync`.
+        """
+        if self.file is None:
+            self.file = open(self.journal_path, "ab")
+        self.file.write(snapshot.json_dumps(record) + b"\n")
+        self.file.flush()
+        self.unsynced = True
+        if time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+        self.records_since_checkpoint += 1
+        return self.records_since_checkpoint >= self.checkpoint_every
+
+    def sync(self) -> None:
+        """Commit the records appended since the last sync."""
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+        self.unsynced = False
+        self.last_sync = time.monotonic()
+
+    def checkpoint(self, chats: Dict[int, int], searches: Dict[int, Any]) -> None:
+        """Write the full state and start a new, empty journal."""
+        snapshot.save_snapshot(self.checkpoint_path, {
+            "active_chats": chats,
+            "searching_users": searches
+        }, self.format)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        # The snapshot is fsynced and already contains everything the journal had
+        open(self.journal_path, "wb").close()
+        self.unsynced = False
+        self.records_since_checkpoint = 0
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+def apply_record(record: Dict[str, Any], chats: Dict[int, int], searches: Dict[int, Any], users=None) -> None:
+    """Apply one journal record to the chat and search dicts and the user store."""
+    op = record["op"]
+    if op == "txn":
+        # Profiles are stored as [user_id, data] pairs so IDs stay integers
+        for user_id, data in record["users"]:
+            if users is not None:
+                users.put(user_id, data)
+        for change in record["changes"]:
+            apply_record(change, chats, searches, users)
+    elif op == "user":
+        if users is not None:
+            users.put(record["id"], record["data"])
+    elif op == "pair":
+        chats[record["a"]] = record["b"]
+        chats[record["b"]] = record["a"]
+    elif op == "unpair":
+        # Only drop entries that still point at each other
+        if chats.get(record["a"]) == record["b"]:
+            del chats[record["a"]]
+        if chats.get(record["b"]) == record["a"]:
+            del chats[record["b"]]
+    elif op == "enqueue":
+        searches[record["user"]] = record["entry"]
+    elif op == "dequeue":
+        searches.pop(record["user"], None)
+    else:
+        raise ValueError(f"Unknown journal op: {op}")
@@ -0,0 +1,217 @@
+import math
+import random
+from collections import OrderedDict, deque
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from records import interests_to_mask
+
+# Reputation tiers stored on the profile as "tier"
+TIER_LOW, TIER_NORMAL, TIER_HIGH = 0, 1, 2
+# Votes needed before a user can leave the normal tier
+TIER_MIN_VOTES = 5
+# Wilson lower bounds separating the tiers
+TIER_LOW_BELOW = 0.2
+TIER_HIGH_FROM = 0.7
+# 95% confidence
+WILSON_Z = 1.96
+
+# Score added per interest two users share
+INTEREST_WEIGHT = 2
+
+# Chance to pick among the top three candidates instead of the best one
+RANDOM_PICK_CHANCE = 0.3
+
+# Partners remembered per user to avoid rematching them right away
+RECENT_PARTNERS = 5
+RECENT_PAIR_TTL = 600
+# After this long in the queue a recent partner is better than nobody
+RECENT_RELAX_AFTER = 15
+
+def wilson_lower_bound(positive: int, total: int, z: float = WILSON_Z) -> float:
+    """Lower bound of the Wilson score interval for the share of positive votes."""
+    if total <= 0:
+        return 0.0
+    share = positive / total
+    z2 = z * z
+    centre = share + z2 / (2 * total)
+    margin = z * math.sqrt((share * (1 - share) + z2 / (4 * total)) / total)
+    return (centre - margin) / (1 + z2 / total)
+
+def reputation_tier(reputation: float, total: int) -> int:
+    if total < TIER_MIN_VOTES:
+        return TIER_NORMAL
+    if reputation < TIER_LOW_BELOW:
+        return TIER_LOW
+    if reputation >= TIER_HIGH_FROM:
+        return TIER_HIGH
+    return TIER_NORMAL
+
+def apply_votes(profile: Dict[str, Any], positive: int = 0, negative: int = 0) -> None:
+    """Add votes to a profile and update its reputation and tier in place.
+
+    `rating` stays the net score and `rating_count` the number of votes, as
+    before, so the positive count is (rating + rating_count) / 2.
+    """
+    profile["rating"] = profile.get("rating", 0) + positive - negative
+    profile["rating_count"] = profile.get("rating_count", 0) + positive + negative
+    total = profile["rating_count"]
+    reputation = wilson_lower_bound((profile["rating"] + total) // 2, total)
+    profile["reputation"] = round(reputation, 4)
+    profile["tier"] = reputation_tier(reputation, total)
+
+def interest_mask(interests: Optional[List[str]]) -> int:
+    """Encode profile interests with the snapshot bit assignment; unknown names are ignored."""
+    return interests_to_mask(interests or [], strict=False)
+
+def pool(tier: int) -> int:
+    """Low-reputation users are matched among themselves; everyone else shares a pool."""
+    return 0 if tier == TIER_LOW else 1
+
+def index_key(entry: Dict[str, Any]) -> int:
+    return pool(entry.get("tier", TIER_NORMAL))
+
+def match_score(entry: Dict[str, Any], partner: Dict[str, Any], now: float) -> int:
+    """Score a candidate for a searching user (higher is better)."""
+    score = 0
+    user_gender, partner_gender = entry.get("gender"), partner.get("gender")
+    user_age, partner_age = entry.get("age"), partner.get("age")
+
+    # If both users have gender set and they're opposite, increase score
+    if user_gender and partner_gender and user_gender != partner_gender:
+        score += 3
+
+    # If both users have age set and they're close, increase score
+    if user_age and partner_age:
+        age_diff = abs(user_age - partner_age)
+        if age_diff <= 3:
+            score += 2
+        elif age_diff <= 5:
+            score += 1
+
+    # Shared interests: one AND and a popcount, however many interests exist
+    shared = entry.get("interests", 0) & partner.get("interests", 0)
+    score += INTEREST_WEIGHT * shared.bit_count()
+
+    # Add waiting time bonus (longer waiting = higher chance)
+    partner_waiting_time = now - partner.get("start_time", now)
+    if partner_waiting_time > 60:  # Waiting more than 1 minute
+        score += 2
+    elif partner_waiting_time > 30:  # Waiting more than 30 seconds
+        score += 1
+
+    return score
+
+def pick_partner(user_id: int, entry: Dict[str, Any], candidates: Iterable[Tuple[int, Dict[str, Any]]],
+                 now: float, rng: random.Random = random,
+                 recent: Optional["RecentPairs"] = None, waited: float = 0) -> Optional[Tuple[int, int]]:
+    """Choose a partner among candidates; returns (partner_id, score) or None.
+
+    Recent partners are passed over while anyone else is available, and
+    after RECENT_RELAX_AFTER seconds of waiting also when nobody else is.
+    """
+    potential_partners = []
+    recent_partners = []
+    for partner_id, partner in candidates:
+        if partner_id == user_id:
+            continue
+        scored = (partner_id, match_score(entry, partner, now))
+        if recent is not None and recent.met(user_id, partner_id, now):
+            recent_partners.append(scored)
+        else:
+            potential_partners.append(scored)
+    if not potential_partners and waited >= RECENT_RELAX_AFTER:
+        potential_partners = recent_partners
+    if not potential_partners:
+        return None
+
+    # Sort by score (highest first)
+    potential_partners.sort(key=lambda x: x[1], reverse=True)
+
+    # Prefer higher scores but allow some randomness
+    if len(potential_partners) > 3 and rng.random() < RANDOM_PICK_CHANCE:
+        return rng.choice(potential_partners[:3])
+    return potential_partners[0]
+
+class RecentPairs:
+    """The last few partners of each user, forgotten after RECENT_PAIR_TTL.
+
+    Each user has a small ring of (partner, time), so a check looks at no
+    more than RECENT_PARTNERS entries. Users are kept in order of their last
+    match, so users whose whole ring has expired are dropped from the front.
+    """
+
+    def __init__(self, size: int = RECENT_PARTNERS, ttl: float = RECENT_PAIR_TTL):
+        self.size = size
+        self.ttl = ttl
+        # user_id -> deque of (partner_id, matched at)
+        self.rings: "OrderedDict[int, deque]" = OrderedDict()
+
+    def add(self, user_id: int, partner_id: int, now: float) -> None:
+        """Remember a match for both users."""
+        self._prune(now)
+        for a, b in ((user_id, partner_id), (partner_id, user_id)):
+            ring = self.rings.get(a)
+            if ring is None:
+                ring = self.rings[a] = deque(maxlen=self.size)
+            else:
+                self.rings.move_to_end(a)
+            ring.append((b, now))
+
+    def met(self, user_id: int, partner_id: int, now: float) -> bool:
+        ring = self.rings.get(user_id)
+        if not ring:
+            return False
+        for other_id, matched_at in ring:
+            if other_id == partner_id and now - matched_at < self.ttl:
+                return True
+        return False
+
+    def _prune(self, now: float) -> None:
+        while self.rings:
+            user_id, ring = next(iter(self.rings.items()))
+            if now - ring[-1][1] < self.ttl:
+                break
+            del self.rings[user_id]
+
+    def __len__(self) -> int:
+        return len(self.rings)
+
+class SearchIndex:
+    """Searching users bucketed by index key.
+
+    A searcher only ever sees the bucket of its own key, so the filtering
+    the key encodes (e.g. reputation pools) costs nothing per candidate.
+    """
+
+    def __init__(self):
+        self.buckets: Dict[int, Dict[int, Dict[str, Any]]] = {}
+        self.keys: Dict[int, int] = {}
+
+    def add(self, user_id: int, entry: Dict[str, Any]) -> None:
+        self.remove(user_id)
+        key = index_key(entry)
+        self.keys[user_id] = key
+        self.buckets.setdefault(key, {})[user_id] = entry
+
+    def remove(self, user_id: int) -> None:
+        key = self.keys.pop(user_id, None)
+        if key is None:
+            return
+        bucket = self.buckets[key]
+        del bucket[user_id]
+        if not bucket:
+            del self.buckets[key]
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        key = self.keys.get(user_id)
+        return None if key is None else self.buckets[key][user_id]
+
+    def candidates(self, entry: Dict[str, Any]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Searchers that may be matched with `entry`, including its own user."""
+        return iter(self.buckets.get(index_key(entry), {}).items())
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.keys
+
+    def __len__(self) -> int:
+        return len(self.keys)
@@ -0,0 +1,33 @@
+import time
+from typing import Dict, Optional
+
+class MediaBlocklist:
+    """Telegram file_unique_ids that must not be relayed.
+
+    A check is one lookup in the exact table, which is also what gets
+    persisted (the "media_blocklist" table) and replicated between workers.
+    """
+
+    def __init__(self, ids: Optional[Dict[str, float]] = None):
+        # file_unique_id -> when it was blocked
+        self.ids: Dict[str, float] = ids if ids is not None else {}
+
+    def __contains__(self, file_unique_id: str) -> bool:
+        return file_unique_id in self.ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, file_unique_id: str) -> bool:
+        """Block an ID; returns False if it was already blocked."""
+        if file_unique_id in self.ids:
+            return False
+        self.ids[file_unique_id] = time.time()
+        return True
+
+    def remove(self, file_unique_id: str) -> bool:
+        """Unblock an ID; returns False if it wasn't blocked."""
+        if file_unique_id not in self.ids:
+            return False
+        del self.ids[file_unique_id]
+        return True
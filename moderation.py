@@ -0,0 +1,111 @@
+import os
+import time
+import heapq
+from typing import Dict, Any, List, Tuple, Optional
+
+# Ban lengths offered to admins when reviewing reports, in seconds (0 = forever)
+BAN_DURATIONS = [(24 * 3600, "1 день"), (7 * 24 * 3600, "7 дней"), (0, "Навсегда")]
+# Reports about one user before admins are alerted
+REPORT_ALERT_THRESHOLD = int(os.environ.get("REPORT_ALERT_THRESHOLD", "3"))
+# Reporter IDs kept per reported user
+MAX_REPORTERS = 50
+
+class BanList:
+    """Banned users with their ban expiry.
+
+    `until` maps user ID to the time the ban ends (0 for a permanent ban), so
+    checking a user is one dict lookup. Timed bans also sit in a heap ordered
+    by expiry, which lets `purge` drop finished bans without scanning.
+    """
+
+    def __init__(self, until: Optional[Dict[int, float]] = None):
+        self.until: Dict[int, float] = until if until is not None else {}
+        self.heap: List[Tuple[float, int]] = []
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        """Recreate the expiry heap from `until`."""
+        self.heap = [(expires, user_id) for user_id, expires in self.until.items() if expires]
+        heapq.heapify(self.heap)
+
+    def added(self, user_id: int) -> None:
+        """Account for a ban that was put into `until` directly (e.g. by replication)."""
+        expires = self.until.get(user_id)
+        if expires:
+            heapq.heappush(self.heap, (expires, user_id))
+
+    def is_banned(self, user_id: int, now: Optional[float] = None) -> bool:
+        expires = self.until.get(user_id)
+        if expires is None:
+            return False
+        if expires and expires <= (now if now is not None else time.time()):
+            # The heap entry is dropped by the next purge
+            del self.until[user_id]
+            return False
+        return True
+
+    def ban(self, user_id: int, duration: float, now: Optional[float] = None) -> float:
+        """Ban a user for `duration` seconds (0 = forever); returns the expiry."""
+        expires = (now if now is not None else time.time()) + duration if duration else 0
+        self.until[user_id] = expires
+        self.added(user_id)
+        return expires
+
+    def unban(self, user_id: int) -> bool:
+        """Lift a ban; returns False if the user wasn't banned."""
+        if user_id not in self.until:
+            return False
+        del self.until[user_id]
+        return True
+
+    def purge(self, now: Optional[float] = None) -> List[int]:
+        """Remove expired bans; returns the users whose ban ended."""
+        if now is None:
+            now = time.time()
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            expires, user_id = heapq.heappop(self.heap)
+            # Skip entries of bans that were lifted or replaced since
+            if self.until.get(user_id) == expires:
+                del self.until[user_id]
+                expired.append(user_id)
+        return expired
+
+    def __len__(self) -> int:
+        return len(self.until)
+
+class ReportQueue:
+    """Pending reports waiting for admin review, one entry per reported user."""
+
+    def __init__(self, reports: Optional[Dict[int, Dict[str, Any]]] = None):
+        # reported user ID -> {"reporters": [...], "first": time, "last": time}
+        self.reports: Dict[int, Dict[str, Any]] = reports if reports is not None else {}
+
+    def add(self, reporter_id: int, reported_id: int, now: Optional[float] = None) -> int:
+        """File a report; returns the number of distinct reporters, or 0 for a repeat."""
+        if now is None:
+            now = time.time()
+        entry = self.reports.get(reported_id)
+        if entry is None:
+            entry = {"reporters": [], "first": now, "last": now}
+        elif reporter_id in entry["reporters"]:
+            return 0
+        entry["reporters"] = (entry["reporters"] + [reporter_id])[-MAX_REPORTERS:]
+        entry["last"] = now
+        # Reassign so the change is published when the table is replicated
+        self.reports[reported_id] = entry
+        return len(entry["reporters"])
+
+    def pending(self, limit: int = 10) -> List[Tuple[int, Dict[str, Any]]]:
+        """Most reported users first."""
+        return sorted(self.reports.items(), key=lambda item: (-len(item[1]["reporters"]), item[1]["first"]))[:limit]
+
+    def resolve(self, reported_id: int) -> bool:
+        """Close the reports about a user; returns False if there were none."""
+        if reported_id not in self.reports:
+            return False
+        del self.reports[reported_id]
+        return True
+
+    def __len__(self) -> int:
+        return len(self.reports)
@@ -0,0 +1,51 @@
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# Remembered relayed messages per chat; older ones are forgotten first
+MESSAGE_MAP_SIZE = int(os.environ.get("MESSAGE_MAP_SIZE", "200"))
+
+class MessageMap:
+    """Links each relayed message to its copy in the partner's chat.
+
+    Every relay is stored in both directions, so an edit of the original
+    and a reply to either copy can be resolved with one dict lookup. Each
+    chat keeps at most `max_per_chat` links in LRU order, so long chats
+    don't grow memory, and a chat's links are dropped when it ends.
+    """
+
+    def __init__(self, max_per_chat: int = MESSAGE_MAP_SIZE):
+        self.max_per_chat = max_per_chat
+        # chat_id -> {message_id: (other_chat_id, other_message_id)}
+        self.chats: Dict[int, "OrderedDict[int, Tuple[int, int]]"] = {}
+
+    def __len__(self) -> int:
+        return sum(len(links) for links in self.chats.values())
+
+    def add(self, chat_id: int, message_id: int, other_chat_id: int, other_message_id: int) -> None:
+        """Record that `message_id` in `chat_id` was relayed as `other_message_id`."""
+        self._link(chat_id, message_id, (other_chat_id, other_message_id))
+        self._link(other_chat_id, other_message_id, (chat_id, message_id))
+
+    def _link(self, chat_id: int, message_id: int, target: Tuple[int, int]) -> None:
+        links = self.chats.get(chat_id)
+        if links is None:
+            links = self.chats[chat_id] = OrderedDict()
+        links[message_id] = target
+        links.move_to_end(message_id)
+        if len(links) > self.max_per_chat:
+            links.popitem(last=False)
+
+    def lookup(self, chat_id: int, message_id: int) -> Optional[Tuple[int, int]]:
+        """Return (other_chat_id, other_message_id) for a message, if still known."""
+        links = self.chats.get(chat_id)
+        if links is None:
+            return None
+        target = links.get(message_id)
+        if target is not None:
+            links.move_to_end(message_id)
+        return target
+
+    def drop(self, chat_id: int) -> None:
+        """Forget all links of a chat."""
+        self.chats.pop(chat_id, None)
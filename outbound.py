@@ -0,0 +1,308 @@
+import os
+import time
+import random
+import asyncio
+import datetime
+import contextlib
+import logging
+from collections import OrderedDict, deque
+from typing import Dict, Any, Callable, Awaitable, List, Optional
+
+import telegram
+
+from timing_wheel import TimingWheel
+
+logger = logging.getLogger(__name__)
+
+# Telegram shows a chat action for up to 5 seconds or until the next message
+CHAT_ACTION_WINDOW = 5.0
+
+# Attempts per message before it is dead-lettered, and the backoff between them
+SEND_ATTEMPTS = int(os.environ.get("SEND_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+# Failed messages kept for inspection
+DEAD_LETTER_SIZE = int(os.environ.get("DEAD_LETTER_SIZE", "1000"))
+
+# Errors meaning the user blocked the bot; older library versions call it Unauthorized
+BLOCKED_ERRORS = tuple(
+    error for error in (telegram.error.Forbidden, getattr(telegram.error, "Unauthorized", None))
+    if error is not None
+)
+
+class RecipientBlocked(telegram.error.Forbidden):
+    """Raised without calling the API for chats known to have blocked the bot."""
+
+def failure_reason(error: Exception) -> str:
+    """Reason code stored with a dead letter."""
+    if isinstance(error, telegram.error.RetryAfter):
+        return "rate_limited"
+    if isinstance(error, telegram.error.TimedOut):
+        return "timed_out"
+    if isinstance(error, telegram.error.NetworkError):
+        return "network_error"
+    if isinstance(error, BLOCKED_ERRORS):
+        return "forbidden"
+    if isinstance(error, telegram.error.BadRequest):
+        return "bad_request"
+    return "error"
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for the given retry number (0-based)."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+def retry_after_seconds(error: telegram.error.RetryAfter) -> float:
+    """Seconds to wait from a RetryAfter error (int or timedelta depending on the library version)."""
+    retry_after = error.retry_after
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+class Outbound:
+    """Gate for messages sent to users.
+
+    Handlers never wait on a retry: the first attempt is made in line and
+    anything that has to be retried goes to a background sender per chat,
+    so one recipient's flood wait doesn't hold up updates from other users.
+
+    When Telegram answers a send with RetryAfter the chat is paused: later
+    sends to it are queued until a timer on the wheel resumes the chat,
+    instead of each hitting the flood limit again. Flood-control and network
+    failures are retried with jittered exponential backoff up to `attempts`
+    times. Sends to one chat go out in call order, so a message being
+    retried is never overtaken by a later one. Messages that fail for good
+    are kept in a bounded dead-letter queue.
+
+    Chats that answer with Forbidden are added to `blocked` (a dict that can
+    be shared between workers) and `on_blocked` is called once; later sends
+    to them fail at once with RecipientBlocked.
+    """
+
+    def __init__(self, wheel: TimingWheel, action_window: float = CHAT_ACTION_WINDOW,
+                 attempts: int = SEND_ATTEMPTS, dead_letter_size: int = DEAD_LETTER_SIZE):
+        self.wheel = wheel
+        self.action_window = action_window
+        self.attempts = attempts
+        # chat_id -> [lock, number of sends holding or waiting for it]
+        self.chat_locks: Dict[int, List[Any]] = {}
+        # chat_id -> queued [method, kwargs, attempts, dead_letter, on_sent, attempts made]
+        self.queues: Dict[int, deque] = {}
+        # chat_id -> background task draining the chat's queue
+        self.workers: Dict[int, asyncio.Future] = {}
+        self.dead_letters: deque = deque(maxlen=dead_letter_size)
+        self.dead_letter_counts: Dict[str, int] = {}
+        self.retries = 0
+        # chat_id -> when the chat was found to have blocked the bot
+        self.blocked: Dict[int, float] = {}
+        self.on_blocked: Optional[Callable[[int], Any]] = None
+        self.skipped_blocked = 0
+        # chat_id -> (event set on resume, timer that resumes the chat)
+        self.paused: Dict[int, Any] = {}
+        # chat_id -> when the last chat action was sent, oldest first
+        self.last_action: "OrderedDict[int, float]" = OrderedDict()
+
+    def is_paused(self, chat_id: int) -> bool:
+        return chat_id in self.paused
+
+    def pause(self, chat_id: int, seconds: float) -> None:
+        """Hold sends to a chat for `seconds`."""
+        entry = self.paused.get(chat_id)
+        if entry is None:
+            event = asyncio.Event()
+        else:
+            event, timer = entry
+            timer.cancel()
+        timer = self.wheel.call_later(seconds, self.resume, chat_id)
+        self.paused[chat_id] = (event, timer)
+        logger.warning(f"Pausing sends to chat {chat_id} for {seconds:.1f}s")
+
+    def resume(self, chat_id: int) -> None:
+        entry = self.paused.pop(chat_id, None)
+        if entry is not None:
+            event, timer = entry
+            timer.cancel()
+            event.set()
+
+    async def wait(self, chat_id: int) -> None:
+        """Wait until sends to the chat are allowed (used by the background senders)."""
+        while chat_id in self.paused:
+            await self.paused[chat_id][0].wait()
+
+    @contextlib.asynccontextmanager
+    async def _chat_lock(self, chat_id: int):
+        """Serialize API calls to one chat; the lock is dropped when nobody holds or waits for it."""
+        entry = self.chat_locks.get(chat_id)
+        if entry is None:
+            entry = self.chat_locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.chat_locks[chat_id]
+
+    def _retryable(self, error: Exception, chat_id: int) -> bool:
+        """Whether another attempt may succeed; pauses or blocks the chat as a side effect."""
+        if isinstance(error, telegram.error.RetryAfter):
+            self.pause(chat_id, retry_after_seconds(error))
+            return True
+        if isinstance(error, BLOCKED_ERRORS):
+            self.mark_blocked(chat_id)
+            return False
+        # Includes TimedOut; BadRequest is a subclass but will fail again
+        return isinstance(error, telegram.error.NetworkError) and not isinstance(error, telegram.error.BadRequest)
+
+    async def send(self, method: Callable[..., Awaitable[Any]], chat_id: int,
+                   attempts: Optional[int] = None, dead_letter: bool = True,
+                   on_sent: Optional[Callable[[Any], Any]] = None, **kwargs) -> Any:
+        """Call a Bot method for `chat_id` without ever waiting on a pause or a backoff.
+
+        The first attempt is made right away and its result returned. If it
+        fails with a flood-control or network error, or if the chat is paused
+        or still has queued sends, the message is queued for the chat's
+        background sender and None is returned: it is retried there in order
+        and `on_sent(result)` is called once it goes out. Errors that won't go
+        away (BadRequest, Forbidden) are raised at once.
+
+        Pass attempts=1 and dead_letter=False for messages that are only
+        useful right now, such as timer edits and chat actions; those are
+        dropped instead of queued.
+        """
+        if chat_id in self.blocked:
+            self.skipped_blocked += 1
+            raise RecipientBlocked(f"Chat {chat_id} has blocked the bot")
+        if attempts is None:
+            attempts = self.attempts
+        job = [method, kwargs, attempts, dead_letter, on_sent, 0]
+
+        async with self._chat_lock(chat_id):
+            # Never overtake a queued message
+            if chat_id in self.queues or chat_id in self.paused:
+                if attempts > 1:
+                    self._enqueue(chat_id, job)
+                return None
+            try:
+                result = await method(chat_id=chat_id, **kwargs)
+            except Exception as e:
+                if attempts > 1 and self._retryable(e, chat_id):
+                    job[5] = 1
+                    self._enqueue(chat_id, job)
+                    return None
+                if dead_letter and not isinstance(e, telegram.error.BadRequest):
+                    self._dead_letter(method, chat_id, kwargs, e)
+                raise
+
+        self._sent(on_sent, result)
+        return result
+
+    def _enqueue(self, chat_id: int, job: List[Any]) -> None:
+        queue = self.queues.get(chat_id)
+        if queue is None:
+            queue = self.queues[chat_id] = deque()
+            self.workers[chat_id] = asyncio.ensure_future(self._drain(chat_id))
+        queue.append(job)
+
+    def _sent(self, on_sent: Optional[Callable[[Any], Any]], result: Any) -> None:
+        if on_sent is None:
+            return
+        try:
+            on_sent(result)
+        except Exception as e:
+            logger.error(f"Error in on_sent callback: {e}")
+
+    async def _drain(self, chat_id: int) -> None:
+        """Background sender: retry a chat's queued messages in order."""
+        queue = self.queues[chat_id]
+        try:
+            while queue:
+                method, kwargs, attempts, dead_letter, on_sent, attempt = queue[0]
+                error: Optional[Exception] = None
+                while attempt < attempts:
+                    if chat_id in self.blocked:
+                        self.skipped_blocked += 1
+                        error = RecipientBlocked(f"Chat {chat_id} has blocked the bot")
+                        break
+                    await self.wait(chat_id)
+                    if attempt:
+                        self.retries += 1
+                        logger.warning(f"Retrying {getattr(method, '__name__', 'send')} to {chat_id} "
+                                       f"(attempt {attempt + 1}/{attempts})")
+                    async with self._chat_lock(chat_id):
+                        try:
+                            result = await method(chat_id=chat_id, **kwargs)
+                        except Exception as e:
+                            error = e
+                        else:
+                            error = None
+                    attempt += 1
+                    if error is None:
+                        self._sent(on_sent, result)
+                        break
+                    if not self._retryable(error, chat_id):
+                        break
+                    if attempt < attempts and not isinstance(error, telegram.error.RetryAfter):
+                        await self.wheel.sleep(backoff_delay(attempt - 1))
+                if error is not None and dead_letter and not isinstance(error, telegram.error.BadRequest):
+                    self._dead_letter(method, chat_id, kwargs, error)
+                queue.popleft()
+        finally:
+            del self.queues[chat_id]
+            self.workers.pop(chat_id, None)
+
+    def mark_blocked(self, chat_id: int) -> None:
+        """Remember that a chat can't be reached and let the owner tear it down."""
+        if chat_id in self.blocked:
+            return
+        self.blocked[chat_id] = time.time()
+        logger.warning(f"Chat {chat_id} has blocked the bot, skipping further sends")
+        if self.on_blocked is not None:
+            result = self.on_blocked(chat_id)
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
+
+    def unblock(self, chat_id: int) -> None:
+        """Allow sends to a chat again (the user came back with /start)."""
+        self.blocked.pop(chat_id, None)
+
+    def _dead_letter(self, method: Callable, chat_id: int, kwargs: Dict[str, Any], error: Exception) -> None:
+        reason = failure_reason(error)
+        self.dead_letters.append({
+            "time": time.time(),
+            "chat_id": chat_id,
+            "method": getattr(method, "__name__", str(method)),
+            "kwargs": kwargs,
+            "reason": reason,
+            "error": str(error)
+        })
+        self.dead_letter_counts[reason] = self.dead_letter_counts.get(reason, 0) + 1
+        logger.error(f"Dead-lettered {getattr(method, '__name__', 'send')} to {chat_id} ({reason}): {error}")
+
+    async def send_action(self, bot: telegram.Bot, chat_id: int, action: str) -> None:
+        """Show a chat action, at most once per action window and chat."""
+        now = time.monotonic()
+        # Entries are added in time order, so expired ones are at the front
+        while self.last_action:
+            oldest_chat, sent_at = next(iter(self.last_action.items()))
+            if now - sent_at < self.action_window:
+                break
+            del self.last_action[oldest_chat]
+
+        # A paused chat would only delay the message the action announces
+        if chat_id in self.last_action or chat_id in self.paused:
+            return
+        self.last_action[chat_id] = now
+        # Goes through the chat's send order like a message, so it can't land
+        # after the copy it announces; dropped if the chat has queued sends
+        await self.send(bot.send_chat_action, chat_id, attempts=1, dead_letter=False, action=action)
+
+    def close(self) -> None:
+        """Release everything waiting on a pause and stop the background senders."""
+        queued = sum(len(queue) for queue in self.queues.values())
+        if queued:
+            logger.warning(f"Dropping {queued} queued messages on shutdown")
+        for worker in list(self.workers.values()):
+            worker.cancel()
+        for chat_id in list(self.paused):
+            self.resume(chat_id)
@@ -0,0 +1,81 @@
+import os
+import time
+import secrets
+from typing import Dict, List, Tuple, Optional
+
+# How long the rating and report buttons of an ended chat stay valid
+RATING_TOKEN_TTL = int(os.environ.get("RATING_TOKEN_TTL", str(24 * 3600)))
+# Most tokens kept at once; the oldest are dropped first
+RATING_TOKEN_LIMIT = int(os.environ.get("RATING_TOKEN_LIMIT", "100000"))
+
+class TokenStore:
+    """One-time rating tokens for ended chats.
+
+    Each token names who may use it and whom it rates, so a callback can't
+    be forged for another user and a chat can be rated once. Tokens all live
+    for the same TTL, which makes insertion order expiry order: expired and
+    overflowing tokens are always at the front of the dict.
+    """
+
+    def __init__(self, tokens: Optional[Dict[str, List]] = None,
+                 ttl: float = RATING_TOKEN_TTL, limit: int = RATING_TOKEN_LIMIT):
+        # token -> [rater_id, rated_id, expires, voted]
+        self.tokens: Dict[str, List] = tokens if tokens is not None else {}
+        self.ttl = ttl
+        self.limit = limit
+
+    def issue(self, rater_id: int, rated_id: int, now: Optional[float] = None) -> str:
+        """Create a token letting `rater_id` rate or report `rated_id` once."""
+        if now is None:
+            now = time.time()
+        self._prune(now)
+        token = secrets.token_hex(8)
+        self.tokens[token] = [rater_id, rated_id, now + self.ttl, False]
+        return token
+
+    def get(self, token: str, rater_id: int, now: Optional[float] = None) -> Optional[int]:
+        """Return the rated user if `rater_id` holds a live token, else None."""
+        entry = self.tokens.get(token)
+        if entry is None or entry[0] != rater_id:
+            return None
+        if entry[2] <= (now if now is not None else time.time()):
+            return None
+        return entry[1]
+
+    def claim_vote(self, token: str, rater_id: int, now: Optional[float] = None) -> Optional[int]:
+        """Use the token's vote; returns the rated user, or None if it's invalid or used."""
+        rated_id = self.get(token, rater_id, now)
+        if rated_id is None or self.tokens[token][3]:
+            return None
+        # Reassign so the change is published when the store is replicated
+        self.tokens[token] = self.tokens[token][:3] + [True]
+        return rated_id
+
+    def _prune(self, now: float) -> None:
+        while self.tokens:
+            token, entry = next(iter(self.tokens.items()))
+            if entry[2] > now and len(self.tokens) < self.limit:
+                break
+            del self.tokens[token]
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+class VoteCounter:
+    """Votes accumulated between flushes, per rated user."""
+
+    def __init__(self):
+        # user_id -> [positive, negative]
+        self.pending: Dict[int, List[int]] = {}
+
+    def add(self, user_id: int, positive: bool) -> None:
+        counts = self.pending.setdefault(user_id, [0, 0])
+        counts[0 if positive else 1] += 1
+
+    def drain(self) -> Dict[int, Tuple[int, int]]:
+        """Return and reset the pending votes."""
+        pending, self.pending = self.pending, {}
+        return {user_id: (counts[0], counts[1]) for user_id, counts in pending.items()}
+
+    def __len__(self) -> int:
+        return len(self.pending)
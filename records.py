@@ -0,0 +1,230 @@
+import enum
+from typing import Dict, Any, Optional, List
+
+# Compact records for users, searches and chats, used to serialize state
+# (binary snapshots); the bot itself keeps plain dicts. Every record converts to and from the JSON shape stored by the database
+# module without losing anything: keys that were absent stay absent and
+# values the compact fields cannot represent are kept in `extra`.
+
+class Gender(enum.IntEnum):
+    UNSET = 0
+    MALE = 1
+    FEMALE = 2
+
+GENDER_CODES = {None: Gender.UNSET, "male": Gender.MALE, "female": Gender.FEMALE}
+GENDER_NAMES = {code: name for name, code in GENDER_CODES.items()}
+
+def gender_code(value: Any) -> Optional[Gender]:
+    """Code of a JSON gender value, or None if the compact field can't hold it."""
+    # Anything but a string or null may be a list or dict, which can't be looked up
+    if value is not None and not isinstance(value, str):
+        return None
+    return GENDER_CODES.get(value)
+
+class Interest(enum.IntFlag):
+    NONE = 0
+    FLIRT = 1
+    CHAT = 2
+
+# Canonical order of interests, used when rebuilding the JSON list
+INTEREST_CODES = {"flirt": Interest.FLIRT, "chat": Interest.CHAT}
+
+def interests_to_mask(interests: List[str], strict: bool = True) -> Optional[int]:
+    """Encode an interest list as a bitmask.
+
+    Strict encoding returns None if the list can't be rebuilt exactly from
+    the mask; otherwise unknown names are ignored (e.g. for matching).
+    """
+    mask = 0
+    for name in interests:
+        code = INTEREST_CODES.get(name) if isinstance(name, str) else None
+        if code is None or mask & code:
+            if strict:
+                return None
+            continue
+        mask |= code
+    if strict and mask_to_interests(mask) != interests:
+        return None
+    return mask
+
+def mask_to_interests(mask: int) -> List[str]:
+    """Decode an interest bitmask into the JSON list."""
+    return [name for name, code in INTEREST_CODES.items() if mask & code]
+
+class UserProfile:
+    """One user's profile."""
+
+    # Profile keys with a compact field, in JSON order
+    FIELDS = ("gender", "age", "interests", "chat_count", "total_chats",
+              "rating", "rating_count", "avatar", "join_date")
+
+    __slots__ = ("user_id", "present", "gender", "age", "interests", "chat_count",
+                 "total_chats", "rating", "rating_count", "avatar", "join_date", "extra")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.present = 0  # bit i set when FIELDS[i] is in the JSON dict
+        self.gender = Gender.UNSET
+        self.age: Optional[int] = None
+        self.interests = 0
+        self.chat_count = 0
+        self.total_chats = 0
+        self.rating = 0
+        self.rating_count = 0
+        self.avatar: Optional[str] = None
+        self.join_date: Optional[str] = None
+        self.extra: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_dict(cls, user_id: Any, data: Dict[str, Any]) -> "UserProfile":
+        """Build a record from the JSON profile dict."""
+        record = cls(int(user_id))
+        for key, value in data.items():
+            if key in _PROFILE_BITS and record._set_field(key, value):
+                record.present |= _PROFILE_BITS[key]
+            else:
+                if record.extra is None:
+                    record.extra = {}
+                record.extra[key] = value
+        return record
+
+    def _set_field(self, key: str, value: Any) -> bool:
+        if key == "gender":
+            code = gender_code(value)
+            if code is None:
+                return False
+            self.gender = code
+        elif key == "interests":
+            if not isinstance(value, list):
+                return False
+            mask = interests_to_mask(value)
+            if mask is None:
+                return False
+            self.interests = mask
+        elif key in ("age", "chat_count", "total_chats", "rating", "rating_count"):
+            if value is not None and type(value) is not int:
+                return False
+            if value is None and key != "age":
+                return False
+            setattr(self, key, value)
+        else:
+            if value is not None and not isinstance(value, str):
+                return False
+            setattr(self, key, value)
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert back to the JSON profile dict."""
+        data: Dict[str, Any] = {}
+        for key in self.FIELDS:
+            if not self.present & _PROFILE_BITS[key]:
+                continue
+            if key == "gender":
+                data[key] = GENDER_NAMES[self.gender]
+            elif key == "interests":
+                data[key] = mask_to_interests(self.interests)
+            else:
+                data[key] = getattr(self, key)
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __repr__(self) -> str:
+        return f"UserProfile({self.user_id}, {self.to_dict()!r})"
+
+_PROFILE_BITS = {key: 1 << i for i, key in enumerate(UserProfile.FIELDS)}
+
+class SearchEntry:
+    """One user waiting in the search queue."""
+
+    FIELDS = ("start_time", "message_id", "chat_id", "gender", "age")
+
+    __slots__ = ("user_id", "present", "start_time", "message_id", "chat_id",
+                 "gender", "age", "extra")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.present = 0
+        self.start_time = 0.0
+        self.message_id = 0
+        self.chat_id = 0
+        self.gender = Gender.UNSET
+        self.age: Optional[int] = None
+        self.extra: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_dict(cls, user_id: Any, data: Dict[str, Any]) -> "SearchEntry":
+        """Build a record from the JSON search entry."""
+        record = cls(int(user_id))
+        for key, value in data.items():
+            if key in _SEARCH_BITS and record._set_field(key, value):
+                record.present |= _SEARCH_BITS[key]
+            else:
+                if record.extra is None:
+                    record.extra = {}
+                record.extra[key] = value
+        return record
+
+    def _set_field(self, key: str, value: Any) -> bool:
+        if key == "gender":
+            code = gender_code(value)
+            if code is None:
+                return False
+            self.gender = code
+        elif key == "start_time":
+            if type(value) not in (int, float):
+                return False
+            self.start_time = value
+        elif key == "age":
+            if value is not None and type(value) is not int:
+                return False
+            self.age = value
+        else:
+            if type(value) is not int:
+                return False
+            setattr(self, key, value)
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert back to the JSON search entry."""
+        data: Dict[str, Any] = {}
+        for key in self.FIELDS:
+            if not self.present & _SEARCH_BITS[key]:
+                continue
+            if key == "gender":
+                data[key] = GENDER_NAMES[self.gender]
+            else:
+                data[key] = getattr(self, key)
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __repr__(self) -> str:
+        return f"SearchEntry({self.user_id}, {self.to_dict()!r})"
+
+_SEARCH_BITS = {key: 1 << i for i, key in enumerate(SearchEntry.FIELDS)}
+
+def profiles_from_json(data: Dict[str, Dict[str, Any]]) -> Dict[int, UserProfile]:
+    """Convert the user_data.json dict into records keyed by integer user ID."""
+    return {int(user_id): UserProfile.from_dict(user_id, info) for user_id, info in data.items()}
+
+def profiles_to_json(records: Dict[int, UserProfile]) -> Dict[str, Dict[str, Any]]:
+    """Convert records back into the user_data.json dict."""
+    return {str(user_id): record.to_dict() for user_id, record in records.items()}
+
+def searches_from_json(data: Dict[str, Dict[str, Any]]) -> Dict[int, SearchEntry]:
+    """Convert the searching_users.json dict into records keyed by integer user ID."""
+    return {int(user_id): SearchEntry.from_dict(user_id, info) for user_id, info in data.items()}
+
+def searches_to_json(records: Dict[int, SearchEntry]) -> Dict[str, Dict[str, Any]]:
+    """Convert records back into the searching_users.json dict."""
+    return {str(user_id): record.to_dict() for user_id, record in records.items()}
+
+def chats_from_json(data: Dict[str, Any]) -> Dict[int, int]:
+    """Convert the active_chats.json dict into an int -> int partner map."""
+    # Older files stored partners as strings, newer ones as numbers
+    return {int(user_id): int(partner_id) for user_id, partner_id in data.items()}
+
+def chats_to_json(chats: Dict[int, int]) -> Dict[str, int]:
+    """Convert an int -> int partner map back into the active_chats.json dict."""
+    return {str(user_id): partner_id for user_id, partner_id in chats.items()}
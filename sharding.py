@@ -0,0 +1,384 @@
+import os
+import json
+import asyncio
+import logging
+import tempfile
+import itertools
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+# Sharded deployment settings
+NUM_WORKERS = int(os.environ.get("BOT_WORKERS", "1"))
+SOCKET_DIR = os.environ.get("BOT_SOCKET_DIR", os.path.join(tempfile.gettempdir(), "dox-bot"))
+COORDINATOR_SOCKET = os.path.join(SOCKET_DIR, "coordinator.sock")
+
+# Telegram updates with large captions can exceed asyncio's default 64KB line limit
+FRAME_LIMIT = 4 * 1024 * 1024
+
+# Update fields that carry the sending user, in the order we check them
+USER_UPDATE_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query",
+    "chosen_inline_result", "shipping_query", "pre_checkout_query",
+    "poll_answer", "my_chat_member", "chat_member", "chat_join_request",
+)
+
+def worker_socket(shard: int) -> str:
+    """Path of the Unix socket a worker listens on for routed updates."""
+    return os.path.join(SOCKET_DIR, f"worker-{shard}.sock")
+
+def shard_for(user_id: Any, num_shards: int) -> int:
+    """Return the shard that owns a user ID."""
+    if num_shards <= 1 or user_id is None:
+        return 0
+    # Knuth multiplicative hash so that sequential Telegram IDs spread evenly
+    return ((int(user_id) * 2654435761) & 0xFFFFFFFF) % num_shards
+
+def extract_user_id(update_data: Dict[str, Any]) -> Optional[int]:
+    """Find the user ID in a raw update dict."""
+    for field in USER_UPDATE_FIELDS:
+        obj = update_data.get(field)
+        if not obj:
+            continue
+        user = obj.get("from") or obj.get("user")
+        if user:
+            return user.get("id")
+        chat = obj.get("chat")
+        if chat:
+            return chat.get("id")
+    return None
+
+async def write_frame(writer: asyncio.StreamWriter, frame: Dict[str, Any]) -> None:
+    """Send one newline-delimited JSON frame."""
+    writer.write(json.dumps(frame, ensure_ascii=False).encode("utf-8") + b"\n")
+    await writer.drain()
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    """Read one frame, or None when the peer closed the connection."""
+    line = await reader.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+class ReplicatedDict(dict):
+    """Dict whose writes are published to the coordinator and mirrored by every worker."""
+
+    def __init__(self, name: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = name
+        self.client: Optional["CoordinatorClient"] = None
+        # Called with the key after a write from another worker was applied
+        self.on_remote_change: Optional[Callable[[Any], None]] = None
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._publish({"op": "set", "table": self.name, "key": key, "value": value})
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._publish({"op": "del", "table": self.name, "key": key})
+
+    def pop(self, key, *default):
+        present = key in self
+        value = super().pop(key, *default)
+        if present:
+            self._publish({"op": "del", "table": self.name, "key": key})
+        return value
+
+    def apply_set(self, key, value) -> None:
+        """Apply a replicated write without publishing it again."""
+        super().__setitem__(key, value)
+        if self.on_remote_change is not None:
+            self.on_remote_change(key)
+
+    def apply_del(self, key) -> None:
+        """Apply a replicated delete without publishing it again."""
+        super().pop(key, None)
+        if self.on_remote_change is not None:
+            self.on_remote_change(key)
+
+    def _publish(self, frame: Dict[str, Any]) -> None:
+        if self.client is not None:
+            self.client.publish(frame)
+
+class Coordinator:
+    """Owns shared matchmaking and group state for all workers."""
+
+    TABLES = ("active_chats", "searching_users", "group_chats", "blocked_chats", "blocked_media", "bans", "reports", "rating_tokens")
+
+    def __init__(self, path: str = COORDINATOR_SOCKET):
+        self.path = path
+        self.state: Dict[str, Dict[Any, Any]] = {name: {} for name in self.TABLES}
+        self.workers: Dict[int, asyncio.StreamWriter] = {}
+
+    async def serve(self) -> None:
+        """Listen for worker connections until cancelled."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._handle, path=self.path, limit=FRAME_LIMIT)
+        logger.info(f"Coordinator listening on {self.path}")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        shard = None
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                op = frame.get("op")
+
+                if op == "hello":
+                    shard = frame["shard"]
+                    self.workers[shard] = writer
+                    logger.info(f"Worker {shard} connected to coordinator")
+                    # Send the full state as key/value lists so int keys survive JSON
+                    snapshot = {name: list(table.items()) for name, table in self.state.items()}
+                    await write_frame(writer, {"op": "snapshot", "state": snapshot})
+
+                elif op == "set":
+                    self.state[frame["table"]][frame["key"]] = frame["value"]
+                    await self._broadcast(frame, exclude=shard)
+
+                elif op == "del":
+                    if self.state[frame["table"]].pop(frame["key"], None) is not None:
+                        await self._broadcast(frame, exclude=shard)
+
+                elif op == "claim":
+                    # Atomically take two searchers out of the queue; only one worker can win
+                    searching = self.state["searching_users"]
+                    users = frame["users"]
+                    ok = all(user in searching for user in users)
+                    if ok:
+                        for user in users:
+                            del searching[user]
+                            await self._broadcast({"op": "del", "table": "searching_users", "key": user}, exclude=shard)
+                    await write_frame(writer, {"op": "reply", "id": frame["id"], "ok": ok})
+
+                elif op == "forward":
+                    target = self.workers.get(frame["shard"])
+                    if target is None:
+                        logger.warning(f"Dropping forwarded frame for offline worker {frame['shard']}")
+                    else:
+                        await write_frame(target, frame)
+
+                else:
+                    logger.warning(f"Unknown coordinator op: {op}")
+        except Exception as e:
+            logger.error(f"Error in coordinator connection for worker {shard}: {e}")
+        finally:
+            if shard is not None and self.workers.get(shard) is writer:
+                del self.workers[shard]
+                logger.info(f"Worker {shard} disconnected from coordinator")
+            writer.close()
+
+    async def _broadcast(self, frame: Dict[str, Any], exclude: Optional[int] = None) -> None:
+        for shard, writer in list(self.workers.items()):
+            if shard == exclude:
+                continue
+            try:
+                await write_frame(writer, frame)
+            except Exception as e:
+                logger.error(f"Error broadcasting to worker {shard}: {e}")
+
+class CoordinatorClient:
+    """Worker-side connection to the coordinator."""
+
+    def __init__(self, shard: int, num_shards: int, path: str = COORDINATOR_SOCKET):
+        self.shard = shard
+        self.num_shards = num_shards
+        self.path = path
+        self.tables: Dict[str, ReplicatedDict] = {}
+        self.handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]] = {}
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.ids = itertools.count(1)
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reader_task: Optional[asyncio.Task] = None
+
+    async def connect(self, tables: Dict[str, ReplicatedDict], retries: int = 50) -> None:
+        """Connect, publish local state and load the shared snapshot."""
+        for attempt in range(retries):
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.path, limit=FRAME_LIMIT)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # Coordinator may still be starting up
+                await asyncio.sleep(0.2)
+        else:
+            raise ConnectionError(f"Coordinator is not reachable at {self.path}")
+
+        self.tables = tables
+        await write_frame(self.writer, {"op": "hello", "shard": self.shard})
+
+        # The snapshot is the first frame the coordinator sends back
+        frame = await read_frame(self.reader)
+        local_state = {name: dict(table) for name, table in tables.items()}
+        for name, items in frame["state"].items():
+            table = tables.get(name)
+            if table is None:
+                continue
+            for key, value in items:
+                table.apply_set(key, value)
+
+        # Publish whatever this worker restored from its own data directory
+        for name, table in tables.items():
+            table.client = self
+            for key, value in local_state[name].items():
+                self.publish({"op": "set", "table": name, "key": key, "value": value})
+
+        self.reader_task = asyncio.create_task(self._read_loop())
+        logger.info(f"Worker {self.shard} synced with coordinator")
+
+    def publish(self, frame: Dict[str, Any]) -> None:
+        """Queue a frame for the coordinator; stream order keeps writes ordered."""
+        if self.writer is None or self.writer.is_closing():
+            logger.error(f"Coordinator connection lost, dropping {frame.get('op')} frame")
+            return
+        self.writer.write(json.dumps(frame, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    async def claim_pair(self, user_id: Any, partner_id: Any) -> bool:
+        """Ask the coordinator to atomically remove both users from the search queue."""
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.publish({"op": "claim", "id": request_id, "users": [user_id, partner_id]})
+        try:
+            return await asyncio.wait_for(future, timeout=5)
+        except asyncio.TimeoutError:
+            logger.error(f"Coordinator did not answer claim for {user_id} and {partner_id}")
+            return False
+        finally:
+            self.pending.pop(request_id, None)
+
+    def owns(self, user_id: Any) -> bool:
+        """Check if this worker owns the user."""
+        return shard_for(user_id, self.num_shards) == self.shard
+
+    def forward(self, user_id: Any, kind: str, payload: Dict[str, Any]) -> None:
+        """Send an operation to the worker that owns the user."""
+        self.publish({
+            "op": "forward",
+            "shard": shard_for(user_id, self.num_shards),
+            "kind": kind,
+            "user_id": user_id,
+            "payload": payload,
+        })
+
+    def on_forward(self, kind: str, handler: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        """Register a handler for operations forwarded to this worker."""
+        self.handlers[kind] = handler
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                frame = await read_frame(self.reader)
+                if frame is None:
+                    logger.error("Coordinator closed the connection")
+                    break
+                op = frame.get("op")
+                if op == "set":
+                    self.tables[frame["table"]].apply_set(frame["key"], frame["value"])
+                elif op == "del":
+                    self.tables[frame["table"]].apply_del(frame["key"])
+                elif op == "reply":
+                    future = self.pending.get(frame["id"])
+                    if future and not future.done():
+                        future.set_result(frame["ok"])
+                elif op == "forward":
+                    handler = self.handlers.get(frame["kind"])
+                    if handler is None:
+                        logger.warning(f"No handler for forwarded op {frame['kind']}")
+                        continue
+                    try:
+                        await handler(frame)
+                    except Exception as e:
+                        logger.error(f"Error handling forwarded op {frame['kind']}: {e}")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error in coordinator read loop: {e}")
+
+    async def close(self) -> None:
+        if self.reader_task:
+            self.reader_task.cancel()
+        if self.writer:
+            self.writer.close()
+
+async def serve_worker_updates(shard: int, on_update: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+    """Accept routed updates from the front process and pass them to the worker."""
+    path = worker_socket(shard)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                await on_update(frame)
+        except Exception as e:
+            logger.error(f"Error reading routed updates on worker {shard}: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_unix_server(handle, path=path, limit=FRAME_LIMIT)
+    logger.info(f"Worker {shard} listening on {path}")
+    async with server:
+        await server.serve_forever()
+
+async def run_front(bot, num_workers: int, allowed_updates=None) -> None:
+    """Long-poll Telegram and route each update to the worker owning its user."""
+    writers: Dict[int, asyncio.StreamWriter] = {}
+
+    async def get_writer(shard: int) -> asyncio.StreamWriter:
+        writer = writers.get(shard)
+        if writer is not None and not writer.is_closing():
+            return writer
+        for attempt in range(50):
+            try:
+                _, writer = await asyncio.open_unix_connection(worker_socket(shard), limit=FRAME_LIMIT)
+                writers[shard] = writer
+                return writer
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(0.2)
+        raise ConnectionError(f"Worker {shard} is not reachable")
+
+    await bot.initialize()
+    # Keep updates sent during a deploy, as the single-process bot does
+    await bot.delete_webhook(drop_pending_updates=False)
+    logger.info(f"Front process routing updates to {num_workers} workers")
+
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.error(f"Error polling updates: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        for update in updates:
+            offset = update.update_id + 1
+            data = update.to_dict()
+            shard = shard_for(extract_user_id(data), num_workers)
+            try:
+                await write_frame(await get_writer(shard), data)
+            except Exception as e:
+                logger.error(f"Error routing update {update.update_id} to worker {shard}: {e}")
+                writers.pop(shard, None)
+
+def run_coordinator(path: str = COORDINATOR_SOCKET) -> None:
+    """Process entry point for the coordinator."""
+    logging.basicConfig(
+        format="%(asctime)s - coordinator - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO
+    )
+    try:
+        asyncio.run(Coordinator(path).serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,264 @@
+import os
+import json
+import struct
+import logging
+import argparse
+from typing import Dict, Any, List, Optional
+
+from records import UserProfile, SearchEntry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Snapshots hold the whole bot state:
+#   {"users": {user_id: profile}, "active_chats": {user_id: partner_id},
+#    "searching_users": {user_id: entry}}
+# and are stored either as JSON or in a compact binary layout:
+#   header, string table, users, chats, searches
+# Strings (avatar paths, join dates, unusual values) are stored once in the
+# string table and referenced by index from fixed-size records.
+
+BINARY_MAGIC = b"DXSN"
+BINARY_VERSION = 1
+HEADER = struct.Struct("<4sHxxIIII")  # magic, version, strings, users, chats, searches
+STRING_LEN = struct.Struct("<I")
+USER = struct.Struct("<qHBxhIIIiIiii")  # id, present, gender, age, interests, chat_count, total_chats, rating, rating_count, avatar, join_date, extra
+CHAT = struct.Struct("<qq")
+SEARCH = struct.Struct("<qBBhdqqi")  # id, present, gender, age, start_time, message_id, chat_id, extra
+NO_STRING = -1
+NO_AGE = -1
+
+FORMATS = ("json", "binary")
+
+def json_dumps(obj: Any) -> bytes:
+    """Compact JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def json_loads(data: bytes) -> Any:
+    """Parse JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class StringTable:
+    """Interns strings while encoding a binary snapshot."""
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self.indexes: Dict[str, int] = {}
+
+    def add(self, value: Optional[str]) -> int:
+        if value is None:
+            return NO_STRING
+        index = self.indexes.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(value)
+            self.indexes[value] = index
+        return index
+
+    def add_extra(self, extra: Optional[Dict[str, Any]]) -> int:
+        if not extra:
+            return NO_STRING
+        return self.add(json_dumps(extra).decode("utf-8"))
+
+def _to_record(cls, user_id: int, data: Dict[str, Any]):
+    """Build a record; an age equal to NO_AGE would read back as missing, so it goes to extra."""
+    record = cls.from_dict(user_id, data)
+    if record.age == NO_AGE:
+        record = cls.from_dict(user_id, {key: value for key, value in data.items() if key != "age"})
+        record.extra = dict(record.extra or {}, age=data["age"])
+    return record
+
+def _encode_user(user_id: int, profile: Dict[str, Any], strings: StringTable) -> bytes:
+    record = _to_record(UserProfile, user_id, profile)
+    try:
+        return USER.pack(
+            record.user_id, record.present, record.gender,
+            NO_AGE if record.age is None else record.age,
+            record.interests, record.chat_count, record.total_chats,
+            record.rating, record.rating_count,
+            strings.add(record.avatar), strings.add(record.join_date),
+            strings.add_extra(record.extra)
+        )
+    except struct.error:
+        # Values too large for the fixed layout; keep the whole profile as JSON
+        return USER.pack(record.user_id, 0, 0, NO_AGE, 0, 0, 0, 0, 0,
+                         NO_STRING, NO_STRING, strings.add_extra(profile))
+
+def _decode_user(fields: tuple, strings: List[str]) -> Dict[str, Any]:
+    (user_id, present, gender, age, interests, chat_count, total_chats,
+     rating, rating_count, avatar, join_date, extra) = fields
+    record = UserProfile(user_id)
+    record.present = present
+    record.gender = gender
+    record.age = None if age == NO_AGE else age
+    record.interests = interests
+    record.chat_count = chat_count
+    record.total_chats = total_chats
+    record.rating = rating
+    record.rating_count = rating_count
+    record.avatar = None if avatar == NO_STRING else strings[avatar]
+    record.join_date = None if join_date == NO_STRING else strings[join_date]
+    if extra != NO_STRING:
+        record.extra = json_loads(strings[extra])
+    return record.to_dict()
+
+def _encode_search(user_id: int, entry: Dict[str, Any], strings: StringTable) -> bytes:
+    record = _to_record(SearchEntry, user_id, entry)
+    try:
+        return SEARCH.pack(
+            record.user_id, record.present, record.gender,
+            NO_AGE if record.age is None else record.age,
+            record.start_time, record.message_id, record.chat_id,
+            strings.add_extra(record.extra)
+        )
+    except struct.error:
+        return SEARCH.pack(record.user_id, 0, 0, NO_AGE, 0.0, 0, 0, strings.add_extra(entry))
+
+def _decode_search(fields: tuple, strings: List[str]) -> Dict[str, Any]:
+    user_id, present, gender, age, start_time, message_id, chat_id, extra = fields
+    record = SearchEntry(user_id)
+    record.present = present
+    record.gender = gender
+    record.age = None if age == NO_AGE else age
+    record.start_time = start_time
+    record.message_id = message_id
+    record.chat_id = chat_id
+    if extra != NO_STRING:
+        record.extra = json_loads(strings[extra])
+    return record.to_dict()
+
+def encode_binary(state: Dict[str, Dict[int, Any]]) -> bytes:
+    """Encode a state dict into the binary snapshot layout."""
+    strings = StringTable()
+    users = state.get("users", {})
+    chats = state.get("active_chats", {})
+    searches = state.get("searching_users", {})
+
+    body = bytearray()
+    for user_id, profile in users.items():
+        body += _encode_user(int(user_id), profile, strings)
+    for user_id, partner_id in chats.items():
+        body += CHAT.pack(int(user_id), int(partner_id))
+    for user_id, entry in searches.items():
+        body += _encode_search(int(user_id), entry, strings)
+
+    out = bytearray(HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(strings.strings),
+                                len(users), len(chats), len(searches)))
+    for value in strings.strings:
+        encoded = value.encode("utf-8")
+        out += STRING_LEN.pack(len(encoded))
+        out += encoded
+    out += body
+    return bytes(out)
+
+def decode_binary(data: bytes) -> Dict[str, Dict[int, Any]]:
+    """Decode a binary snapshot into a state dict keyed by integer user IDs."""
+    magic, version, string_count, user_count, chat_count, search_count = HEADER.unpack_from(data, 0)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError("Not a binary snapshot")
+    offset = HEADER.size
+
+    view = memoryview(data)
+    strings = []
+    for _ in range(string_count):
+        (length,) = STRING_LEN.unpack_from(data, offset)
+        offset += STRING_LEN.size
+        strings.append(str(view[offset:offset + length], "utf-8"))
+        offset += length
+
+    users = {}
+    for fields in USER.iter_unpack(view[offset:offset + user_count * USER.size]):
+        users[fields[0]] = _decode_user(fields, strings)
+    offset += user_count * USER.size
+
+    chats = dict(CHAT.iter_unpack(view[offset:offset + chat_count * CHAT.size]))
+    offset += chat_count * CHAT.size
+
+    searches = {}
+    for fields in SEARCH.iter_unpack(view[offset:offset + search_count * SEARCH.size]):
+        searches[fields[0]] = _decode_search(fields, strings)
+
+    return {"users": users, "active_chats": chats, "searching_users": searches}
+
+def encode_json(state: Dict[str, Dict[int, Any]]) -> bytes:
+    """Encode a state dict as compact JSON."""
+    return json_dumps({
+        name: {str(key): value for key, value in table.items()}
+        for name, table in state.items()
+    })
+
+def decode_json(data: bytes) -> Dict[str, Dict[int, Any]]:
+    """Decode a JSON snapshot into a state dict keyed by integer user IDs."""
+    state = json_loads(data)
+    return {
+        name: {int(key): value for key, value in table.items()}
+        for name, table in state.items()
+    }
+
+def save_snapshot(path: str, state: Dict[str, Dict[int, Any]], fmt: str = "binary") -> None:
+    """Atomically write a snapshot file."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown snapshot format: {fmt}")
+    data = encode_binary(state) if fmt == "binary" else encode_json(state)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def load_snapshot(path: str) -> Dict[str, Dict[int, Any]]:
+    """Read a snapshot file in either format."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(BINARY_MAGIC)] == BINARY_MAGIC:
+        return decode_binary(data)
+    return decode_json(data)
+
+def main() -> None:
+    """Convert, export and import snapshots from the command line."""
+    parser = argparse.ArgumentParser(description="Bot state snapshot tool")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert = commands.add_parser("convert", help="Convert a snapshot between formats")
+    convert.add_argument("source")
+    convert.add_argument("target")
+    convert.add_argument("--format", choices=FORMATS, default="binary")
+
+    export = commands.add_parser("export", help="Write the state from DATA_DIR to a snapshot")
+    export.add_argument("target")
+    export.add_argument("--format", choices=FORMATS, default="binary")
+
+    restore = commands.add_parser("import", help="Load a snapshot into DATA_DIR")
+    restore.add_argument("source")
+
+    args = parser.parse_args()
+    logging.basicConfig(format="%(levelname)s - %(message)s", level=logging.INFO)
+
+    if args.command == "convert":
+        state = load_snapshot(args.source)
+        save_snapshot(args.target, state, args.format)
+        print(f"Converted {len(state.get('users', {}))} users to {args.format}: "
+              f"{os.path.getsize(args.source)} -> {os.path.getsize(args.target)} bytes")
+        return
+
+    import database as db
+    db.init_db()
+    if args.command == "export":
+        db.export_snapshot(args.target, args.format)
+        print(f"Exported state to {args.target} ({os.path.getsize(args.target)} bytes)")
+    else:
+        db.import_snapshot(args.source)
+        print(f"Imported {args.source} into {db.USER_DATA_DIR}")
+    db.close_db()
+
+if __name__ == "__main__":
+    main()
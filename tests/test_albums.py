@@ -0,0 +1,100 @@
+"""An album sent in a chat goes through the application and is relayed as one media group."""
+import os
+import sys
+import json
+import asyncio
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telegram
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import bot
+
+USER_ID, PARTNER_ID = 1001, 1002
+
+class FakeRequest(BaseRequest):
+    """Answers Bot API calls offline and records them."""
+
+    def __init__(self):
+        self.calls = []
+        self.next_message_id = 500
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    def message(self, chat_id: int) -> dict:
+        self.next_message_id += 1
+        return {"message_id": self.next_message_id, "date": 0, "chat": {"id": chat_id, "type": "private"}}
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.calls.append((endpoint, params))
+        if endpoint == "getMe":
+            result = {"id": 42, "is_bot": True, "first_name": "Bot", "username": "test_bot"}
+        elif endpoint == "sendMediaGroup":
+            result = [self.message(params["chat_id"]) for _ in params["media"]]
+        elif endpoint.startswith("send") and endpoint != "sendChatAction":
+            result = self.message(params["chat_id"])
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+def make_update(application: Application, update_id: int, **message) -> telegram.Update:
+    """Decode an update the way updates from Telegram are decoded."""
+    message = dict(message, message_id=update_id, date=int(datetime.datetime.now().timestamp()),
+                   chat={"id": USER_ID, "type": "private"},
+                   **{"from": {"id": USER_ID, "is_bot": False, "first_name": "User"}})
+    return telegram.Update.de_json({"update_id": update_id, "message": message}, application.bot)
+
+def album_part(application: Application, update_id: int, file_id: str, **extra) -> telegram.Update:
+    photo = [{"file_id": file_id, "file_unique_id": file_id + "-unique", "width": 90, "height": 90}]
+    return make_update(application, update_id, photo=photo, media_group_id="album-1", **extra)
+
+async def enter_chat(update: telegram.Update, context) -> int:
+    # Matching happens on timers, so the test starts the conversation in a chat
+    return bot.CHATTING
+
+def test_album_is_relayed_through_the_application(monkeypatch):
+    request = FakeRequest()
+    builder = Application.builder
+    monkeypatch.setattr(Application, "builder", staticmethod(lambda: builder().request(request)))
+    monkeypatch.setattr(bot, "start", enter_chat)
+    monkeypatch.setattr(bot, "active_chats", {USER_ID: PARTNER_ID, PARTNER_ID: USER_ID})
+    monkeypatch.setattr(bot, "album_collector", bot.albums.AlbumCollector(bot.wheel))
+
+    async def run() -> None:
+        application = bot.build_application("123:TEST", with_updater=False)
+        await application.initialize()
+        try:
+            start = make_update(application, 1, text="/start",
+                                entities=[{"type": "bot_command", "offset": 0, "length": 6}])
+            await application.process_update(start)
+            await application.process_update(album_part(application, 2, "photo-1", caption="caption"))
+            await application.process_update(album_part(application, 3, "photo-2"))
+
+            assert [message.message_id for message in bot.album_collector.pending["album-1"]["messages"]] == [2, 3]
+            await bot.album_collector.flush("album-1")
+        finally:
+            await application.shutdown()
+
+    asyncio.run(run())
+
+    groups = [params for endpoint, params in request.calls if endpoint == "sendMediaGroup"]
+    assert len(groups) == 1
+    assert groups[0]["chat_id"] == PARTNER_ID
+    media = groups[0]["media"]
+    assert [item["media"] for item in media] == ["photo-1", "photo-2"]
+    assert media[0]["caption"] == "caption"
+    # Both copies are remembered, so edits and replies reach the partner
+    assert bot.message_map.lookup(USER_ID, 3) is not None
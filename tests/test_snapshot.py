@@ -0,0 +1,23 @@
+"""Binary snapshots read back exactly what was written."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot
+
+def test_binary_round_trip_keeps_edge_values():
+    state = {
+        "users": {
+            1: {"gender": "male", "age": 25, "interests": ["chat"], "rating": 3},
+            2: {"age": snapshot.NO_AGE},
+            3: {"age": None, "gender": None},
+            4: {"gender": ["male"], "rating": 2 ** 40},
+        },
+        "active_chats": {1: 3, 3: 1},
+        "searching_users": {
+            2: {"start_time": 1.5, "message_id": 7, "chat_id": 2, "age": snapshot.NO_AGE},
+            5: {"start_time": 2.0, "gender": "female", "age": None, "interests": 1},
+        },
+    }
+    assert snapshot.decode_binary(snapshot.encode_binary(state)) == state
@@ -0,0 +1,56 @@
+"""Early search stops are censored samples and don't lock a bucket out for good."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot
+import matchmaking
+import waitstats
+
+NOW = 1000000.0
+
+def test_censored_sample_follows_longer_searches():
+    sketch = waitstats.WaitSketch()
+    sketch.updated = NOW
+    for _ in range(3):
+        sketch.add(100, timed_out=True, now=NOW)
+    sketch.add(50, now=NOW)
+    sketch.add(2, now=NOW)
+
+    # Of the searches that lasted past 20 seconds, three in four timed out
+    sketch.add_censored(20, now=NOW)
+    assert sketch.counts[-1] == pytest.approx(3.75)
+    assert sketch.weight(NOW) == pytest.approx(6)
+
+    # Without longer searches to go by a stop counts as a timeout
+    empty = waitstats.WaitSketch()
+    empty.add_censored(20, now=NOW)
+    assert empty.counts[-1] == 1
+
+def test_bucket_recovers_when_partners_search(monkeypatch):
+    monkeypatch.setattr(bot, "wait_stats", waitstats.WaitEstimator())
+    monkeypatch.setattr(bot, "search_index", matchmaking.SearchIndex())
+
+    for _ in range(10):
+        bot.wait_stats.record("male", 20, 120, timed_out=True)
+    user = {"gender": "male", "age": 20, "start_time": NOW - 10}
+    bot.search_index.add(1, user)
+
+    # Alone in the queue: the search is stopped and recorded as censored
+    assert bot.search_looks_hopeless(1, user)
+    bot.wait_stats.record_stopped("male", 20, 10)
+    assert bot.wait_stats.likely_timeout("male", 20)
+
+    # Someone to match with is searching, so the search goes on and matches
+    bot.search_index.add(2, {"gender": "female", "age": 21, "start_time": NOW})
+    assert not bot.search_looks_hopeless(1, user)
+
+    # The matches it gets bring the bucket back
+    for _ in range(5):
+        bot.wait_stats.record("male", 20, 10)
+    assert not bot.wait_stats.likely_timeout("male", 20)
+    bot.search_index.remove(2)
+    assert not bot.search_looks_hopeless(1, user)
@@ -0,0 +1,141 @@
+import time
+import asyncio
+import inspect
+import logging
+from typing import Callable, Optional, List, Set
+
+logger = logging.getLogger(__name__)
+
+class Timer:
+    """Handle for a scheduled callback."""
+
+    __slots__ = ("deadline", "callback", "args", "bucket", "cancelled")
+
+    def __init__(self, deadline: int, callback: Callable, args: tuple):
+        self.deadline = deadline  # in ticks
+        self.callback = callback
+        self.args = args
+        self.bucket: Optional[Set["Timer"]] = None
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """Cancel the timer; O(1)."""
+        self.cancelled = True
+        if self.bucket is not None:
+            self.bucket.discard(self)
+            self.bucket = None
+
+class TimingWheel:
+    """Hierarchical timing wheel driven by a single task.
+
+    Level 0 has `slots` buckets of one tick each, level 1 has `slots` buckets
+    of `slots` ticks each, and so on. Arming and cancelling a timer is O(1);
+    timers on higher levels are moved down as the wheel turns.
+    """
+
+    def __init__(self, tick: float = 0.1, slots: int = 64, levels: int = 4,
+                 clock: Callable[[], float] = time.monotonic):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.clock = clock
+        self.wheels: List[List[Set[Timer]]] = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.current = int(clock() / tick)
+        self.task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for wheel in self.wheels for bucket in wheel)
+
+    def call_later(self, delay: float, callback: Callable, *args) -> Timer:
+        """Run `callback(*args)` after `delay` seconds. Coroutine functions run as tasks."""
+        # Count from the real clock so a wheel that is behind doesn't shorten delays
+        now = max(self.current, int(self.clock() / self.tick))
+        deadline = now + max(1, int(round(delay / self.tick)))
+        timer = Timer(deadline, callback, args)
+        self._insert(timer)
+        return timer
+
+    def _insert(self, timer: Timer) -> None:
+        remaining = timer.deadline - self.current
+        if remaining <= 0:
+            # Already due; fire on the next tick
+            remaining = 1
+            timer.deadline = self.current + 1
+
+        span = 1
+        for level in range(self.levels):
+            if remaining < span * self.slots or level == self.levels - 1:
+                slot = (timer.deadline // span) % self.slots
+                bucket = self.wheels[level][slot]
+                bucket.add(timer)
+                timer.bucket = bucket
+                return
+            span *= self.slots
+
+    def advance_to(self, now: float) -> None:
+        """Fire every timer due at or before `now` (in clock seconds)."""
+        target = int(now / self.tick)
+        while self.current < target:
+            self.current += 1
+            self._cascade()
+            bucket = self.wheels[0][self.current % self.slots]
+            if not bucket:
+                continue
+            due = [timer for timer in bucket if timer.deadline <= self.current]
+            for timer in due:
+                bucket.discard(timer)
+                timer.bucket = None
+            for timer in due:
+                if not timer.cancelled:
+                    self._fire(timer)
+
+    def _cascade(self) -> None:
+        """Move timers from higher levels down when their slot comes up."""
+        span = 1
+        for level in range(1, self.levels):
+            span *= self.slots
+            if self.current % span:
+                break
+            bucket = self.wheels[level][(self.current // span) % self.slots]
+            timers = list(bucket)
+            bucket.clear()
+            for timer in timers:
+                timer.bucket = None
+                self._insert(timer)
+
+    def _fire(self, timer: Timer) -> None:
+        try:
+            result = timer.callback(*timer.args)
+            if inspect.isawaitable(result):
+                asyncio.ensure_future(result)
+        except Exception as e:
+            logger.error(f"Error in timer callback {getattr(timer.callback, '__name__', timer.callback)}: {e}")
+
+    def sleep(self, delay: float) -> "asyncio.Future":
+        """Future that resolves after `delay` seconds, without a sleeping task per caller."""
+        future = asyncio.get_running_loop().create_future()
+
+        def wake() -> None:
+            if not future.done():
+                future.set_result(None)
+
+        timer = self.call_later(delay, wake)
+        future.add_done_callback(lambda _: timer.cancel())
+        return future
+
+    async def run(self) -> None:
+        """Drive the wheel from the clock until cancelled."""
+        while True:
+            await asyncio.sleep(self.tick)
+            self.advance_to(self.clock())
+
+    def start(self) -> asyncio.Task:
+        if self.task is None or self.task.done():
+            # Timers armed before the start fire on the first turn if overdue
+            self.task = asyncio.create_task(self.run())
+        return self.task
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
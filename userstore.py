@@ -0,0 +1,275 @@
+import os
+import mmap
+import struct
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Iterator, Tuple
+
+from snapshot import json_dumps, json_loads
+
+logger = logging.getLogger(__name__)
+
+# Index file layout:
+#   header: magic, version, entry count, size of the data file the index covers
+#   entries: (user_id, offset, length) sorted by user_id
+INDEX_MAGIC = b"DXIX"
+INDEX_VERSION = 1
+HEADER = struct.Struct("<4sIQQ")
+ENTRY = struct.Struct("<qQI")
+
+class UserStore:
+    """User profiles in an append-only data file with a memory-mapped offset index.
+
+    Opening the store only maps the index; profiles are parsed on first access
+    and kept in a bounded LRU cache. Changed profiles are written back when
+    they are evicted, when too many are dirty, or on flush().
+    """
+
+    def __init__(self, data_dir: str, cache_size: int = 100000, dirty_limit: int = 100):
+        self.data_path = os.path.join(data_dir, "users.dat")
+        self.index_path = os.path.join(data_dir, "users.idx")
+        self.cache_size = cache_size
+        self.dirty_limit = dirty_limit
+
+        self.cache: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self.dirty = set()
+        # Records appended since the index was last rewritten: user_id -> (offset, length)
+        self.overlay: Dict[int, Tuple[int, int]] = {}
+        self.unflushed = False
+
+        self.index_map: Optional[mmap.mmap] = None
+        self.index_count = 0
+        self.index_data_end = 0
+
+        os.makedirs(data_dir, exist_ok=True)
+        self.data_file = open(self.data_path, "ab")
+        self.data_fd = os.open(self.data_path, os.O_RDONLY)
+        self._map_index()
+        self._recover_tail()
+
+    def _map_index(self) -> None:
+        if self.index_map is not None:
+            self.index_map.close()
+            self.index_map = None
+        self.index_count = 0
+        self.index_data_end = 0
+
+        if not os.path.exists(self.index_path) or os.path.getsize(self.index_path) < HEADER.size:
+            return
+        with open(self.index_path, "rb") as f:
+            self.index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, data_end = HEADER.unpack_from(self.index_map, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            logger.error(f"Unsupported user index {self.index_path}, rebuilding from data file")
+            self.index_map.close()
+            self.index_map = None
+            return
+        self.index_count = count
+        self.index_data_end = data_end
+
+    def _recover_tail(self) -> None:
+        """Index records appended after the index was last written (e.g. after a crash)."""
+        data_size = os.path.getsize(self.data_path)
+        offset = self.index_data_end
+        if offset >= data_size:
+            return
+
+        recovered = 0
+        with open(self.data_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Torn write at the end of the file; drop it
+                    logger.warning(f"Truncating incomplete user record at offset {offset}")
+                    self.data_file.truncate(offset)
+                    break
+                try:
+                    user_id = json_loads(line)["id"]
+                except Exception as e:
+                    logger.error(f"Skipping unreadable user record at offset {offset}: {e}")
+                else:
+                    self.overlay[user_id] = (offset, len(line))
+                    recovered += 1
+                offset += len(line)
+
+        if recovered:
+            logger.info(f"Recovered {recovered} user records written after the last index")
+
+    def _lookup(self, user_id: int) -> Optional[Tuple[int, int]]:
+        location = self.overlay.get(user_id)
+        if location is not None:
+            return location
+        return self._search_index(user_id)
+
+    def _search_index(self, user_id: int) -> Optional[Tuple[int, int]]:
+        # Binary search over the mapped index
+        low, high = 0, self.index_count - 1
+        while low <= high:
+            middle = (low + high) // 2
+            key, offset, length = ENTRY.unpack_from(self.index_map, HEADER.size + middle * ENTRY.size)
+            if key < user_id:
+                low = middle + 1
+            elif key > user_id:
+                high = middle - 1
+            else:
+                return offset, length
+        return None
+
+    def _read(self, location: Tuple[int, int]) -> Dict[str, Any]:
+        if self.unflushed:
+            self.data_file.flush()
+            self.unflushed = False
+        offset, length = location
+        return json_loads(os.pread(self.data_fd, length, offset))["data"]
+
+    def _append(self, user_id: int, data: Dict[str, Any]) -> None:
+        line = json_dumps({"id": user_id, "data": data}) + b"\n"
+        self.data_file.seek(0, os.SEEK_END)
+        offset = self.data_file.tell()
+        self.data_file.write(line)
+        self.overlay[user_id] = (offset, len(line))
+        self.unflushed = True
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Return the profile, loading it from disk on first access."""
+        data = self.cache.get(user_id)
+        if data is not None:
+            self.cache.move_to_end(user_id)
+            return data
+
+        location = self._lookup(user_id)
+        if location is None:
+            return None
+        data = self._read(location)
+        self._cache(user_id, data)
+        return data
+
+    def put(self, user_id: int, data: Dict[str, Any]) -> None:
+        """Store a profile; it is written back to disk later."""
+        self._cache(user_id, data)
+        self.dirty.add(user_id)
+        if len(self.dirty) >= self.dirty_limit:
+            self.write_back()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.cache or self._lookup(user_id) is not None
+
+    def __len__(self) -> int:
+        new_users = sum(
+            1 for user_id in set(self.overlay) | self.dirty
+            if self._search_index(user_id) is None
+        )
+        return self.index_count + new_users
+
+    def _cache(self, user_id: int, data: Dict[str, Any]) -> None:
+        self.cache[user_id] = data
+        self.cache.move_to_end(user_id)
+        while len(self.cache) > self.cache_size:
+            evicted_id, evicted = self.cache.popitem(last=False)
+            if evicted_id in self.dirty:
+                self.dirty.discard(evicted_id)
+                self._append(evicted_id, evicted)
+
+    def write_back(self) -> None:
+        """Append all dirty profiles to the data file."""
+        if not self.dirty:
+            return
+        for user_id in self.dirty:
+            self._append(user_id, self.cache[user_id])
+        self.dirty.clear()
+        self.data_file.flush()
+        self.unflushed = False
+
+    def flush(self, rewrite_index: bool = False) -> None:
+        """Write back dirty profiles and fold appended records into the index.
+
+        The index is only rewritten once enough records were appended since the
+        last rewrite; the rest are re-indexed from the data file tail on open.
+        """
+        self.write_back()
+        self.data_file.flush()
+        os.fsync(self.data_file.fileno())
+        if self.overlay and (rewrite_index or len(self.overlay) >= max(1000, self.index_count // 10)):
+            self._rewrite_index()
+
+    def iter_locations(self) -> Iterator[Tuple[int, Tuple[int, int]]]:
+        """Yield (user_id, location) for every stored profile, sorted by user ID."""
+        overlay = self.overlay
+        indexed = (
+            ENTRY.unpack_from(self.index_map, HEADER.size + i * ENTRY.size)
+            for i in range(self.index_count)
+        )
+        pending = sorted(overlay.items())
+        p = 0
+        for key, offset, length in indexed:
+            while p < len(pending) and pending[p][0] < key:
+                yield pending[p]
+                p += 1
+            if p < len(pending) and pending[p][0] == key:
+                yield pending[p]
+                p += 1
+            else:
+                yield key, (offset, length)
+        yield from pending[p:]
+
+    def items(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Yield every (user_id, profile) without filling the cache."""
+        self.write_back()
+        self.data_file.flush()
+        for user_id, location in self.iter_locations():
+            cached = self.cache.get(user_id)
+            yield user_id, cached if cached is not None else self._read(location)
+
+    def _rewrite_index(self) -> None:
+        entries = list(self.iter_locations())
+        data_end = os.path.getsize(self.data_path)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(entries), data_end))
+            for user_id, (offset, length) in entries:
+                f.write(ENTRY.pack(user_id, offset, length))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+        self.overlay = {}
+        self._map_index()
+        logger.info(f"Rewrote user index with {len(entries)} entries")
+
+    def compact(self) -> None:
+        """Rewrite the data file with only the latest version of each profile."""
+        self.write_back()
+        self.data_file.flush()
+        tmp_path = self.data_path + ".tmp"
+        entries = []
+        with open(tmp_path, "wb") as out:
+            for user_id, location in self.iter_locations():
+                line = os.pread(self.data_fd, location[1], location[0])
+                entries.append((user_id, (out.tell(), len(line))))
+                out.write(line)
+            out.flush()
+            os.fsync(out.fileno())
+
+        self.data_file.close()
+        os.close(self.data_fd)
+        os.replace(tmp_path, self.data_path)
+        self.data_file = open(self.data_path, "ab")
+        self.data_fd = os.open(self.data_path, os.O_RDONLY)
+
+        # Index the compacted file from scratch
+        self.overlay = dict(entries)
+        self.index_count = 0
+        self._rewrite_index()
+
+    def bulk_load(self, profiles: Dict[int, Dict[str, Any]]) -> None:
+        """Append many profiles at once and index them (used for migration)."""
+        for user_id, data in profiles.items():
+            self._append(int(user_id), data)
+        self.flush(rewrite_index=True)
+
+    def close(self) -> None:
+        self.flush(rewrite_index=True)
+        self.data_file.close()
+        os.close(self.data_fd)
+        if self.index_map is not None:
+            self.index_map.close()
+            self.index_map = None
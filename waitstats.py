@@ -0,0 +1,117 @@
+import math
+import time
+from bisect import bisect_right
+from typing import Dict, Optional, Tuple
+
+# Upper edges of the wait-time bins in seconds; one more bin holds timeouts
+WAIT_EDGES = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+# Samples lose half their weight after this long
+WAIT_HALF_LIFE = 1800
+# Decayed sample weight needed before a bucket gives estimates
+WAIT_MIN_SAMPLES = 5
+# Age band boundaries; users without an age get a band of their own
+AGE_BANDS = (18, 25, 35, 50)
+# Searches are ended early when at least this share of similar ones timed out
+EARLY_TIMEOUT_SHARE = 0.8
+
+class WaitSketch:
+    """Time-decayed histogram of search wait times.
+
+    A fixed set of log-spaced bins plus one for timeouts, so memory is
+    constant. Weights decay with WAIT_HALF_LIFE, applied lazily on access.
+    Searches ended early are censored samples: all they say is that the
+    wait was longer, so their weight goes where searches that got as far
+    ended up.
+    """
+
+    __slots__ = ("counts", "updated")
+
+    def __init__(self):
+        self.counts = [0.0] * (len(WAIT_EDGES) + 1)
+        self.updated = 0.0
+
+    def _decay(self, now: float) -> None:
+        if now > self.updated:
+            factor = 0.5 ** ((now - self.updated) / WAIT_HALF_LIFE)
+            self.counts = [count * factor for count in self.counts]
+            self.updated = now
+
+    def add(self, wait: float, timed_out: bool = False, now: Optional[float] = None) -> None:
+        self._decay(now if now is not None else time.time())
+        index = len(WAIT_EDGES) if timed_out else min(bisect_right(WAIT_EDGES, wait), len(WAIT_EDGES) - 1)
+        self.counts[index] += 1
+
+    def add_censored(self, wait: float, now: Optional[float] = None) -> None:
+        """Count a search stopped after `wait` seconds without a match.
+
+        Its weight is spread over the bin of `wait`, the bins above it and
+        the timeout bin in proportion to what they hold; with nothing to go
+        by it counts as a timeout.
+        """
+        self._decay(now if now is not None else time.time())
+        index = min(bisect_right(WAIT_EDGES, wait), len(WAIT_EDGES) - 1)
+        later = sum(self.counts[index:])
+        if not later:
+            self.counts[-1] += 1
+            return
+        for i in range(index, len(self.counts)):
+            self.counts[i] += self.counts[i] / later
+
+    def weight(self, now: Optional[float] = None) -> float:
+        self._decay(now if now is not None else time.time())
+        return sum(self.counts)
+
+    def quantile(self, share: float, now: Optional[float] = None) -> Optional[float]:
+        """Wait time below which `share` of searches matched; inf if they timed out; None without data."""
+        total = self.weight(now)
+        if total < WAIT_MIN_SAMPLES:
+            return None
+        target = share * total
+        seen = 0.0
+        for index, count in enumerate(self.counts[:-1]):
+            if seen + count >= target and count:
+                # Interpolate inside the bin
+                low = WAIT_EDGES[index - 1] if index else 0
+                return low + (WAIT_EDGES[index] - low) * (target - seen) / count
+            seen += count
+        return math.inf
+
+    def timeout_share(self, now: Optional[float] = None) -> Optional[float]:
+        total = self.weight(now)
+        if total < WAIT_MIN_SAMPLES:
+            return None
+        return self.counts[-1] / total
+
+def age_band(age: Optional[int]) -> int:
+    return -1 if age is None else bisect_right(AGE_BANDS, age)
+
+class WaitEstimator:
+    """Wait-time sketches per (gender, age band) of the searching user."""
+
+    def __init__(self):
+        self.sketches: Dict[Tuple[Optional[str], int], WaitSketch] = {}
+
+    def _sketch(self, gender: Optional[str], age: Optional[int]) -> WaitSketch:
+        key = (gender, age_band(age))
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = WaitSketch()
+        return sketch
+
+    def record(self, gender: Optional[str], age: Optional[int], wait: float,
+               timed_out: bool = False, now: Optional[float] = None) -> None:
+        self._sketch(gender, age).add(wait, timed_out, now)
+
+    def record_stopped(self, gender: Optional[str], age: Optional[int], wait: float,
+                       now: Optional[float] = None) -> None:
+        """Record a search ended early, before it matched or timed out."""
+        self._sketch(gender, age).add_censored(wait, now)
+
+    def estimate(self, gender: Optional[str], age: Optional[int], share: float = 0.5,
+                 now: Optional[float] = None) -> Optional[float]:
+        """Typical wait for a user like this (median by default)."""
+        return self._sketch(gender, age).quantile(share, now)
+
+    def likely_timeout(self, gender: Optional[str], age: Optional[int], now: Optional[float] = None) -> bool:
+        share = self._sketch(gender, age).timeout_share(now)
+        return share is not None and share >= EARLY_TIMEOUT_SHARE